@@ -0,0 +1,193 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from pathlib import Path
+
+from flask import request, send_file
+
+PASTAS_ESTATICAS = ('css', 'img')
+COMPRIMIVEIS = {'.css', '.js', '.svg', '.txt', '.json'}
+# Conteúdo em que espaços e quebras de linha são significativos
+_PRESERVADOS = re.compile(r'(<(pre|textarea|script)\b.*?</\2>)', re.IGNORECASE | re.DOTALL)
+_HTML = re.compile(r'<[a-zA-Z!/]')
+
+
+def minifica_template(texto: str) -> str:
+    """
+    Minificação conservadora de um template Jinja2: remove a indentação e as
+    linhas em branco, sem juntar linhas. Não interpreta nem o HTML nem o
+    Jinja2, e portanto não altera o resultado renderizado, exceto pelos
+    espaços. Blocos <pre>, <textarea> e <script> são mantidos intactos
+    """
+    partes = []
+    for numero, trecho in enumerate(_PRESERVADOS.split(texto)):
+        # split com dois grupos devolve: texto, bloco preservado, nome da tag, ...
+        if numero % 3 == 1:
+            partes.append(trecho)
+        elif numero % 3 == 0:
+            partes.append('\n'.join(linha.strip() for linha in trecho.splitlines()
+                                    if linha.strip()))
+    return '\n'.join(parte for parte in partes if parte)
+
+
+def _minifica_css(texto: str) -> str:
+    try:
+        from rcssmin import cssmin
+    except ImportError:  # dependência do Flask-Minify
+        return texto
+    return cssmin(texto)
+
+
+def _comprime(arquivo: Path) -> list[Path]:
+    conteudo = arquivo.read_bytes()
+    variantes = []
+    gz = arquivo.with_name(arquivo.name + '.gz')
+    gz.write_bytes(gzip.compress(conteudo, compresslevel=9, mtime=0))
+    variantes.append(gz)
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        br = arquivo.with_name(arquivo.name + '.br')
+        br.write_bytes(brotli.compress(conteudo, quality=11))
+        variantes.append(br)
+    return variantes
+
+
+class Assets:
+    """
+    Arquivos gerados por 'flask assets build' em instance/ASSETS_BUILD_DIR:
+    templates minificados, que têm precedência sobre os originais, e cópias
+    dos arquivos de static/css e static/img com o hash do conteúdo no nome,
+    acompanhadas das versões .gz e .br. url_for('static', ...) passa a gerar
+    o nome com hash, servido com cache de longa duração (ASSETS_MAX_AGE), e
+    a minificação em tempo de execução (MINIFY) deixa de ser necessária
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.diretorio: Path | None = None
+        self.manifesto: dict[str, str] = {}
+        self._originais: dict[str, str] = {}
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def construido(self) -> bool:
+        return bool(self.manifesto)
+
+    def init_app(self, app):
+        from jinja2 import ChoiceLoader, FileSystemLoader
+
+        self.app = app
+        app.config.setdefault('ASSETS', True)
+        app.config.setdefault('ASSETS_BUILD_DIR', 'build')
+        app.config.setdefault('ASSETS_MAX_AGE', 31536000)
+        app.extensions['assets'] = self
+
+        self.diretorio = Path(app.instance_path) / app.config['ASSETS_BUILD_DIR']
+        self.manifesto = {}
+        arquivo = self.diretorio / 'manifest.json'
+        if not app.config['ASSETS'] or not arquivo.is_file():
+            return
+
+        self.manifesto = json.loads(arquivo.read_text(encoding='utf-8'))
+        self._originais = {gerado: original for original, gerado in self.manifesto.items()}
+        app.jinja_loader = ChoiceLoader([FileSystemLoader(self.diretorio / 'templates'),
+                                         app.jinja_loader])
+        app.url_defaults(self._nome_com_hash)
+        app.view_functions['static'] = self._envia
+        app.logger.info("Usando os arquivos gerados em %s", self.diretorio)
+
+    def _nome_com_hash(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifesto.get(values['filename'], values['filename'])
+
+    def _envia(self, filename: str):
+        if filename not in self._originais:
+            return self.app.send_static_file(filename)
+
+        caminho = self.diretorio / 'static' / filename
+        aceitas = request.accept_encodings
+        for codificacao, extensao in (('br', '.br'), ('gzip', '.gz')):
+            variante = caminho.with_name(caminho.name + extensao)
+            if aceitas[codificacao] and variante.is_file():
+                break
+        else:
+            codificacao, variante = None, caminho
+
+        resposta = send_file(variante,
+                             mimetype=mimetypes.guess_type(caminho.name)[0],
+                             conditional=True,
+                             etag=f"{filename}-{codificacao or 'identity'}",
+                             max_age=self.app.config['ASSETS_MAX_AGE'])
+        if codificacao is not None:
+            resposta.content_encoding = codificacao
+        resposta.vary.add('Accept-Encoding')
+        # O nome muda junto com o conteúdo
+        resposta.cache_control.public = True
+        resposta.cache_control.immutable = True
+        return resposta
+
+    def constroi(self, minificar_css: bool = True) -> dict[str, int]:
+        """Gera os templates minificados, os arquivos com hash e o manifesto."""
+        app = self.app
+        temporario = self.diretorio.with_name(self.diretorio.name + '.tmp')
+        shutil.rmtree(temporario, ignore_errors=True)
+        totais = dict(templates=0, estaticos=0, comprimidos=0, bytes_antes=0, bytes_depois=0)
+
+        origem = Path(app.root_path) / app.template_folder
+        for arquivo in sorted(origem.rglob('*.jinja2')):
+            texto = arquivo.read_text(encoding='utf-8')
+            relativo = arquivo.relative_to(origem)
+            # Os emails são texto puro, em que linhas em branco são conteúdo;
+            # sem cópia minificada, o loader usa o template original
+            if 'email' in relativo.parts or not _HTML.search(texto):
+                continue
+            destino = temporario / 'templates' / relativo
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            minificado = minifica_template(texto)
+            destino.write_text(minificado, encoding='utf-8')
+            totais['templates'] += 1
+            totais['bytes_antes'] += len(texto.encode())
+            totais['bytes_depois'] += len(minificado.encode())
+
+        manifesto = {}
+        estaticos = Path(app.static_folder)
+        for pasta in PASTAS_ESTATICAS:
+            for arquivo in sorted((estaticos / pasta).rglob('*')):
+                if not arquivo.is_file() or arquivo.name.startswith('.'):
+                    continue
+                conteudo = arquivo.read_bytes()
+                if minificar_css and arquivo.suffix == '.css':
+                    conteudo = _minifica_css(conteudo.decode('utf-8')).encode('utf-8')
+                resumo = hashlib.sha256(conteudo).hexdigest()[:12]
+                relativo = arquivo.relative_to(estaticos)
+                gerado = relativo.with_name(f"{arquivo.stem}.{resumo}{arquivo.suffix}")
+                destino = temporario / 'static' / gerado
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                destino.write_bytes(conteudo)
+                manifesto[relativo.as_posix()] = gerado.as_posix()
+                totais['estaticos'] += 1
+                if arquivo.suffix in COMPRIMIVEIS:
+                    totais['comprimidos'] += len(_comprime(destino))
+
+        (temporario / 'manifest.json').write_text(json.dumps(manifesto, indent=2),
+                                                  encoding='utf-8')
+        # O diretório só é substituído com tudo já gerado, para que um servidor
+        # iniciado durante a construção não leia um manifesto incompleto
+        antigo = self.diretorio.with_name(self.diretorio.name + '.old')
+        shutil.rmtree(antigo, ignore_errors=True)
+        if self.diretorio.exists():
+            os.replace(self.diretorio, antigo)
+        os.replace(temporario, self.diretorio)
+        shutil.rmtree(antigo, ignore_errors=True)
+        return totais
+
+    def limpa(self):
+        shutil.rmtree(self.diretorio, ignore_errors=True)
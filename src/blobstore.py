@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+# Assinaturas (magic numbers) dos formatos de imagem aceitos. O tipo MIME é
+# sempre determinado pelo conteúdo, nunca pelo que o cliente informou
+ASSINATURAS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+CHAVE_VALIDA = re.compile(r'^[0-9a-f]{64}$')
+
+
+def detecta_mime(cabecalho: bytes) -> str | None:
+    for assinatura, mime in ASSINATURAS:
+        if cabecalho.startswith(assinatura):
+            return mime
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class BlobStore:
+    """
+    Armazenamento de arquivos endereçado pelo conteúdo. Cada arquivo é
+    gravado uma única vez em <instance>/<BLOBSTORE_DIR>/<aa>/<sha256>, onde
+    'aa' são os dois primeiros caracteres do hash
+    """
+
+    def __init__(self, app=None):
+        self.diretorio: Path | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.diretorio = Path(app.instance_path) / app.config.get('BLOBSTORE_DIR', 'blobs')
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        app.extensions['blobstore'] = self
+
+    def caminho(self, chave: str) -> Path:
+        if not CHAVE_VALIDA.match(chave):
+            raise ValueError(f"Chave inválida para o armazenamento: {chave!r}")
+        return self.diretorio / chave[:2] / chave
+
+    def existe(self, chave: str) -> bool:
+        try:
+            return self.caminho(chave).is_file()
+        except ValueError:
+            return False
+
+    def remove(self, chave: str):
+        try:
+            self.caminho(chave).unlink(missing_ok=True)
+        except ValueError:
+            pass
+
+    def arquivos(self):
+        """Caminhos de todos os blobs, inclusive dos envios interrompidos."""
+        for pasta in self.diretorio.iterdir():
+            if pasta.is_dir() and re.match(r'^[0-9a-f]{2}$', pasta.name):
+                yield from (arquivo for arquivo in pasta.iterdir() if arquivo.is_file())
+            elif pasta.is_file() and pasta.name.startswith('.upload-'):
+                yield pasta
+
+    def mime(self, chave: str) -> str | None:
+        with open(self.caminho(chave), 'rb') as arquivo:
+            return detecta_mime(arquivo.read(16))
+
+    def guarda(self, fluxo: BinaryIO, tamanho_bloco: int = 64 * 1024) -> tuple[str, str | None]:
+        # O conteúdo é copiado em blocos para um arquivo temporário no mesmo
+        # sistema de arquivos enquanto o hash é calculado, e depois movido
+        # atomicamente para o destino. Conteúdos repetidos não são regravados
+        digest = hashlib.sha256()
+        cabecalho = b''
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, prefix='.upload-')
+        try:
+            with os.fdopen(descritor, 'wb') as destino:
+                while bloco := fluxo.read(tamanho_bloco):
+                    if len(cabecalho) < 16:
+                        cabecalho += bloco[:16 - len(cabecalho)]
+                    digest.update(bloco)
+                    destino.write(bloco)
+            chave = digest.hexdigest()
+            final = self.caminho(chave)
+            if final.is_file():
+                os.unlink(temporario)
+                # Renova a data do arquivo, para que 'flask fotos limpar' não
+                # o remova antes que o produto que o referencia seja gravado
+                os.utime(final)
+            else:
+                final.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temporario, final)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.unlink(temporario)
+            raise
+        return chave, detecta_mime(cabecalho)
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable
+
+import sqlalchemy as sa
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy.orm import make_transient_to_detached, object_session
+
+_AUSENTE = object()
+
+# Chave de session.info com os ids dos usuários alterados na transação
+_USUARIOS_ALTERADOS = 'user_cache_alterados'
+
+
+class TTLCache:
+    """
+    Cache em memória, limitado em quantidade de itens (os usados há mais
+    tempo são descartados primeiro) e com tempo de vida por item. Seguro para
+    uso por várias threads do mesmo processo
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._itens: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._trava = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def get(self, chave: Hashable, default: Any = None) -> Any:
+        with self._trava:
+            item = self._itens.get(chave, _AUSENTE)
+            if item is _AUSENTE:
+                return default
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                return default
+            self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave: Hashable, valor: Any, ttl: float | None = None):
+        if self.maxsize <= 0:
+            return
+        expira_em = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._trava:
+            self._itens[chave] = (expira_em, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maxsize:
+                self._itens.popitem(last=False)
+
+    def pop(self, chave: Hashable, default: Any = None) -> Any:
+        with self._trava:
+            item = self._itens.pop(chave, _AUSENTE)
+        return default if item is _AUSENTE else item[1]
+
+    def clear(self):
+        with self._trava:
+            self._itens.clear()
+
+
+class UserLoaderCache:
+    """
+    Cache das instâncias de User usadas pelo user_loader do flask-login.
+    Guarda cópias desanexadas da sessão, que são reanexadas com
+    merge(load=False), sem nenhuma consulta ao banco. Qualquer alteração de
+    um User gravada pelo ORM remove a cópia do cache quando a transação é
+    confirmada (e não no flush: até o commit, uma requisição concorrente
+    ainda lê o registro antigo e o guardaria de novo); com USER_CACHE_SHARED,
+    a remoção também é sinalizada aos demais processos da mesma máquina
+    através da data de modificação de um arquivo em instance/. Alterações
+    feitas por outros meios são percebidas em até USER_CACHE_TTL segundos
+    """
+
+    def __init__(self, app=None):
+        self.cache = TTLCache()
+        self.arquivo: Path | None = None
+        self._geracao = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from src.models.usuario import User
+        from src.modules import db
+
+        self.cache = TTLCache(maxsize=app.config.get('USER_CACHE_SIZE', 1024),
+                              ttl=app.config.get('USER_CACHE_TTL', 30))
+        if app.config.get('USER_CACHE_SHARED', False):
+            self.arquivo = Path(app.instance_path) / app.config.get('USER_CACHE_SHARED_FILE',
+                                                                    'user-cache.generation')
+            self.arquivo.touch(exist_ok=True)
+            self._geracao = self.arquivo.stat().st_mtime_ns
+        if not sa.event.contains(User, 'after_update', self._ao_alterar):
+            sa.event.listen(User, 'after_update', self._ao_alterar)
+            sa.event.listen(User, 'after_delete', self._ao_alterar)
+            sa.event.listen(db.session, 'after_commit', self._ao_confirmar)
+            sa.event.listen(db.session, 'after_rollback', self._ao_desfazer)
+        app.extensions['user_cache'] = self
+
+    # noinspection PyUnusedLocal
+    def _ao_alterar(self, mapper, connection, target):  # pylint: disable=unused-argument
+        sessao = object_session(target)
+        if sessao is None:
+            self.invalida(target.id)
+        else:
+            sessao.info.setdefault(_USUARIOS_ALTERADOS, set()).add(target.id)
+
+    def _ao_confirmar(self, session):
+        for user_id in session.info.pop(_USUARIOS_ALTERADOS, ()):
+            self.invalida(user_id)
+
+    @staticmethod
+    def _ao_desfazer(session):
+        # As alterações desfeitas não chegaram ao banco: as cópias continuam
+        # válidas
+        session.info.pop(_USUARIOS_ALTERADOS, None)
+
+    def invalida(self, user_id=None):
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(user_id)
+        if self.arquivo is not None:
+            os.utime(self.arquivo)
+
+    def _verifica_geracao(self):
+        if self.arquivo is None:
+            return
+        try:
+            geracao = self.arquivo.stat().st_mtime_ns
+        except OSError:
+            return
+        if geracao != self._geracao:
+            self._geracao = geracao
+            self.cache.clear()
+
+    @staticmethod
+    def _copia(usuario):
+        copia = type(usuario)()
+        for atributo in sa.inspect(type(usuario)).column_attrs:
+            setattr(copia, atributo.key, getattr(usuario, atributo.key))
+        make_transient_to_detached(copia)
+        return copia
+
+    def get(self, user_id):
+        from src.models.usuario import User
+        from src.modules import db
+
+        self._verifica_geracao()
+        copia = self.cache.get(user_id)
+        if copia is not None:
+            return db.session.merge(copia, load=False)
+        usuario = db.session.get(User, user_id)
+        if usuario is not None:
+            self.cache.set(user_id, self._copia(usuario))
+        return usuario
+
+
+class CacheTagExtension(Extension):
+    """
+    Tag {% cache 'nome', chave, ... %}...{% endcache %} do Jinja2: o trecho é
+    renderizado uma vez e reaproveitado enquanto as chaves forem as mesmas.
+    As chaves são convertidas para texto; tudo aquilo de que o trecho depende
+    (usuário, email etc.) precisa estar nelas
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        chaves = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            chaves.append(parser.parse_expression())
+        corpo = parser.parse_statements(('name:endcache',), drop_needle=True)
+        chamada = self.call_method('_fragmento', [nodes.Const(parser.name), nodes.List(chaves)])
+        return nodes.CallBlock(chamada, [], [], corpo).set_lineno(lineno)
+
+    def _fragmento(self, template: str, chaves: list, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        chave = (template, *map(str, chaves))
+        fragmento = cache.get(chave)
+        if fragmento is None:
+            fragmento = caller()
+            cache.set(chave, fragmento)
+        return fragmento
+
+
+class FragmentCache:
+    """
+    Cache dos trechos de template marcados com {% cache %}, guardados em um
+    TTLCache limitado por FRAGMENT_CACHE_SIZE e FRAGMENT_CACHE_TTL. Com
+    FRAGMENT_CACHE desligado, a tag continua válida e apenas renderiza o
+    trecho a cada vez
+    """
+
+    def __init__(self, app=None):
+        self.cache: TTLCache | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE', True)
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 512)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 300)
+        app.jinja_env.add_extension(CacheTagExtension)
+        if app.config['FRAGMENT_CACHE']:
+            self.cache = TTLCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'],
+                                  ttl=app.config['FRAGMENT_CACHE_TTL'])
+        app.jinja_env.fragment_cache = self.cache
+        app.extensions['fragment_cache'] = self
+
+    def invalida(self):
+        if self.cache is not None:
+            self.cache.clear()
@@ -0,0 +1,26 @@
+import click
+from flask.cli import AppGroup
+
+from src.modules import assets
+
+assets_cli = AppGroup('assets', help="Geração dos templates e arquivos estáticos de produção")
+
+
+@assets_cli.command('build')
+@click.option('--minificar-css/--sem-minificar-css', default=True, show_default=True,
+              help="Minifica os arquivos .css antes de calcular o hash")
+def build(minificar_css: bool):
+    """Minifica os templates e gera os estáticos com hash e as versões .gz/.br."""
+    totais = assets.constroi(minificar_css=minificar_css)
+    click.echo(f"{totais['templates']} templates minificados "
+               f"({totais['bytes_antes']} -> {totais['bytes_depois']} bytes)")
+    click.echo(f"{totais['estaticos']} arquivos estáticos com hash e "
+               f"{totais['comprimidos']} versões comprimidas em {assets.diretorio}")
+    click.echo("Reinicie o servidor para usar os arquivos gerados")
+
+
+@assets_cli.command('limpar')
+def limpar():
+    """Remove os arquivos gerados; a aplicação volta a usar os originais."""
+    assets.limpa()
+    click.echo(f"{assets.diretorio} removido")
@@ -0,0 +1,615 @@
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+from urllib.parse import urlencode, urlsplit
+
+import click
+import sqlalchemy as sa
+from flask import current_app, url_for
+from flask.cli import AppGroup
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from src.models.usuario import prefixo_do_hash
+from src.modules import db
+from src.utils import timestamp
+
+bench_cli = AppGroup('bench', help="Medições de desempenho da aplicação")
+
+METODOS_PADRAO = ('scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000',
+                  'pbkdf2:sha256:260000')
+
+
+def _verificacoes_por(password_hash: str, senha: str, duracao: float) -> int:
+    quantidade = 0
+    fim = time.perf_counter() + duracao
+    while time.perf_counter() < fim:
+        check_password_hash(password_hash, senha)
+        quantidade += 1
+    return quantidade
+
+
+@bench_cli.command('senhas')
+@click.option('--metodo', 'metodos', multiple=True,
+              help="Método do Werkzeug a medir (pode ser repetido). Padrão: o configurado "
+                   "em PASSWORD_HASH_METHOD e alguns parâmetros usuais")
+@click.option('--duracao', default=3.0, show_default=True,
+              help="Segundos de medição para cada método")
+@click.option('--processos', default=os.cpu_count(), show_default=True,
+              help="Processos usados na medição com todos os núcleos")
+def senhas(metodos: tuple[str], duracao: float, processos: int):
+    """Mede quantos logins por segundo (verificações de senha) cada política suporta."""
+    configurado = current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    metodos = metodos or (configurado, *[m for m in METODOS_PADRAO if m != configurado])
+    senha = "senha-de-teste-123"
+
+    click.echo(f"{'método':<26} {'ms/login':>10} {'logins/s/núcleo':>16} "
+               f"{f'logins/s ({processos} proc.)':>22}")
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        for metodo in metodos:
+            password_hash = generate_password_hash(senha, method=metodo)
+            por_nucleo = _verificacoes_por(password_hash, senha, duracao) / duracao
+            tarefas = [executor.submit(_verificacoes_por, password_hash, senha, duracao)
+                       for _ in range(processos)]
+            total = sum(tarefa.result() for tarefa in tarefas) / duracao
+            marcador = " *" if prefixo_do_hash(metodo) == prefixo_do_hash(configurado) else ""
+            click.echo(f"{metodo + marcador:<26} {1000 / por_nucleo:>10.1f} "
+                       f"{por_nucleo:>16.1f} {total:>22.1f}")
+
+
+# ---------------------------------------------------------------------------
+# Carga HTTP
+# ---------------------------------------------------------------------------
+
+_CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class Cenario(NamedTuple):
+    endpoint: str
+    autenticado: bool = False
+    parametros: Mapping = MappingProxyType({})
+
+
+CENARIOS = {
+    'index': Cenario('index'),
+    'categorias.lista': Cenario('categorias.lista'),
+    'produtos.lista': Cenario('produtos.lista'),
+    'produtos.busca': Cenario('produtos.busca', parametros={'q': 'arroz integral'}),
+    'produtos.em_falta': Cenario('produtos.em_falta'),
+    'auth.login': Cenario('auth.login'),
+    'auth.profile': Cenario('auth.profile', autenticado=True),
+    'produtos.novo': Cenario('produtos.novo', autenticado=True),
+}
+
+
+class Resposta(NamedTuple):
+    status: int
+    corpo: str
+    destino: str
+
+
+class _ClienteWSGI:
+    """Cliente que chama a aplicação WSGI no próprio processo."""
+
+    def __init__(self, app):
+        self.cliente = app.test_client()
+
+    @staticmethod
+    def _resposta(resposta) -> Resposta:
+        return Resposta(resposta.status_code, resposta.get_data(as_text=True),
+                        resposta.headers.get('Location', ''))
+
+    def get(self, caminho: str) -> Resposta:
+        return self._resposta(self.cliente.get(caminho))
+
+    def post(self, caminho: str, dados: dict) -> Resposta:
+        return self._resposta(self.cliente.post(caminho, data=dados))
+
+
+class _SemRedirecionamento(urllib.request.HTTPRedirectHandler):
+    # O redirecionamento faz parte do que se mede (ex.: o login bem-sucedido)
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class _ClienteHTTP:
+    """Cliente que fala HTTP com um servidor já em execução."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _SemRedirecionamento())
+
+    def _abre(self, requisicao) -> Resposta:
+        try:
+            with self.opener.open(requisicao, timeout=30) as resposta:
+                return Resposta(resposta.status, resposta.read().decode(errors='replace'),
+                                resposta.headers.get('Location', ''))
+        except urllib.error.HTTPError as e:
+            return Resposta(e.code, e.read().decode(errors='replace'),
+                            e.headers.get('Location', ''))
+
+    def get(self, caminho: str) -> Resposta:
+        return self._abre(urllib.request.Request(self.url + caminho))
+
+    def post(self, caminho: str, dados: dict) -> Resposta:
+        return self._abre(urllib.request.Request(self.url + caminho,
+                                                 data=urlencode(dados).encode()))
+
+
+def _dados_de_login(cliente, caminho: str, email: str, senha: str) -> dict:
+    # Abre o formulário para obter o token CSRF da sessão, quando houver
+    formulario = cliente.get(caminho)
+    dados = dict(email=email, password=senha, submit="Entrar")
+    token = _CSRF.search(formulario.corpo)
+    if token:
+        dados['csrf_token'] = token.group(1)
+    return dados
+
+
+def _entra(cliente, caminhos: dict, email: str, senha: str) -> Resposta:
+    caminho = caminhos['auth.login']
+    return cliente.post(caminho, _dados_de_login(cliente, caminho, email, senha))
+
+
+def _entrou(resposta: Resposta, caminhos: dict) -> bool:
+    # Tanto o sucesso quanto a falha redirecionam; a falha volta ao formulário
+    return (resposta.status == 302
+            and urlsplit(resposta.destino).path != caminhos['auth.login'])
+
+
+def _percentil(ordenados: list[float], percentual: float) -> float:
+    if not ordenados:
+        return 0.0
+    return ordenados[max(0, math.ceil(percentual / 100 * len(ordenados)) - 1)]
+
+
+def _mede(nome: str, novo_cliente, credenciais: list[tuple[str, str]], caminhos: dict,
+          concorrencia: int, duracao: float, requisicoes: int) -> dict:
+    cenario = CENARIOS[nome]
+    caminho = caminhos[nome]
+    janela = {}
+
+    def abre_janela():
+        janela['inicio'] = time.perf_counter()
+        janela['fim'] = janela['inicio'] + duracao
+
+    # Todos os usuários virtuais começam juntos, depois do login e do aquecimento
+    largada = threading.Barrier(concorrencia + 1, action=abre_janela)
+
+    def usuario_virtual(numero: int) -> list[tuple[float, bool]]:
+        email, senha = credenciais[numero % len(credenciais)]
+        cliente = novo_cliente()
+        if cenario.autenticado and not _entrou(_entra(cliente, caminhos, email, senha),
+                                               caminhos):
+            largada.abort()
+            raise click.ClickException(f"Não foi possível entrar como {email}")
+        if nome != 'auth.login':
+            cliente.get(caminho)  # aquecimento, fora da medição
+        largada.wait()
+
+        amostras = []
+        while len(amostras) < requisicoes and time.perf_counter() < janela['fim']:
+            if nome == 'auth.login':
+                # Cada login usa uma sessão nova; só o POST é medido
+                cliente = novo_cliente()
+                dados = _dados_de_login(cliente, caminho, email, senha)
+                inicio = time.perf_counter()
+                resposta = cliente.post(caminho, dados)
+                ok = _entrou(resposta, caminhos)
+            else:
+                inicio = time.perf_counter()
+                resposta = cliente.get(caminho)
+                ok = resposta.status < 400
+            amostras.append((time.perf_counter() - inicio, ok))
+        return amostras
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        tarefas = [executor.submit(usuario_virtual, numero) for numero in range(concorrencia)]
+        try:
+            largada.wait()
+        except threading.BrokenBarrierError:
+            for tarefa in tarefas:
+                tarefa.result()
+            raise
+        amostras = [amostra for tarefa in tarefas for amostra in tarefa.result()]
+        decorrido = time.perf_counter() - janela['inicio']
+
+    latencias = sorted(latencia * 1000 for latencia, _ in amostras)
+    return dict(requisicoes=len(amostras),
+                erros=sum(1 for _, ok in amostras if not ok),
+                req_s=round(len(amostras) / decorrido, 2),
+                media_ms=round(sum(latencias) / len(latencias), 2) if latencias else 0.0,
+                p50_ms=round(_percentil(latencias, 50), 2),
+                p95_ms=round(_percentil(latencias, 95), 2),
+                p99_ms=round(_percentil(latencias, 99), 2))
+
+
+def _grava_config(destino: Path, **ajustes) -> Path:
+    # Cópia da configuração atual (apenas o que é serializável em JSON), para
+    # criar outras instâncias da aplicação com create_app
+    config = {}
+    for chave, valor in current_app.config.items():
+        try:
+            json.dumps(valor)
+        except TypeError:
+            continue
+        config[chave] = valor
+    config.update(ajustes)
+    destino.write_text(json.dumps(config), encoding='utf-8')
+    return destino
+
+
+def _app_com_dados(diretorio: Path, produtos: int, categorias: int, usuarios: int,
+                   semente: int, senha: str, ajustes: dict):
+    from src.factory import create_app
+
+    banco = diretorio / 'bench.sqlite3'
+    arquivo = _grava_config(diretorio / 'config.json',
+                            SQLALCHEMY_DATABASE_URI=f"sqlite+pysqlite:///{banco}",
+                            SQLITE_DB_NAME=str(banco),
+                            MAIL_BACKEND='locmem',
+                            USER_CACHE_SHARED=False,
+                            **ajustes)
+    config = json.loads(arquivo.read_text(encoding='utf-8'))
+
+    # O esquema precisa existir antes de create_app verificá-lo
+    motor = sa.create_engine(config['SQLALCHEMY_DATABASE_URI'])
+    db.metadata.create_all(motor)
+    motor.dispose()
+
+    app = create_app(str(arquivo))
+    executor = app.test_cli_runner()
+    # Sem o contexto próprio, os comandos rodariam no contexto já ativo, o
+    # da aplicação que chamou o benchmark, e gravariam no banco dela
+    with app.app_context():
+        for argumentos in (['seed', 'inicial'],
+                           ['seed', 'sintetico', '--produtos', str(produtos),
+                            '--categorias', str(categorias), '--usuarios', str(usuarios),
+                            '--semente', str(semente), '--senha', senha]):
+            resultado = executor.invoke(args=argumentos)
+            if resultado.exit_code != 0:
+                raise click.ClickException(f"Falha ao gerar os dados: {resultado.output}")
+    return app
+
+
+def _compara(resultado: dict, base: dict, tolerancia: float) -> list[str]:
+    regressoes = []
+    for nome, atual in resultado['rotas'].items():
+        anterior = base.get('rotas', {}).get(nome)
+        if anterior is None:
+            continue
+        if atual['req_s'] < anterior['req_s'] * (1 - tolerancia):
+            regressoes.append(f"{nome}: {atual['req_s']} req/s, base {anterior['req_s']}")
+        if atual['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p95 de {atual['p95_ms']}ms, base {anterior['p95_ms']}ms")
+        if atual['erros'] > anterior['erros']:
+            regressoes.append(f"{nome}: {atual['erros']} erros, base {anterior['erros']}")
+    return regressoes
+
+
+@bench_cli.command('http')
+@click.option('--rota', 'rotas', multiple=True, type=click.Choice(list(CENARIOS)),
+              help="Rota a medir (pode ser repetida). Padrão: todas")
+@click.option('--concorrencia', default=8, show_default=True,
+              help="Usuários virtuais simultâneos")
+@click.option('--duracao', default=5.0, show_default=True,
+              help="Segundos de medição para cada rota")
+@click.option('--requisicoes', default=0,
+              help="Limita as requisições de cada usuário virtual por rota (0 = sem limite)")
+@click.option('--url', default=None,
+              help="Mede um servidor já em execução (ex.: http://127.0.0.1:5000) em vez "
+                   "da aplicação WSGI no próprio processo")
+@click.option('--email', default=None,
+              help="Usuário das rotas autenticadas com --url. Padrão: DEFAULT_ADMIN_EMAIL")
+@click.option('--senha', default=None,
+              help="Senha do usuário. Padrão: DEFAULT_ADMIN_PASSWORD, ou a dos usuários "
+                   "sintéticos")
+@click.option('--produtos', default=20_000, show_default=True,
+              help="Produtos do banco temporário gerado para a medição")
+@click.option('--categorias', default=50, show_default=True,
+              help="Categorias do banco temporário")
+@click.option('--semente', default=2024, show_default=True, help="Semente dos dados gerados")
+@click.option('--metricas/--sem-metricas', default=None,
+              help="Liga ou desliga METRICS na aplicação medida, para comparar o custo "
+                   "da instrumentação. Padrão: o configurado")
+@click.option('--profiling/--sem-profiling', default=None,
+              help="Liga ou desliga PROFILING na aplicação medida. Padrão: o configurado")
+@click.option('--saida', type=click.Path(dir_okay=False, path_type=Path), default=None,
+              help="Grava o resultado em JSON neste arquivo")
+@click.option('--base', type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              default=None, help="Resultado anterior (JSON) usado como linha de base")
+@click.option('--tolerancia', default=0.10, show_default=True,
+              help="Piora relativa de req/s ou p95 aceita em relação à base")
+def http_(rotas: tuple[str], concorrencia: int, duracao: float, requisicoes: int,
+          url: str | None, email: str | None, senha: str | None, produtos: int,
+          categorias: int, semente: int, metricas: bool | None, profiling: bool | None,
+          saida: Path | None, base: Path | None, tolerancia: float):
+    """Mede req/s e latências (p50/p95/p99) das principais rotas sob carga concorrente."""
+    rotas = rotas or tuple(CENARIOS)
+    requisicoes = requisicoes or sys.maxsize
+    config = current_app.config
+    ajustes = {chave: valor for chave, valor in (('METRICS', metricas),
+                                                 ('PROFILING', profiling))
+               if valor is not None}
+    if url and ajustes:
+        raise click.UsageError("--metricas e --profiling só valem para a aplicação no "
+                               "próprio processo; com --url, configure o servidor")
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as temporario:
+        if url:
+            app = current_app._get_current_object()  # pylint: disable=protected-access
+            credenciais = [(email or config.get('DEFAULT_ADMIN_EMAIL', 'admin@admin.com.br'),
+                            senha or config.get('DEFAULT_ADMIN_PASSWORD', "123456"))]
+
+            def novo_cliente():
+                return _ClienteHTTP(url)
+        else:
+            senha = senha or "senha123"
+            click.echo(f"Gerando banco temporário com {produtos} produtos...")
+            app = _app_com_dados(Path(temporario), produtos, categorias,
+                                 max(concorrencia, 1), semente, senha, ajustes)
+            credenciais = [(f"usuario{numero:06d}@exemplo.com.br", senha)
+                           for numero in range(1, concorrencia + 1)]
+
+            def novo_cliente():
+                return _ClienteWSGI(app)
+
+        with app.test_request_context():
+            caminhos = {nome: url_for(cenario.endpoint, **cenario.parametros)
+                        for nome, cenario in CENARIOS.items()}
+
+        resultado = dict(gerado_em=timestamp().isoformat(),
+                         alvo=url or 'wsgi',
+                         concorrencia=concorrencia,
+                         duracao=duracao,
+                         produtos=None if url else produtos,
+                         metricas=app.config.get('METRICS', False) if not url else None,
+                         profiling=app.config.get('PROFILING', False) if not url else None,
+                         rotas={})
+        click.echo(f"{'rota':<20} {'req':>7} {'erros':>6} {'req/s':>9} {'p50 ms':>9} "
+                   f"{'p95 ms':>9} {'p99 ms':>9}")
+        for nome in rotas:
+            medida = _mede(nome, novo_cliente, credenciais, caminhos, concorrencia, duracao,
+                           requisicoes)
+            resultado['rotas'][nome] = medida
+            click.echo(f"{nome:<20} {medida['requisicoes']:>7} {medida['erros']:>6} "
+                       f"{medida['req_s']:>9.1f} {medida['p50_ms']:>9.1f} "
+                       f"{medida['p95_ms']:>9.1f} {medida['p99_ms']:>9.1f}")
+
+        if not url:
+            db.session.remove()
+            with app.app_context():
+                db.engine.dispose()
+
+    if saida:
+        saida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding='utf-8')
+        click.echo(f"Resultado gravado em {saida}")
+    if base:
+        regressoes = _compara(resultado, json.loads(base.read_text(encoding='utf-8')),
+                              tolerancia)
+        if regressoes:
+            for regressao in regressoes:
+                click.echo(f"REGRESSÃO {regressao}", err=True)
+            raise click.ClickException(f"{len(regressoes)} regressão(ões) em relação a {base}")
+        click.echo(f"Sem regressões em relação a {base} (tolerância de {tolerancia:.0%})")
+
+
+# ---------------------------------------------------------------------------
+# Inicialização
+# ---------------------------------------------------------------------------
+
+_INICIALIZACAO = """
+import json, sys, time
+inicio = time.perf_counter()
+from src.factory import create_app
+importado = time.perf_counter()
+app = create_app(sys.argv[1])
+criado = time.perf_counter()
+app.test_client().get('/')
+respondido = time.perf_counter()
+print(json.dumps(dict(importacao=importado - inicio, criacao=criado - importado,
+                      primeira_requisicao=respondido - criado)))
+"""
+
+
+def _inicializa(arquivo: Path, importtime: bool) -> tuple[dict, str]:
+    argumentos = [sys.executable, *(['-X', 'importtime'] if importtime else []),
+                  '-c', _INICIALIZACAO, str(arquivo)]
+    processo = subprocess.run(argumentos, cwd=Path(current_app.root_path).parent,
+                              capture_output=True, text=True, check=False)
+    if processo.returncode != 0:
+        raise click.ClickException(f"Falha ao iniciar a aplicação:\n{processo.stderr}")
+    return json.loads(processo.stdout.strip().splitlines()[-1]), processo.stderr
+
+
+def _maiores_importacoes(saida: str, quantidade: int) -> list[tuple[str, float]]:
+    # Linhas de -X importtime: "import time: próprio | acumulado | módulo". O
+    # tempo é agrupado por pacote (por subpacote, no caso de src), pelo maior
+    # acumulado, que já inclui os módulos importados por ele
+    pacotes = {}
+    for linha in saida.splitlines():
+        if not linha.startswith('import time:') or '|' not in linha:
+            continue
+        _, acumulado, modulo = linha.split('|')
+        if not acumulado.strip().isdigit():
+            continue
+        partes = modulo.strip().split('.')
+        pacote = '.'.join(partes[:2] if partes[0] == 'src' else partes[:1])
+        pacotes[pacote] = max(pacotes.get(pacote, 0), int(acumulado) / 1000)
+    return sorted(pacotes.items(), key=lambda item: item[1], reverse=True)[:quantidade]
+
+
+@bench_cli.command('inicializacao')
+@click.option('--repeticoes', default=5, show_default=True,
+              help="Processos iniciados em cada modo")
+@click.option('--importacoes', default=10, show_default=True,
+              help="Quantos dos módulos mais lentos de importar listar")
+def inicializacao(repeticoes: int, importacoes: int):
+    """Mede a partida a frio de um processo, com e sem FAST_START."""
+    modos = {'padrão': dict(FAST_START=False, JINJA_BYTECODE_CACHE=None),
+             'FAST_START': dict(FAST_START=True,
+                                JINJA_BYTECODE_CACHE=current_app.config.get(
+                                    'JINJA_BYTECODE_CACHE') or 'jinja-cache')}
+    with tempfile.TemporaryDirectory(prefix='bench-') as temporario:
+        click.echo(f"{'modo':<12} {'importação':>11} {'create_app':>11} "
+                   f"{'1ª requisição':>14} {'total':>9}   (ms, mediana de {repeticoes})")
+        saida_importtime = ''
+        for nome, ajustes in modos.items():
+            arquivo = _grava_config(Path(temporario) / f"{nome}.json", **ajustes)
+            # Uma execução descartada: aquece o cache de bytecode do Python e,
+            # no modo rápido, o dos templates
+            _, saida_importtime = _inicializa(arquivo, importtime=True)
+            medidas = [_inicializa(arquivo, importtime=False)[0] for _ in range(repeticoes)]
+            medianas = {etapa: statistics.median(medida[etapa] for medida in medidas) * 1000
+                        for etapa in medidas[0]}
+            click.echo(f"{nome:<12} {medianas['importacao']:>11.0f} "
+                       f"{medianas['criacao']:>11.0f} {medianas['primeira_requisicao']:>14.0f} "
+                       f"{sum(medianas.values()):>9.0f}")
+
+    click.echo("\nImportações mais lentas (ms, acumulado):")
+    for modulo, duracao in _maiores_importacoes(saida_importtime, importacoes):
+        click.echo(f"  {modulo:<40} {duracao:>8.1f}")
+
+
+# ---------------------------------------------------------------------------
+# Concorrência no estoque
+# ---------------------------------------------------------------------------
+
+def _movimenta_sem_controle(produto_id, delta: int):
+    # Leitura e gravação do valor calculado no Python, sem conferir a versão:
+    # o padrão que perde atualizações quando dois clientes se intercalam
+    from src.models.movimento import Movimento
+    from src.models.produto import Produto
+
+    tabela = Produto.__table__
+    estoque = db.session.execute(
+        sa.select(tabela.c.estoque).where(tabela.c.id == produto_id)).scalar_one()
+    db.session.execute(sa.update(tabela).where(tabela.c.id == produto_id).
+                       values(estoque=estoque + delta))
+    Movimento.registra([Movimento.linha(produto_id, delta, origem='bench')])
+    db.session.commit()
+
+
+@bench_cli.command('concorrencia')
+@click.option('--threads', default=16, show_default=True,
+              help="Clientes simultâneos")
+@click.option('--operacoes', default=200, show_default=True,
+              help="Movimentações por cliente")
+@click.option('--produtos', default=4, show_default=True,
+              help="Produtos disputados pelos clientes")
+@click.option('--tentativas', default=8, show_default=True,
+              help="Tentativas de cada movimentação antes de desistir")
+@click.option('--sem-controle/--so-cas', default=True, show_default=True,
+              help="Também mede, para comparação, a leitura e gravação sem controle")
+@click.option('--semente', default=2024, show_default=True)
+def concorrencia_(threads: int, operacoes: int, produtos: int, tentativas: int,
+                  sem_controle: bool, semente: int):
+    """
+    Vários clientes comprando e vendendo os mesmos produtos ao mesmo tempo.
+    Confere se nenhuma movimentação se perdeu e se o estoque bate com o livro.
+    """
+    from src.models.movimento import Movimento
+    from src.models.produto import ConflitoDeEstoque, Produto
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as temporario:
+        app = _app_com_dados(Path(temporario), max(produtos, 100), 5, 1, semente,
+                             'senha123', {})
+        with app.app_context():
+            disputados = list(db.session.execute(
+                sa.select(Produto).where(Produto.ativo.is_(True)).limit(produtos)).scalars())
+            ids = [produto.id for produto in disputados]
+
+        def executa(modo: str) -> dict:
+            with app.app_context():
+                # Estoque alto o bastante para que nenhuma venda seja recusada
+                for produto in db.session.execute(
+                        sa.select(Produto).where(Produto.id.in_(ids))).scalars():
+                    produto.estoque = threads * operacoes * 10
+                db.session.commit()
+                iniciais = dict(db.session.execute(
+                    sa.select(Produto.id, Produto.estoque).where(Produto.id.in_(ids))).all())
+
+            barreira = threading.Barrier(threads)
+
+            def cliente(numero: int) -> dict:
+                aleatorio = random.Random(semente * 1000 + numero)
+                aplicados = dict.fromkeys(ids, 0)
+                tentativas_feitas = desistencias = 0
+                with app.app_context():
+                    barreira.wait()
+                    for _ in range(operacoes):
+                        produto_id = aleatorio.choice(ids)
+                        delta = aleatorio.choice((-3, -2, -1, 1, 2, 3))
+                        if modo == 'sem controle':
+                            _movimenta_sem_controle(produto_id, delta)
+                            tentativas_feitas += 1
+                        else:
+                            try:
+                                resultado = Produto.movimenta(produto_id, delta,
+                                                              origem='bench',
+                                                              tentativas=tentativas)
+                            except ConflitoDeEstoque:
+                                desistencias += 1
+                                tentativas_feitas += tentativas
+                                continue
+                            tentativas_feitas += resultado.tentativas
+                        aplicados[produto_id] += delta
+                return dict(aplicados=aplicados, tentativas=tentativas_feitas,
+                            desistencias=desistencias)
+
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                resultados = list(executor.map(cliente, range(threads)))
+            duracao = time.perf_counter() - inicio
+
+            with app.app_context():
+                finais = dict(db.session.execute(
+                    sa.select(Produto.id, Produto.estoque).where(Produto.id.in_(ids))).all())
+                divergencias = len(db.session.execute(Movimento.divergencias()).all())
+            esperados = {produto_id: iniciais[produto_id] + sum(r['aplicados'][produto_id]
+                                                                 for r in resultados)
+                         for produto_id in ids}
+            desistencias = sum(r['desistencias'] for r in resultados)
+            concluidas = threads * operacoes - desistencias
+            return dict(concluidas=concluidas,
+                        desistencias=desistencias,
+                        ops_s=concluidas / duracao,
+                        tentativas_por_op=sum(r['tentativas'] for r in resultados) /
+                        (threads * operacoes),
+                        perdidas=sum(abs(esperados[produto_id] - finais[produto_id])
+                                     for produto_id in ids),
+                        divergencias=divergencias)
+
+        modos = ['compare-and-swap'] + (['sem controle'] if sem_controle else [])
+        click.echo(f"{threads} clientes, {operacoes} movimentações cada, "
+                   f"em {produtos} produtos")
+        click.echo(f"{'modo':<18} {'ops/s':>8} {'tent./op':>9} {'desistências':>13} "
+                   f"{'unid. perdidas':>15} {'divergências':>13}")
+        resultados = {}
+        for modo in modos:
+            resultado = resultados[modo] = executa(modo)
+            click.echo(f"{modo:<18} {resultado['ops_s']:>8.0f} "
+                       f"{resultado['tentativas_por_op']:>9.2f} "
+                       f"{resultado['desistencias']:>13} {resultado['perdidas']:>15} "
+                       f"{resultado['divergencias']:>13}")
+
+    cas = resultados['compare-and-swap']
+    if cas['perdidas'] or cas['divergencias']:
+        raise click.ClickException("Movimentações perdidas com compare-and-swap")
+    click.echo("Nenhuma movimentação perdida com compare-and-swap")
@@ -0,0 +1,51 @@
+import time
+
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import AppGroup
+
+from src.models.email_pendente import EmailPendente
+from src.modules import db, outbox
+from src.utils import timestamp
+
+email_cli = AppGroup('email', help="Caixa de saída dos emails")
+
+
+@email_cli.command('processar')
+@click.option('--continuo', is_flag=True, default=False,
+              help="Continua aguardando novas mensagens em vez de terminar")
+def processar(continuo: bool):
+    """Envia as mensagens pendentes da caixa de saída."""
+    total = 0
+    while True:
+        enviados = outbox.processa_lote()
+        total += enviados
+        if enviados == 0:
+            if not continuo:
+                break
+            time.sleep(current_app.config['EMAIL_OUTBOX_INTERVALO'])
+    click.echo(f"{total} mensagens enviadas")
+
+
+@email_cli.command('situacao')
+def situacao():
+    """Mostra a quantidade de mensagens em cada situação."""
+    # pylint: disable=not-callable
+    for nome, quantidade in db.session.execute(
+            sa.select(EmailPendente.situacao, sa.func.count()).
+            group_by(EmailPendente.situacao).
+            order_by(EmailPendente.situacao)):
+        click.echo(f"{nome:<10} {quantidade}")
+
+
+@email_cli.command('reenviar')
+def reenviar():
+    """Devolve para a fila as mensagens que esgotaram as tentativas."""
+    resultado = db.session.execute(
+        sa.update(EmailPendente).
+        where(EmailPendente.situacao == EmailPendente.FALHOU).
+        values(situacao=EmailPendente.PENDENTE, tentativas=0, proxima_tentativa=timestamp())
+    )
+    db.session.commit()
+    click.echo(f"{resultado.rowcount} mensagens devolvidas para a fila")
@@ -0,0 +1,89 @@
+import datetime
+import uuid
+
+import click
+import pytz
+from flask import current_app
+from flask.cli import AppGroup
+
+from src.models.movimento import Movimento, SaldoDeEstoque
+from src.modules import db
+
+estoque_cli = AppGroup('estoque', help="Livro de movimentações e instantâneos do estoque")
+
+
+def _fim_do_dia(data: datetime.date) -> datetime.datetime:
+    # O dia é o do fuso da aplicação; as datas no banco estão em UTC
+    fuso = pytz.timezone(current_app.config.get('TIMEZONE', 'UTC'))
+    inicio_do_dia_seguinte = fuso.localize(datetime.datetime.combine(
+        data + datetime.timedelta(days=1), datetime.time()))
+    return inicio_do_dia_seguinte.astimezone(pytz.utc)
+
+
+def _ontem() -> datetime.date:
+    fuso = pytz.timezone(current_app.config.get('TIMEZONE', 'UTC'))
+    return datetime.datetime.now(tz=fuso).date() - datetime.timedelta(days=1)
+
+
+@estoque_cli.command('snapshot')
+@click.option('--data', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Dia do instantâneo, com o estoque ao final dele (padrão: ontem)")
+def snapshot(data: datetime.datetime | None):
+    """Grava o instantâneo do estoque de todos os produtos ao final de um dia."""
+    dia = data.date() if data else _ontem()
+    corte = _fim_do_dia(dia)
+    anterior = SaldoDeEstoque.anterior_a(corte)
+    produtos = SaldoDeEstoque.gera(corte)
+    db.session.commit()
+    click.echo(f"Instantâneo de {dia.isoformat()} gravado com {produtos} produtos"
+               + (f", a partir do instantâneo de {anterior:%Y-%m-%d %H:%M} UTC"
+                  if anterior else ""))
+
+
+@estoque_cli.command('saldo')
+@click.argument('data', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--produto', 'produtos', multiple=True, type=click.UUID,
+              help="Produto a consultar; pode ser repetido (padrão: todos)")
+def saldo(data: datetime.datetime, produtos: tuple[uuid.UUID, ...]):
+    """Mostra o estoque ao final de um dia, a partir do livro de movimentações."""
+    saldos = Movimento.estoque_em(_fim_do_dia(data.date()), list(produtos) or None)
+    if produtos:
+        for produto_id in produtos:
+            click.echo(f"{produto_id}  {saldos.get(produto_id, 0):>10}")
+    else:
+        click.echo(f"{sum(saldos.values())} unidades em {len(saldos)} produtos")
+
+
+@estoque_cli.command('reconciliar')
+@click.option('--completo', is_flag=True, default=False,
+              help="Soma o livro inteiro, em vez de partir do último instantâneo")
+@click.option('--corrigir', is_flag=True, default=False,
+              help="Registra ajustes no livro para igualá-lo ao estoque dos produtos")
+@click.option('--limite', default=20, show_default=True,
+              help="Divergências listadas")
+def reconciliar(completo: bool, corrigir: bool, limite: int):
+    """Confere o estoque de cada produto com o saldo do livro de movimentações."""
+    divergencias = db.session.execute(
+        Movimento.divergencias(completo=completo).execution_options(yield_per=5000))
+    ajustes = []
+    quantidade = 0
+    for divergencia in divergencias:
+        quantidade += 1
+        if quantidade <= limite:
+            click.echo(f"{divergencia.id}  estoque {divergencia.estoque:>8}  "
+                       f"livro {divergencia.saldo:>8}  {divergencia.nome}")
+        if corrigir:
+            ajustes.append(Movimento.linha(divergencia.id,
+                                           divergencia.estoque - divergencia.saldo,
+                                           tipo=Movimento.AJUSTE, origem='reconciliação'))
+    if quantidade > limite:
+        click.echo(f"... e mais {quantidade - limite}")
+
+    if not quantidade:
+        click.echo("O estoque de todos os produtos confere com o livro")
+        return
+    if not corrigir:
+        raise click.ClickException(f"{quantidade} produtos com o estoque diferente do livro")
+    Movimento.registra(ajustes)
+    db.session.commit()
+    click.echo(f"{len(ajustes)} ajustes registrados no livro")
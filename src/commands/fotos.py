@@ -0,0 +1,205 @@
+import base64
+import binascii
+import io
+import time
+import uuid
+from concurrent.futures import as_completed
+
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import AppGroup
+
+from src.models.produto import Produto
+from src.modules import blobstore, db, miniaturas
+
+fotos_cli = AppGroup('fotos', help="Manutenção das fotos dos produtos")
+
+
+@fotos_cli.command('miniaturas')
+@click.option('--refazer', is_flag=True, default=False,
+              help="Gera novamente as variantes que já existem")
+@click.option('--lote', default=1000, show_default=True,
+              help="Quantidade de produtos lidos do banco por vez")
+@click.option('--processos', type=int, default=None,
+              help="Número de processos (padrão: MINIATURAS_PROCESSOS)")
+def gera_miniaturas(refazer: bool, lote: int, processos: int | None):
+    """Gera, em paralelo, as variantes das fotos dos produtos já cadastrados."""
+    sentenca = (sa.select(Produto.id, Produto.foto_hash).
+                where(Produto.possui_foto.is_(True), Produto.foto_hash.is_not(None)).
+                execution_options(yield_per=lote))
+    total = db.session.execute(
+        sa.select(sa.func.count()).select_from(sentenca.subquery())  # pylint: disable=not-callable
+    ).scalar_one()
+    # O backfill sempre usa o pool, mesmo que a aplicação gere as variantes
+    # de forma síncrona (MINIATURAS_PROCESSOS = 0)
+    miniaturas.processos = max(1, processos if processos is not None else miniaturas.processos)
+
+    click.echo(f"Gerando as variantes de {total} fotos com {miniaturas.processos} processos")
+    falhas = 0
+    with click.progressbar(length=total, label="Miniaturas") as barra:
+        pendentes = set()
+        for linha in db.session.execute(sentenca):
+            pendentes.add(miniaturas.agenda(linha.id, linha.foto_hash, refazer=refazer))
+            # Limita o número de tarefas pendentes para não manter o catálogo
+            # inteiro em memória
+            if len(pendentes) >= lote:
+                falhas += _aguarda(pendentes, barra, len(pendentes) // 2)
+        falhas += _aguarda(pendentes, barra, len(pendentes))
+    if falhas:
+        current_app.logger.warning("%d fotos não puderam ser processadas", falhas)
+
+
+def _aguarda(pendentes: set, barra, quantidade: int) -> int:
+    falhas = 0
+    for futuro in as_completed(list(pendentes)):
+        pendentes.discard(futuro)
+        barra.update(1)
+        if futuro.exception() is not None:
+            falhas += 1
+        quantidade -= 1
+        if quantidade <= 0:
+            break
+    return falhas
+
+
+@fotos_cli.command('migrar')
+@click.option('--lote', default=500, show_default=True,
+              help="Quantidade de fotos convertidas por transação")
+@click.option('--remover-coluna', is_flag=True, default=False,
+              help="Remove a coluna foto_base64 depois que todas as fotos forem migradas")
+def migra(lote: int, remover_coluna: bool):
+    """Copia as fotos da antiga coluna foto_base64 para o armazenamento de blobs."""
+    colunas = {coluna['name'] for coluna in sa.inspect(db.engine).get_columns('produtos')}
+    if 'foto_base64' not in colunas:
+        click.echo("A tabela produtos não tem a coluna foto_base64: nada a migrar")
+        return
+    if 'foto_hash' not in colunas:
+        db.session.execute(sa.text("ALTER TABLE produtos ADD COLUMN foto_hash VARCHAR(64)"))
+        db.session.commit()
+
+    # A coluna não faz mais parte do modelo, então a tabela é descrita aqui
+    produtos = sa.table('produtos',
+                        sa.column('id', sa.Uuid(as_uuid=True)),
+                        sa.column('foto_base64', sa.Text),
+                        sa.column('foto_hash', sa.String),
+                        sa.column('foto_mime', sa.String),
+                        sa.column('possui_foto', sa.Boolean))
+    pendentes = sa.and_(produtos.c.foto_base64.is_not(None), produtos.c.foto_hash.is_(None))
+    contagem = sa.func.count()  # pylint: disable=not-callable
+    total = db.session.execute(
+        sa.select(contagem).select_from(produtos).where(pendentes)).scalar_one()
+    atualizacao = (sa.update(produtos).
+                   where(produtos.c.id == sa.bindparam('b_id')).
+                   values(foto_hash=sa.bindparam('b_hash'), foto_mime=sa.bindparam('b_mime'),
+                          possui_foto=True))
+
+    migradas, invalidas = 0, []
+    ultimo = None
+    with click.progressbar(length=total, label="Fotos") as barra:
+        while True:
+            # Paginação pelo id: as fotos inválidas continuam pendentes e não
+            # podem ser lidas de novo
+            sentenca = (sa.select(produtos.c.id, produtos.c.foto_base64).
+                        where(pendentes).order_by(produtos.c.id).limit(lote))
+            if ultimo is not None:
+                sentenca = sentenca.where(produtos.c.id > ultimo)
+            linhas = db.session.execute(sentenca).all()
+            if not linhas:
+                break
+            valores = []
+            for produto_id, foto in linhas:
+                chave, mime = _guarda_base64(foto)
+                if mime is None:
+                    invalidas.append(produto_id)
+                    continue
+                valores.append(dict(b_id=produto_id, b_hash=chave, b_mime=mime))
+            if valores:
+                db.session.execute(atualizacao, valores)
+            db.session.commit()
+            migradas += len(valores)
+            ultimo = linhas[-1].id
+            barra.update(len(linhas))
+
+    click.echo(f"{migradas} fotos migradas para o armazenamento de blobs")
+    for produto_id in invalidas[:20]:
+        click.echo(f"{produto_id}  foto_base64 não contém uma imagem reconhecida", err=True)
+    if migradas:
+        click.echo("Execute 'flask fotos miniaturas' para gerar as variantes das fotos migradas")
+    if not remover_coluna:
+        return
+    if invalidas:
+        raise click.ClickException(f"{len(invalidas)} fotos não puderam ser migradas; a coluna "
+                                   f"foto_base64 foi mantida")
+    db.session.execute(sa.text("ALTER TABLE produtos DROP COLUMN foto_base64"))
+    db.session.commit()
+    click.echo("Coluna foto_base64 removida")
+
+
+def _guarda_base64(foto: str) -> tuple[str | None, str | None]:
+    # Aceita também o formato de data URL (data:image/png;base64,...)
+    if foto.startswith('data:'):
+        foto = foto.partition(',')[2]
+    try:
+        conteudo = base64.b64decode(foto, validate=False)
+    except (binascii.Error, ValueError):
+        return None, None
+    chave, mime = blobstore.guarda(io.BytesIO(conteudo))
+    if mime is None:
+        blobstore.remove(chave)
+    return chave, mime
+
+
+@fotos_cli.command('limpar')
+@click.option('--idade', default=60, show_default=True,
+              help="Minutos desde a gravação para que um arquivo sem referência seja removido")
+@click.option('--simular', is_flag=True, default=False,
+              help="Apenas lista o que seria removido")
+@click.option('--lote', default=500, show_default=True,
+              help="Pastas de variantes conferidas por consulta")
+def limpa(idade: int, simular: bool, lote: int):
+    """Remove os blobs e as variantes que nenhum produto referencia mais."""
+    # Arquivos recentes podem pertencer a um envio cuja transação ainda não
+    # terminou, e por isso são mantidos
+    limite = time.time() - idade * 60
+    referenciados = set(db.session.execute(
+        sa.select(Produto.foto_hash).where(Produto.foto_hash.is_not(None)).distinct()
+    ).scalars())
+
+    removidos, liberados = 0, 0
+    for arquivo in blobstore.arquivos():
+        if arquivo.name in referenciados:
+            continue
+        estado = arquivo.stat()
+        if estado.st_mtime > limite:
+            continue
+        removidos += 1
+        liberados += estado.st_size
+        if not simular:
+            arquivo.unlink(missing_ok=True)
+    click.echo(f"{removidos} blobs sem referência ({liberados / 2 ** 20:.1f} MiB)"
+               + (" seriam removidos" if simular else " removidos"))
+
+    # Variantes de produtos removidos ou que não têm mais foto
+    pastas = [pasta for pasta in miniaturas.diretorio.iterdir()
+              if pasta.is_dir() and pasta.stat().st_mtime <= limite] \
+        if miniaturas.diretorio.is_dir() else []
+    orfas = 0
+    for inicio in range(0, len(pastas), lote):
+        bloco = {}
+        for pasta in pastas[inicio:inicio + lote]:
+            try:
+                bloco[uuid.UUID(pasta.name)] = pasta
+            except ValueError:
+                continue
+        com_foto = set(db.session.execute(
+            sa.select(Produto.id).where(Produto.id.in_(bloco),
+                                        Produto.foto_hash.is_not(None))).scalars())
+        for produto_id in bloco:
+            if produto_id in com_foto:
+                continue
+            orfas += 1
+            if not simular:
+                miniaturas.agenda(produto_id, None)
+    click.echo(f"{orfas} pastas de variantes sem foto"
+               + (" seriam removidas" if simular else " removidas"))
@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from src.importacao import ArquivoInvalido, conta_linhas, importa
+from src.models.produto import ConflitoDeEstoque, reconstroi_indice_de_busca
+from src.modules import db
+
+produtos_cli = AppGroup('produtos', help="Manutenção do cadastro de produtos")
+
+
+@produtos_cli.command('reindexar-busca')
+def reindexar_busca():
+    """Cria, se necessário, e reconstrói o índice de busca textual dos produtos."""
+    reconstroi_indice_de_busca()
+    db.session.commit()
+    click.echo("Índice de busca reconstruído")
+
+
+@produtos_cli.command('importar')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option('--atualizar', is_flag=True, default=False,
+              help="Atualiza os produtos já cadastrados com o mesmo nome, em vez de "
+                   "rejeitar as linhas")
+@click.option('--criar-categorias', is_flag=True, default=False,
+              help="Cadastra as categorias inexistentes, em vez de rejeitar as linhas")
+@click.option('--bloco', type=int, default=None,
+              help="Linhas por transação (padrão: IMPORTACAO_BLOCO)")
+@click.option('--processos', type=int, default=None,
+              help="Processos de validação; 0 valida neste processo "
+                   "(padrão: IMPORTACAO_PROCESSOS)")
+@click.option('--erros', type=click.Path(dir_okay=False, path_type=Path), default=None,
+              help="Arquivo CSV com as linhas rejeitadas (padrão: <arquivo>.erros.csv)")
+def importar(arquivo: Path, atualizar: bool, criar_categorias: bool, bloco: int | None,
+             processos: int | None, erros: Path | None):
+    """
+    Importa produtos de um arquivo CSV com as colunas nome, categoria e preco
+    e, opcionalmente, estoque, estoque_minimo e ativo.
+    """
+    config = current_app.config
+    erros = erros or arquivo.with_name(arquivo.stem + '.erros.csv')
+    bloco = bloco or config.get('IMPORTACAO_BLOCO', 5000)
+    processos = processos if processos is not None else \
+        config.get('IMPORTACAO_PROCESSOS', max(1, (os.cpu_count() or 2) // 2))
+
+    with click.progressbar(length=conta_linhas(arquivo), label="Produtos") as barra:
+        processadas = 0
+
+        def avanca(progresso):
+            nonlocal processadas
+            barra.update(progresso.linhas - processadas)
+            processadas = progresso.linhas
+
+        try:
+            progresso = importa(arquivo, erros,
+                                atualizar=atualizar,
+                                criar_categorias=criar_categorias,
+                                tamanho_bloco=bloco,
+                                processos=processos,
+                                ao_progredir=avanca)
+        except (ArquivoInvalido, ConflitoDeEstoque) as e:
+            db.session.rollback()
+            raise click.ClickException(str(e)) from e
+
+    click.echo(f"{progresso.linhas} linhas em {progresso.fim - progresso.inicio:.1f}s: "
+               f"{progresso.inseridos} produtos inseridos, {progresso.atualizados} "
+               f"atualizados e {progresso.rejeitados} linhas rejeitadas")
+    if progresso.categorias_criadas:
+        click.echo(f"{progresso.categorias_criadas} categorias criadas")
+    if progresso.rejeitados:
+        click.echo(f"Linhas rejeitadas em {erros}")
+    else:
+        erros.unlink(missing_ok=True)
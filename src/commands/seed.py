@@ -0,0 +1,172 @@
+import random
+import time
+import uuid
+from decimal import Decimal
+
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.security import generate_password_hash
+
+from src.models.categoria import Categoria
+from src.models.movimento import Movimento
+from src.models.produto import Produto, reconstroi_indice_de_busca, suspende_indice_de_busca
+from src.models.usuario import User
+from src.modules import db
+from src.utils import em_blocos, timestamp
+
+seed_cli = AppGroup('seed', help="Carga inicial e geração de dados sintéticos")
+
+TIPOS = ["Arroz", "Feijão", "Macarrão", "Café", "Açúcar", "Óleo", "Sabonete", "Detergente",
+         "Biscoito", "Refrigerante", "Suco", "Água Mineral", "Leite", "Iogurte", "Queijo",
+         "Presunto", "Pão de Forma", "Achocolatado", "Molho de Tomate", "Farinha de Trigo",
+         "Sabão em Pó", "Amaciante", "Desinfetante", "Papel Higiênico", "Creme Dental"]
+VARIANTES = ["Tradicional", "Integral", "Light", "Zero Açúcar", "Orgânico", "Premium",
+             "Econômico", "Sem Lactose", "Sem Glúten", "Extra Forte", "Suave", "Família"]
+MARCAS = ["Aurora", "Benassi", "Coop", "Dona Benta", "Elma", "Flora", "Granja Real", "Itambé",
+          "Jasmine", "Kerococo", "Limpol", "Minalba", "Nestlé", "Omo", "Pantera", "Quero",
+          "Sadia", "Tio João", "Ypê", "Vigor"]
+MEDIDAS = ["100g", "200g", "500g", "1kg", "2kg", "5kg", "200ml", "500ml", "1L", "1,5L", "2L",
+           "Lata 350ml", "Pacote 400g", "Caixa com 12", "Fardo com 6"]
+
+
+def _insere(tabela, linhas, tamanho: int) -> int:
+    # INSERT em executemany, sem passar pela unidade de trabalho do ORM
+    quantidade = 0
+    for bloco in em_blocos(linhas, tamanho):
+        db.session.execute(sa.insert(tabela), bloco)
+        quantidade += len(bloco)
+    return quantidade
+
+
+@seed_cli.command('inicial')
+def inicial():
+    """Cadastra os usuários padrão e o catálogo de exemplo, se o banco estiver vazio."""
+    config = current_app.config
+    agora = timestamp()
+    if User.is_empty():
+        usuarios = [
+            dict(nome="Administrador",
+                 email=config.get('DEFAULT_ADMIN_EMAIL', 'admin@admin.com.br'),
+                 senha=config.get('DEFAULT_ADMIN_PASSWORD', "123456"),
+                 ativo=True),
+            dict(nome="Usuário",
+                 email=config.get('DEFAULT_USER_EMAIL', 'user@user.com.br'),
+                 senha=config.get('DEFAULT_USER_PASSWORD', "123"),
+                 ativo=False)
+        ]
+        linhas = []
+        for usuario in usuarios:
+            current_app.logger.info("Adicionando usuário (%s:%s)", usuario.get('email'),
+                                    usuario.get('senha'))
+            novo_usuario = User()
+            novo_usuario.email = usuario.get('email')
+            novo_usuario.set_password(usuario.get('senha'))
+            linhas.append(dict(id=uuid.uuid4(),
+                               nome=usuario.get('nome'),
+                               email_normalizado=novo_usuario.email_normalizado,
+                               password_hash=novo_usuario.password_hash,
+                               email_validado=True,
+                               usa_2fa=False,
+                               ativo=usuario.get('ativo'),
+                               dta_validacao_email=agora))
+        _insere(User.__table__, linhas, 1000)
+
+    if Categoria.is_empty():
+        from src.models.seed import seed_data
+        categorias, produtos = [], []
+        for item in seed_data:
+            categoria_id = uuid.uuid4()
+            categorias.append(dict(id=categoria_id, nome=item["categoria"]))
+            produtos.extend(dict(id=uuid.uuid4(),
+                                 nome=p["nome"],
+                                 preco=Decimal(str(p["preco"])),
+                                 estoque=0,
+                                 estoque_minimo=0,
+                                 ativo=True,
+                                 possui_foto=False,
+                                 categoria_id=categoria_id)
+                            for p in item["produtos"])
+        _insere(Categoria.__table__, categorias, 1000)
+        _insere(Produto.__table__, produtos, 1000)
+        current_app.logger.info("Adicionadas %d categorias e %d produtos",
+                                len(categorias), len(produtos))
+    db.session.commit()
+
+
+@seed_cli.command('sintetico')
+@click.option('--categorias', default=50, show_default=True, help="Categorias a gerar")
+@click.option('--produtos', default=100_000, show_default=True, help="Produtos a gerar")
+@click.option('--usuarios', default=100, show_default=True, help="Usuários a gerar")
+@click.option('--semente', default=2024, show_default=True,
+              help="Semente do gerador; a mesma semente gera os mesmos dados")
+@click.option('--senha', default="senha123", show_default=True,
+              help="Senha de todos os usuários gerados")
+@click.option('--lote', default=20_000, show_default=True,
+              help="Linhas por INSERT em executemany")
+def sintetico(categorias: int, produtos: int, usuarios: int, semente: int, senha: str,
+              lote: int):
+    """Gera um catálogo sintético determinístico, em uma única transação."""
+    aleatorio = random.Random(semente)
+    inicio = time.perf_counter()
+    try:
+        _gera_sintetico(aleatorio, categorias, produtos, usuarios, senha, lote)
+    except sa.exc.IntegrityError as e:
+        db.session.rollback()
+        raise click.ClickException("Os dados desta semente já foram gerados neste banco; "
+                                   "use outra semente") from e
+    db.session.commit()
+    click.echo(f"{categorias} categorias, {produtos} produtos e {usuarios} usuários gerados "
+               f"em {time.perf_counter() - inicio:.1f}s")
+
+
+def _gera_sintetico(aleatorio: random.Random, categorias: int, produtos: int, usuarios: int,
+                    senha: str, lote: int):
+    def novo_uuid() -> uuid.UUID:
+        return uuid.UUID(int=aleatorio.getrandbits(128), version=4)
+
+    ids_categorias = [novo_uuid() for _ in range(categorias)]
+    _insere(Categoria.__table__,
+            (dict(id=categoria_id, nome=f"Categoria {numero:04d}")
+             for numero, categoria_id in enumerate(ids_categorias, start=1)),
+            lote)
+
+    def gera_produtos():
+        for numero in range(1, produtos + 1):
+            yield dict(id=novo_uuid(),
+                       nome=f"{aleatorio.choice(TIPOS)} {aleatorio.choice(VARIANTES)} "
+                            f"{aleatorio.choice(MARCAS)} {aleatorio.choice(MEDIDAS)} #{numero}",
+                       preco=Decimal(aleatorio.randint(50, 50_000)) / 100,
+                       estoque=aleatorio.randint(0, 500),
+                       estoque_minimo=aleatorio.randint(0, 20),
+                       ativo=aleatorio.random() > 0.05,
+                       possui_foto=False,
+                       categoria_id=aleatorio.choice(ids_categorias))
+
+    suspende_indice_de_busca()
+    with click.progressbar(length=produtos, label="Produtos") as barra:
+        for bloco in em_blocos(gera_produtos(), lote):
+            db.session.execute(sa.insert(Produto.__table__), bloco)
+            Movimento.registra([Movimento.linha(produto['id'], produto['estoque'],
+                                                tipo=Movimento.AJUSTE, origem='carga sintética')
+                                for produto in bloco if produto['estoque']])
+            barra.update(len(bloco))
+    reconstroi_indice_de_busca()
+
+    # Calcular um hash por usuário dominaria o tempo da carga; todos
+    # compartilham a mesma senha e, portanto, o mesmo hash
+    password_hash = generate_password_hash(
+        senha, method=current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt'))
+    agora = timestamp()
+    _insere(User.__table__,
+            (dict(id=novo_uuid(),
+                  nome=f"Usuário {numero:06d}",
+                  email_normalizado=f"usuario{numero:06d}@exemplo.com.br",
+                  password_hash=password_hash,
+                  email_validado=True,
+                  usa_2fa=False,
+                  ativo=True,
+                  dta_validacao_email=agora)
+             for numero in range(1, usuarios + 1)),
+            lote)
@@ -0,0 +1,26 @@
+import click
+from flask.cli import AppGroup
+
+from src.models.usuario import User
+
+usuarios_cli = AppGroup('usuarios', help="Usuários do sistema")
+
+
+@usuarios_cli.command('token')
+@click.argument('email')
+@click.option('--dias', default=30, show_default=True, type=click.IntRange(min=1),
+              help="Validade do token")
+def token(email: str, dias: int):
+    """Emite um token de acesso à API para o usuário, enviado no cabeçalho
+    'Authorization: Bearer'."""
+    from email_validator import EmailNotValidError
+
+    try:
+        usuario = User.get_by_email(email)
+    except EmailNotValidError as e:
+        raise click.BadParameter(str(e), param_hint='EMAIL') from e
+    if usuario is None:
+        raise click.ClickException(f"Não há usuário com o email {email}")
+    if not usuario.is_active:
+        raise click.ClickException(f"O usuário {email} está desativado")
+    click.echo(usuario.create_jwt_token('api', expires_in=dias * 24 * 60 * 60))
@@ -0,0 +1,179 @@
+import csv
+import io
+import re
+import zipfile
+import zlib
+from decimal import Decimal
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape
+
+import sqlalchemy as sa
+
+from src.models.categoria import Categoria
+from src.models.produto import Produto
+
+# Colunas exportadas, na ordem das planilhas. Apenas colunas escalares: as da
+# foto nunca são lidas
+COLUNAS = (
+    ('id', "Identificador", Produto.id),
+    ('nome', "Nome", Produto.nome),
+    ('categoria', "Categoria", Categoria.nome),
+    ('preco', "Preço", Produto.preco),
+    ('estoque', "Estoque", Produto.estoque),
+    ('estoque_minimo', "Estoque mínimo", Produto.estoque_minimo),
+    ('ativo', "Ativo", Produto.ativo),
+)
+
+# Bytes acumulados antes de entregar um pedaço da resposta ao servidor
+TAMANHO_DO_PEDACO = 64 * 1024
+
+# Caracteres de controle que não podem aparecer em um documento XML
+_INVALIDOS_NO_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Início de um texto que o Excel e o LibreOffice interpretam como fórmula ao
+# abrir um CSV (https://owasp.org/www-community/attacks/CSV_Injection)
+_INICIO_DE_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def consulta_de_estoque(bloco: int = 1000):
+    """
+    Produtos com o nome da categoria em uma única consulta, na ordem do nome.
+    Com yield_per, as linhas são lidas do cursor em blocos de 'bloco'
+    """
+    return (sa.select(*[coluna.label(nome) for nome, _, coluna in COLUNAS]).
+            outerjoin(Categoria, Categoria.id == Produto.categoria_id).
+            order_by(Produto.nome, Produto.id).
+            execution_options(yield_per=bloco))
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return ''
+    # Nomes de produtos e categorias são digitados pelos usuários: um texto
+    # que começaria uma fórmula ganha um apóstrofo na frente, o que faz a
+    # planilha exibi-lo como texto. Os números não são alterados
+    if isinstance(valor, str) and valor.startswith(_INICIO_DE_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def gera_csv(linhas: Iterable, separador: str = ',') -> Iterator[bytes]:
+    """CSV em UTF-8, com BOM para que o Excel reconheça a codificação."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=separador, lineterminator='\r\n')
+    buffer.write('﻿')
+    escritor.writerow([titulo for _, titulo, _ in COLUNAS])
+    for linha in linhas:
+        escritor.writerow([_valor_csv(valor) for valor in linha])
+        if buffer.tell() >= TAMANHO_DO_PEDACO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def comprime_gzip(pedacos: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for pedaco in pedacos:
+        if comprimido := compressor.compress(pedaco):
+            yield comprimido
+    yield compressor.flush()
+
+
+class _Saida(io.RawIOBase):
+    """Destino do ZipFile que apenas acumula o que foi escrito até ser lido."""
+
+    def __init__(self):
+        super().__init__()
+        self._pedacos = []
+        self.tamanho = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._pedacos.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def esvazia(self) -> bytes:
+        dados = b''.join(self._pedacos)
+        self._pedacos.clear()
+        self.tamanho = 0
+        return dados
+
+
+_XLSX_FIXOS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" Type="http://schemas.openxmlformats.org'
+        '/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Produtos" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" Type="http://schemas.'
+        'openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+
+
+def _celula(valor) -> str:
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, bool):
+        return f'<c t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c><v>{valor}</v></c>'
+    # Os textos vão sempre como inline string, nunca como fórmula (<f>): um nome
+    # começando com '=' é exibido exatamente como foi digitado
+    texto = escape(_INVALIDOS_NO_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def gera_xlsx(linhas: Iterable) -> Iterator[bytes]:
+    """
+    Planilha XLSX gerada enquanto as linhas chegam, sem biblioteca externa:
+    o ZipFile escreve em um destino sem seek (com os tamanhos nos data
+    descriptors) e o que ele produz é entregue a cada TAMANHO_DO_PEDACO. Os
+    textos vão como inline strings, dispensando a tabela de strings
+    compartilhadas, que exigiria manter todos os valores na memória
+    """
+    saida = _Saida()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo:
+        for nome, conteudo in _XLSX_FIXOS.items():
+            arquivo.writestr(nome, conteudo)
+        yield saida.esvazia()
+
+        # force_zip64: o tamanho final da planilha não é conhecido de antemão
+        with arquivo.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>')
+            cabecalho = ''.join(_celula(titulo) for _, titulo, _ in COLUNAS)
+            planilha.write(f'<row>{cabecalho}</row>'.encode('utf-8'))
+            for linha in linhas:
+                planilha.write(f"<row>{''.join(map(_celula, linha))}</row>".encode('utf-8'))
+                if saida.tamanho >= TAMANHO_DO_PEDACO:
+                    yield saida.esvazia()
+            planilha.write(b'</sheetData></worksheet>')
+    yield saida.esvazia()
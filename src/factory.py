@@ -2,20 +2,30 @@ import json
 import logging
 import os
 import sys
+import time
 import uuid
 
 from flask import Flask, render_template
+from jinja2 import FileSystemBytecodeCache
 from flask_login import user_logged_in
 
 import src.routes.auth
-from src.models.produto import Produto
-from src.models.categoria import Categoria
 from src.models.usuario import User
-from src.modules import bootstrap, csrf, db, login, mail, minify
-from src.utils import as_localtime, existe_esquema, timestamp
+from src.modules import assets, blobstore, bootstrap, csrf, db, fragment_cache, importacoes, \
+    login, mail, metrics, miniaturas, minify, outbox, profiling, user_cache
+from src.utils import as_localtime, configura_sqlite, existe_esquema, timestamp
 
 
 def create_app(config_filename: str = 'config.dev.json') -> Flask:
+    inicio = anterior = time.perf_counter()
+    tempos = {}
+
+    def etapa(nome: str):
+        nonlocal anterior
+        agora = time.perf_counter()
+        tempos[nome] = agora - anterior
+        anterior = agora
+
     # Desativar as mensagens do servidor HTTP
     # https://stackoverflow.com/a/18379764
     logging.getLogger('werkzeug').setLevel(logging.ERROR)
@@ -45,13 +55,19 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
     except FileNotFoundError:
         app.logger.critical("O arquivo de configuração '%s' não existe", config_filename)
         sys.exit(1)
+    etapa('configuração')
 
     app.logger.debug("Registrando as extensões")
     bootstrap.init_app(app)
-    minificar = app.config.get("MINIFY", False)
+    assets.init_app(app)
+    # Os templates gerados por 'flask assets build' já estão minificados
+    minificar = app.config.get("MINIFY", False) and not assets.construido
     if minificar:
         minify.init_app(app)
     db.init_app(app)
+    # Antes das demais, para que as medições incluam os ganchos registrados por elas
+    profiling.init_app(app)
+    metrics.init_app(app)
     csrf.init_app(app)
     login.init_app(app)
     login.login_view = 'auth.login'
@@ -59,6 +75,12 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
     login.login_message_category = 'warning'
     login.session_protection = 'strong'
     mail.init_app(app)
+    outbox.init_app(app)
+    blobstore.init_app(app)
+    miniaturas.init_app(app)
+    importacoes.init_app(app)
+    user_cache.init_app(app)
+    fragment_cache.init_app(app)
 
     @login.user_loader
     def load_user(user_id):
@@ -66,7 +88,23 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
             auth_id = uuid.UUID(str(user_id))
         except ValueError:
             return None
-        return User.get_by_id(auth_id)
+        usuario = user_cache.get(auth_id)
+        # Um usuário desativado perde as sessões já abertas
+        if usuario is None or not usuario.is_active:
+            return None
+        return usuario
+
+    @login.request_loader
+    def load_user_from_request(req):
+        # Sem sessão, a API aceita o token emitido por 'flask usuarios token'
+        # no cabeçalho 'Authorization: Bearer'
+        if req.blueprint != 'api' or req.authorization is None \
+                or req.authorization.type != 'bearer' or not req.authorization.token:
+            return None
+        usuario, action = User.verify_jwt_token(req.authorization.token)
+        if usuario is None or action != 'api' or not usuario.is_active:
+            return None
+        return usuario
 
     # noinspection PyUnusedLocal
     @user_logged_in.connect_via(app)
@@ -77,49 +115,22 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
         user.dta_acesso_atual = login_atual
         user.dta_ultimo_acesso = login_anterior or login_atual
 
+    etapa('extensões')
+
+    # Em produção (FAST_START), o banco já foi verificado na implantação e
+    # cada processo iniciado não precisa repetir as consultas
+    rapido = app.config.get('FAST_START', False)
     with app.app_context():
-        if not existe_esquema(app):
+        if not rapido and not existe_esquema(app):
             app.logger.critical("É necessário fazer a migração/upgrade do banco")
             sys.exit(1)
 
-        if User.is_empty():
-            usuarios = [
-                dict(nome="Administrador",
-                     email=app.config.get('DEFAULT_ADMIN_EMAIL', 'admin@admin.com.br'),
-                     senha=app.config.get('DEFAULT_ADMIN_PASSWORD', "123456"),
-                     ativo=True),
-                dict(nome="Usuário",
-                     email=app.config.get('DEFAULT_USER_EMAIL', 'user@user.com.br'),
-                     senha=app.config.get('DEFAULT_USER_PASSWORD', "123"),
-                     ativo=False)
-            ]
-            for usuario in usuarios:
-                app.logger.info("Adicionando usuário (%s:%s)", usuario.get('email'),
-                                usuario.get('senha'))
-                novo_usuario = User()
-                novo_usuario.nome = usuario.get('nome')
-                novo_usuario.email = usuario.get('email')
-                novo_usuario.set_password(usuario.get('senha'))
-                novo_usuario.email_validado = True
-                novo_usuario.usa_2fa = False
-                novo_usuario.ativo = usuario.get('ativo')
-                novo_usuario.dta_validacao_email = timestamp()
-                db.session.add(novo_usuario)
-                db.session.commit()
-
-        if Categoria.is_empty():
-            from src.models.seed import seed_data
-            for item in seed_data:
-                categoria = Categoria()
-                categoria.nome = item["categoria"]
-                db.session.add(categoria)
-                for p in item["produtos"]:
-                    produto = Produto()
-                    produto.nome = p["nome"]
-                    produto.preco = p["preco"]
-                    produto.categoria = categoria
-                    db.session.add(produto)
-                db.session.commit()
+        configura_sqlite(app)
+
+        if not rapido and User.is_empty():
+            app.logger.warning("Não há usuários cadastrados. Execute 'flask seed inicial' "
+                               "para a carga inicial do banco")
+    etapa('banco')
 
     @app.route('/')
     @app.route('/index')
@@ -128,14 +139,50 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
                                title="Página principal")
 
     app.logger.debug("Registrando as blueprints")
+    from src.routes.api import bp as api_bp
     from src.routes.auth import bp as auth_bp
     from src.routes.categoria import bp as categoria_bp
+    from src.routes.produto import bp as produto_bp
+    app.register_blueprint(api_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(categoria_bp)
+    app.register_blueprint(produto_bp)
+    etapa('blueprints')
+
+    app.logger.debug("Registrando os comandos")
+    from src.commands.assets import assets_cli
+    from src.commands.bench import bench_cli
+    from src.commands.emails import email_cli
+    from src.commands.estoque import estoque_cli
+    from src.commands.fotos import fotos_cli
+    from src.commands.produtos import produtos_cli
+    from src.commands.seed import seed_cli
+    from src.commands.usuarios import usuarios_cli
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(email_cli)
+    app.cli.add_command(estoque_cli)
+    app.cli.add_command(fotos_cli)
+    app.cli.add_command(produtos_cli)
+    app.cli.add_command(seed_cli)
+    app.cli.add_command(usuarios_cli)
+    etapa('comandos')
 
     # Formatando as datas para horário local
     # https://stackoverflow.com/q/65359968
     app.logger.debug("Registrando filtros no Jinja2")
     app.jinja_env.filters['as_localtime'] = as_localtime
 
+    # Templates compilados guardados em disco: um processo novo não precisa
+    # compilar de novo os templates que não mudaram
+    cache_de_templates = app.config.get('JINJA_BYTECODE_CACHE')
+    if cache_de_templates:
+        diretorio = os.path.join(app.instance_path, cache_de_templates)
+        os.makedirs(diretorio, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(diretorio)
+    etapa('templates')
+
+    app.logger.info("Aplicação criada em %.0fms (%s)", (time.perf_counter() - inicio) * 1000,
+                    ", ".join(f"{nome} {duracao * 1000:.0f}ms"
+                              for nome, duracao in tempos.items()))
     return app
@@ -0,0 +1,68 @@
+from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
+from wtforms.fields.choices import SelectField
+from wtforms.fields.numeric import DecimalField, IntegerField
+from wtforms.fields.simple import BooleanField, HiddenField, StringField, SubmitField, \
+    TextAreaField
+from wtforms.validators import DataRequired, InputRequired, Length, NumberRange
+
+
+class NovoEditProdutoForm(FlaskForm):
+    nome = StringField("Nome do produto",
+                       validators=[DataRequired("É obrigatório indicar o nome do produto"),
+                                   Length(max=100)])
+    categoria = SelectField("Categoria",
+                            validators=[InputRequired("Selecione a categoria do produto")])
+    preco = DecimalField("Preço",
+                         places=2,
+                         validators=[InputRequired("É obrigatório indicar o preço"),
+                                     NumberRange(min=0, message="O preço não pode ser negativo")])
+    estoque = IntegerField("Estoque",
+                           default=0,
+                           validators=[InputRequired("É obrigatório indicar o estoque"),
+                                       NumberRange(min=0,
+                                                   message="O estoque não pode ser negativo")])
+    estoque_minimo = IntegerField("Estoque mínimo",
+                                  default=0,
+                                  description="Abaixo ou igual a este valor o produto aparece "
+                                              "na lista de produtos em falta",
+                                  validators=[InputRequired("É obrigatório indicar o estoque "
+                                                            "mínimo"),
+                                              NumberRange(min=0,
+                                                          message="O estoque mínimo não pode "
+                                                                  "ser negativo")])
+    ativo = BooleanField("Ativo", default=True)
+    foto = FileField("Foto do produto",
+                     validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'],
+                                             "Envie uma imagem JPEG, PNG, GIF ou WebP")])
+    remover_foto = BooleanField("Remover a foto atual")
+    # Versão do produto quando o formulário foi aberto, para detectar
+    # alterações feitas por outro usuário enquanto ele era preenchido
+    versao = HiddenField()
+
+    submit = SubmitField()
+
+
+class MovimentacaoEmLoteForm(FlaskForm):
+    linhas = TextAreaField("Movimentações",
+                           validators=[DataRequired("Informe ao menos uma movimentação")],
+                           description="Uma movimentação por linha, no formato "
+                                       "\"id do produto;quantidade\". Quantidades positivas "
+                                       "são compras e negativas são vendas",
+                           render_kw={'rows': 12, 'class': 'font-monospace'})
+
+    submit = SubmitField("Processar o lote")
+
+
+class ImportacaoForm(FlaskForm):
+    arquivo = FileField("Arquivo CSV",
+                        validators=[FileRequired("Selecione o arquivo a importar"),
+                                    FileAllowed(['csv', 'txt'], "Envie um arquivo CSV")],
+                        description="Com cabeçalho e as colunas nome, categoria e preco e, "
+                                    "opcionalmente, estoque, estoque_minimo e ativo. "
+                                    "Uma planilha exportada pelo sistema também pode ser "
+                                    "importada")
+    atualizar = BooleanField("Atualizar os produtos já cadastrados com o mesmo nome")
+    criar_categorias = BooleanField("Cadastrar as categorias inexistentes")
+
+    submit = SubmitField("Importar")
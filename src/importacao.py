@@ -0,0 +1,385 @@
+import csv
+import dataclasses
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Callable
+
+import sqlalchemy as sa
+
+OBRIGATORIAS = ('nome', 'categoria', 'preco')
+
+# Cabeçalhos aceitos para cada coluna: o nome do campo ou o título usado na
+# exportação, para que uma planilha exportada possa ser importada de volta
+CABECALHOS = {
+    'nome': 'nome',
+    'categoria': 'categoria',
+    'preco': 'preco', 'preço': 'preco',
+    'estoque': 'estoque',
+    'estoque_minimo': 'estoque_minimo', 'estoque mínimo': 'estoque_minimo',
+    'ativo': 'ativo',
+}
+VERDADEIROS = {'1', 'true', 'sim', 's', 'verdadeiro'}
+FALSOS = {'0', 'false', 'nao', 'não', 'n', 'falso'}
+
+# Tamanho das listas do IN na consulta dos produtos já cadastrados, abaixo
+# do limite de parâmetros por comando dos bancos
+CONSULTA_MAXIMA = 500
+
+
+class ArquivoInvalido(Exception):
+    pass
+
+
+@dataclass
+class Progresso:
+    situacao: str = 'processando'
+    linhas: int = 0
+    inseridos: int = 0
+    atualizados: int = 0
+    rejeitados: int = 0
+    categorias_criadas: int = 0
+    mensagem: str | None = None
+    inicio: float = dataclasses.field(default_factory=time.time)
+    fim: float | None = None
+
+
+def _inteiro(texto: str, campo: str) -> int:
+    if not texto:
+        return 0
+    try:
+        valor = int(texto)
+    except ValueError:
+        raise ValueError(f"{campo} não é um número inteiro") from None
+    if valor < 0:
+        raise ValueError(f"{campo} não pode ser negativo")
+    return valor
+
+
+def _preco(texto: str) -> Decimal:
+    # Aceita tanto 1234.56 quanto 1.234,56
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    try:
+        valor = Decimal(texto)
+    except InvalidOperation:
+        raise ValueError("Preço não é um número") from None
+    if not valor.is_finite() or valor < 0:
+        raise ValueError("Preço inválido")
+    if valor != valor.quantize(Decimal('0.01')):
+        raise ValueError("Preço com mais de duas casas decimais")
+    if valor >= Decimal('100000000'):
+        raise ValueError("Preço acima do máximo permitido")
+    return valor
+
+
+def _campo(valores: list[str], colunas: dict[str, int], nome: str) -> str:
+    posicao = colunas.get(nome)
+    if posicao is None or posicao >= len(valores):
+        return ''
+    return valores[posicao].strip()
+
+
+def valida_bloco(linhas: list[tuple[int, list[str]]], colunas: dict[str, int]):
+    """
+    Validação que não depende do banco, executada nos processos do pool.
+    Devolve as linhas válidas como (linha, nome, categoria, preço, estoque,
+    estoque mínimo, ativo) e as rejeitadas como (linha, motivo)
+    """
+    validas, rejeitadas = [], []
+    for numero, valores in linhas:
+        try:
+            nome = _campo(valores, colunas, 'nome')
+            if not nome:
+                raise ValueError("Nome não informado")
+            if len(nome) > 100:
+                raise ValueError("Nome com mais de 100 caracteres")
+            categoria = _campo(valores, colunas, 'categoria')
+            if not categoria:
+                raise ValueError("Categoria não informada")
+            if len(categoria) > 60:
+                raise ValueError("Categoria com mais de 60 caracteres")
+            preco = _preco(_campo(valores, colunas, 'preco'))
+            estoque = _inteiro(_campo(valores, colunas, 'estoque'), "Estoque")
+            estoque_minimo = _inteiro(_campo(valores, colunas, 'estoque_minimo'),
+                                      "Estoque mínimo")
+            ativo = _campo(valores, colunas, 'ativo').lower()
+            if ativo and ativo not in VERDADEIROS | FALSOS:
+                raise ValueError("Ativo deve ser sim ou não")
+        except ValueError as e:
+            rejeitadas.append((numero, str(e)))
+            continue
+        validas.append((numero, nome, categoria, preco, estoque, estoque_minimo,
+                        ativo not in FALSOS))
+    return validas, rejeitadas
+
+
+def _colunas(cabecalho: list[str]) -> dict[str, int]:
+    colunas = {}
+    for posicao, titulo in enumerate(cabecalho):
+        campo = CABECALHOS.get(titulo.strip().lower())
+        if campo is not None and campo not in colunas:
+            colunas[campo] = posicao
+    if faltando := [campo for campo in OBRIGATORIAS if campo not in colunas]:
+        raise ArquivoInvalido(f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+    return colunas
+
+
+def _separador(linha: str) -> str:
+    return max((';', ',', '\t'), key=linha.count)
+
+
+def conta_linhas(caminho: Path) -> int:
+    """Número de linhas de dados, para as barras de progresso."""
+    with open(caminho, 'rb') as arquivo:
+        quebras = sum(bloco.count(b'\n') for bloco in iter(lambda: arquivo.read(1 << 20), b''))
+    return max(0, quebras - 1)
+
+
+def _blocos_validados(leitor, colunas: dict[str, int], tamanho: int, processos: int):
+    # Importado aqui, e não no módulo, para que os processos do pool, que só
+    # executam valida_bloco, não carreguem as extensões da aplicação
+    from src.utils import em_blocos
+
+    # A linha 1 é o cabeçalho
+    numeradas = ((numero, valores) for numero, valores in enumerate(leitor, start=2)
+                 if any(valor.strip() for valor in valores))
+    blocos = em_blocos(numeradas, tamanho)
+
+    if processos == 0:
+        for bloco in blocos:
+            yield bloco, *valida_bloco(bloco, colunas)
+        return
+
+    # Poucos blocos em andamento por vez: o arquivo é lido conforme os
+    # resultados são consumidos, sem ficar inteiro na memória, e os blocos são
+    # devolvidos na ordem do arquivo
+    with ProcessPoolExecutor(max_workers=processos,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        pendentes = deque()
+        for bloco in blocos:
+            pendentes.append((bloco, executor.submit(valida_bloco, bloco, colunas)))
+            if len(pendentes) >= processos * 2:
+                bloco, futuro = pendentes.popleft()
+                yield bloco, *futuro.result()
+        while pendentes:
+            bloco, futuro = pendentes.popleft()
+            yield bloco, *futuro.result()
+
+
+def importa(caminho: Path,
+            erros: Path,
+            atualizar: bool = False,
+            criar_categorias: bool = False,
+            tamanho_bloco: int = 5000,
+            processos: int = 0,
+            ao_progredir: Callable[[Progresso], None] | None = None) -> Progresso:
+    """
+    Importa os produtos de um arquivo CSV com cabeçalho. A validação dos
+    valores roda em 'processos' processos (0 valida neste mesmo processo) e
+    a gravação é feita em blocos de 'tamanho_bloco' linhas, cada um em sua
+    própria transação, com um INSERT e, se 'atualizar', um UPDATE em
+    executemany. As categorias são resolvidas por um mapa carregado uma única
+    vez e os produtos já cadastrados (mesmo nome) são procurados uma vez por
+    bloco. Produtos existentes são atualizados ou rejeitados, conforme
+    'atualizar'. As linhas rejeitadas vão para 'erros', em CSV, com o motivo
+    """
+    from src.models.categoria import Categoria
+    from src.models.movimento import Movimento
+    from src.models.produto import ConflitoDeEstoque, Produto
+    from src.modules import db
+
+    produtos = Produto.__table__
+    categorias = {nome.casefold(): categoria_id for categoria_id, nome in
+                  db.session.execute(sa.select(Categoria.id, Categoria.nome))}
+    atualizacao = (sa.update(produtos).
+                   where(produtos.c.id == sa.bindparam('b_id'),
+                         produtos.c.estoque == sa.bindparam('b_estoque_anterior')).
+                   values(categoria_id=sa.bindparam('b_categoria_id'),
+                          preco=sa.bindparam('b_preco'),
+                          estoque=sa.bindparam('b_estoque'),
+                          estoque_minimo=sa.bindparam('b_estoque_minimo'),
+                          ativo=sa.bindparam('b_ativo'),
+                          versao=produtos.c.versao + 1))
+    vistos: dict[str, int] = {}
+    progresso = Progresso()
+
+    with open(caminho, newline='', encoding='utf-8-sig') as entrada, \
+            open(erros, 'w', newline='', encoding='utf-8-sig') as saida_de_erros:
+        separador = _separador(entrada.readline())
+        entrada.seek(0)
+        leitor = csv.reader(entrada, delimiter=separador)
+        cabecalho = next(leitor, None)
+        if cabecalho is None:
+            raise ArquivoInvalido("Arquivo vazio")
+        colunas = _colunas(cabecalho)
+        registro_de_erros = csv.writer(saida_de_erros, delimiter=separador)
+        registro_de_erros.writerow(['linha', 'motivo', *cabecalho])
+
+        for bloco, validas, rejeitadas in _blocos_validados(leitor, colunas, tamanho_bloco,
+                                                     processos):
+            novos, existentes, novas_categorias = [], {}, []
+            for numero, nome, categoria, preco, estoque, estoque_minimo, ativo in validas:
+                if (anterior := vistos.get(nome)) is not None:
+                    rejeitadas.append((numero, f"Nome repetido (linha {anterior})"))
+                    continue
+                categoria_id = categorias.get(categoria.casefold())
+                if categoria_id is None:
+                    if not criar_categorias:
+                        rejeitadas.append((numero, f"Categoria \"{categoria}\" inexistente"))
+                        continue
+                    categoria_id = uuid.uuid4()
+                    categorias[categoria.casefold()] = categoria_id
+                    novas_categorias.append(dict(id=categoria_id, nome=categoria))
+                vistos[nome] = numero
+                novos.append(dict(id=None, nome=nome, categoria_id=categoria_id, preco=preco,
+                                  estoque=estoque, estoque_minimo=estoque_minimo, ativo=ativo,
+                                  possui_foto=False, linha=numero))
+
+            nomes = [produto['nome'] for produto in novos]
+            for inicio in range(0, len(nomes), CONSULTA_MAXIMA):
+                sentenca = (sa.select(produtos.c.nome, produtos.c.id, produtos.c.estoque).
+                            where(produtos.c.nome.in_(nomes[inicio:inicio + CONSULTA_MAXIMA])))
+                for nome, produto_id, estoque in db.session.execute(sentenca):
+                    existentes[nome] = (produto_id, estoque)
+
+            insercoes, atualizacoes, movimentos = [], [], []
+            for produto in novos:
+                linha = produto.pop('linha')
+                existente = existentes.get(produto['nome'])
+                if existente is None:
+                    produto['id'] = uuid.uuid4()
+                    insercoes.append(produto)
+                    delta = produto['estoque']
+                elif atualizar:
+                    produto['id'], estoque_anterior = existente
+                    atualizacoes.append({f"b_{chave}": valor for chave, valor in produto.items()
+                                         if chave not in ('nome', 'possui_foto')} |
+                                        {'b_estoque_anterior': estoque_anterior})
+                    delta = produto['estoque'] - estoque_anterior
+                else:
+                    rejeitadas.append((linha, "Produto já cadastrado"))
+                    continue
+                if delta:
+                    movimentos.append(Movimento.linha(produto['id'], delta, tipo=Movimento.AJUSTE,
+                                                      origem='importação'))
+
+            if novas_categorias:
+                db.session.execute(sa.insert(Categoria.__table__), novas_categorias)
+            if insercoes:
+                db.session.execute(sa.insert(produtos), insercoes)
+            if atualizacoes:
+                if db.session.execute(atualizacao, atualizacoes).rowcount != len(atualizacoes):
+                    # O estoque foi alterado depois de lido; o movimento
+                    # registrado não corresponderia à alteração
+                    raise ConflitoDeEstoque("O estoque foi alterado durante a importação")
+            Movimento.registra(movimentos)
+            db.session.commit()
+
+            valores = dict(bloco)
+            for numero, motivo in sorted(rejeitadas):
+                registro_de_erros.writerow([numero, motivo, *valores[numero]])
+
+            progresso.linhas += len(bloco)
+            progresso.inseridos += len(insercoes)
+            progresso.atualizados += len(atualizacoes)
+            progresso.rejeitados += len(rejeitadas)
+            progresso.categorias_criadas += len(novas_categorias)
+            if ao_progredir is not None:
+                ao_progredir(progresso)
+
+    progresso.situacao = 'concluida'
+    progresso.fim = time.time()
+    return progresso
+
+
+class Importacoes:
+    """
+    Importações de produtos enviadas pela interface web. O arquivo é gravado
+    em instance/IMPORTACAO_DIR e processado por importa() em uma thread, que
+    registra o andamento em <id>.json, ao lado do arquivo de erros. Como o
+    estado fica em disco, a página de acompanhamento funciona em qualquer
+    processo do servidor
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.diretorio: Path | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('IMPORTACAO_DIR', 'importacoes')
+        app.config.setdefault('IMPORTACAO_BLOCO', 5000)
+        app.config.setdefault('IMPORTACAO_PROCESSOS', max(1, (os.cpu_count() or 2) // 2))
+        app.extensions['importacoes'] = self
+        self.diretorio = Path(app.instance_path) / app.config['IMPORTACAO_DIR']
+
+    def arquivo(self, importacao_id: str, extensao: str) -> Path:
+        return self.diretorio / f"{uuid.UUID(importacao_id).hex}.{extensao}"
+
+    def inicia(self, fluxo, atualizar: bool, criar_categorias: bool) -> str:
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        importacao_id = uuid.uuid4().hex
+        with open(self.arquivo(importacao_id, 'csv'), 'wb') as destino:
+            while bloco := fluxo.read(1 << 20):
+                destino.write(bloco)
+        self._registra(importacao_id, Progresso())
+        threading.Thread(target=self._executa,
+                         args=(importacao_id, atualizar, criar_categorias),
+                         name=f"importacao-{importacao_id}",
+                         daemon=True).start()
+        return importacao_id
+
+    def _executa(self, importacao_id: str, atualizar: bool, criar_categorias: bool):
+        from src.models.produto import ConflitoDeEstoque
+        from src.modules import db
+
+        arquivo = self.arquivo(importacao_id, 'csv')
+        config = self.app.config
+        with self.app.app_context():
+            try:
+                progresso = importa(arquivo, self.arquivo(importacao_id, 'erros.csv'),
+                                    atualizar=atualizar,
+                                    criar_categorias=criar_categorias,
+                                    tamanho_bloco=config['IMPORTACAO_BLOCO'],
+                                    processos=config['IMPORTACAO_PROCESSOS'],
+                                    ao_progredir=lambda p: self._registra(importacao_id, p))
+            except (ArquivoInvalido, ConflitoDeEstoque, UnicodeDecodeError, csv.Error) as e:
+                db.session.rollback()
+                progresso = Progresso(situacao='falhou', mensagem=str(e), fim=time.time())
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                db.session.rollback()
+                self.app.logger.error("Importação %s: %s", importacao_id, e)
+                progresso = Progresso(situacao='falhou', mensagem="Erro interno na importação",
+                                      fim=time.time())
+            finally:
+                arquivo.unlink(missing_ok=True)
+            self._registra(importacao_id, progresso)
+            self.app.logger.info("Importação %s %s: %d inseridos, %d atualizados, "
+                                 "%d rejeitados", importacao_id, progresso.situacao,
+                                 progresso.inseridos, progresso.atualizados,
+                                 progresso.rejeitados)
+
+    def _registra(self, importacao_id: str, progresso: Progresso):
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, prefix='.')
+        with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+            json.dump(dataclasses.asdict(progresso), arquivo)
+        os.replace(temporario, self.arquivo(importacao_id, 'json'))
+
+    def situacao(self, importacao_id: str) -> Progresso | None:
+        try:
+            return Progresso(**json.loads(self.arquivo(importacao_id, 'json').
+                                          read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            return None
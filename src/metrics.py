@@ -0,0 +1,264 @@
+import atexit
+import bisect
+import hmac
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from flask import abort, g, request
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+AJUDA = {
+    'http_requests_total': ("counter", "Requisições atendidas"),
+    'http_request_duration_seconds': ("histogram", "Tempo de atendimento das requisições"),
+    'auth_logins_total': ("counter", "Tentativas de login por resultado"),
+    'auth_2fa_verificacoes_total': ("counter", "Verificações do segundo fator por resultado"),
+    'db_pool_conexoes': ("gauge", "Conexões do pool do banco neste processo, por estado"),
+}
+
+
+def _escapa(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(pares) -> str:
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{chave}="{_escapa(valor)}"' for chave, valor in pares) + '}'
+
+
+class Metrics:
+    """
+    Métricas no formato texto do Prometheus em /metrics, ligadas por
+    METRICS: requisições e histograma de latência por blueprint, endpoint,
+    método e status, logins, verificações do segundo fator e o estado do
+    pool de conexões. O custo por requisição é o de alguns incrementos em
+    dicionários sob uma trava.
+
+    Com servidores de vários processos (METRICS_MULTIPROCESSO), cada
+    processo grava seus contadores em instance/METRICS_DIR/<pid>.json, no
+    máximo a cada METRICS_INTERVALO segundos, e a coleta soma os arquivos de
+    todos eles. O diretório deve ser esvaziado antes de iniciar o servidor.
+    A gravação é feita por uma thread de cada processo, e também quando ele
+    termina, para que um processo ocioso não deixe de registrar o último
+    intervalo.
+
+    /metrics só responde aos endereços de METRICS_IPS (endereços ou redes)
+    ou a quem enviar o cabeçalho 'Authorization: Bearer <METRICS_TOKEN>'.
+    Sem nenhum dos dois configurado, todas as requisições são recusadas.
+    Atrás de um proxy reverso, o endereço visto pela aplicação é o do proxy
+    (muitas vezes 127.0.0.1, no mesmo computador): colocá-lo em METRICS_IPS
+    libera /metrics para qualquer um que passe pelo proxy. Nesse caso, use
+    o token, ou aplique o ProxyFix do Werkzeug com o número de proxies
+    confiáveis, para que request.remote_addr seja o endereço do cliente
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ativo = False
+        self.buckets: tuple[float, ...] = BUCKETS_PADRAO
+        self.diretorio: Path | None = None
+        self._contadores: dict[tuple, int] = {}
+        self._histogramas: dict[tuple, list] = {}
+        self._trava = threading.Lock()
+        self._gravador_pid: int | None = None
+        self._redes: list = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('METRICS', False)
+        app.config.setdefault('METRICS_BUCKETS', list(BUCKETS_PADRAO))
+        app.config.setdefault('METRICS_MULTIPROCESSO', False)
+        app.config.setdefault('METRICS_DIR', 'metrics')
+        app.config.setdefault('METRICS_INTERVALO', 5)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_IPS', [])
+        app.extensions['metrics'] = self
+
+        self.ativo = app.config['METRICS']
+        if not self.ativo:
+            return
+
+        self.buckets = tuple(sorted(app.config['METRICS_BUCKETS']))
+        self._redes = [ipaddress.ip_network(rede, strict=False)
+                       for rede in app.config['METRICS_IPS'] or []]
+        if not self._redes and not app.config['METRICS_TOKEN']:
+            app.logger.warning("Metrics: sem METRICS_TOKEN nem METRICS_IPS, /metrics recusará "
+                               "todas as requisições")
+        if app.config['METRICS_MULTIPROCESSO']:
+            self.diretorio = Path(app.instance_path) / app.config['METRICS_DIR']
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            # A thread é iniciada na primeira requisição de cada processo, e
+            # não aqui, pois os servidores criam os processos com fork depois
+            # de carregar a aplicação
+            app.before_request(self._inicia_gravacao)
+        app.before_request(self._inicia)
+        app.after_request(self._finaliza)
+        app.add_url_rule('/metrics', 'metrics', self._exibe)
+
+    def conta(self, nome: str, quantidade: int = 1, **rotulos):
+        if not self.ativo:
+            return
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._trava:
+            self._contadores[chave] = self._contadores.get(chave, 0) + quantidade
+
+    def observa(self, nome: str, valor: float, **rotulos):
+        if not self.ativo:
+            return
+        chave = (nome, tuple(sorted(rotulos.items())))
+        posicao = bisect.bisect_left(self.buckets, valor)
+        with self._trava:
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                # contagem por faixa (não acumulada), soma e total
+                histograma = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._histogramas[chave] = histograma
+            histograma[0][posicao] += 1
+            histograma[1] += valor
+            histograma[2] += 1
+
+    def _inicia_gravacao(self):
+        pid = os.getpid()
+        if self._gravador_pid == pid:
+            return
+        with self._trava:
+            if self._gravador_pid == pid:
+                return
+            if self._gravador_pid is not None:
+                # Processo criado por fork: os valores herdados já estão no
+                # arquivo do processo pai
+                self._contadores.clear()
+                self._histogramas.clear()
+            self._gravador_pid = pid
+        threading.Thread(target=self._grava_periodicamente, name='metrics-gravacao',
+                         daemon=True).start()
+        atexit.register(self._grava)
+
+    def _grava_periodicamente(self):
+        pid = os.getpid()
+        while self._gravador_pid == pid:
+            time.sleep(self.app.config['METRICS_INTERVALO'])
+            try:
+                self._grava()
+            except OSError as e:
+                self.app.logger.error("Metrics: erro na gravação dos contadores: %s", e)
+
+    @staticmethod
+    def _inicia():
+        g._metrics_inicio = time.perf_counter()  # pylint: disable=protected-access
+
+    def _finaliza(self, response):
+        inicio = g.pop('_metrics_inicio', None)
+        if inicio is None:
+            return response
+        endpoint = request.endpoint or 'nenhum'
+        blueprint = request.blueprint or ''
+        self.conta('http_requests_total', blueprint=blueprint, endpoint=endpoint,
+                   method=request.method, status=response.status_code)
+        self.observa('http_request_duration_seconds', time.perf_counter() - inicio,
+                     blueprint=blueprint, endpoint=endpoint)
+        return response
+
+    def _estado(self) -> dict:
+        with self._trava:
+            return dict(contadores=[[nome, rotulos, valor]
+                                    for (nome, rotulos), valor in self._contadores.items()],
+                        histogramas=[[nome, rotulos, list(faixas), soma, total]
+                                     for (nome, rotulos), (faixas, soma, total)
+                                     in self._histogramas.items()])
+
+    def _grava(self):
+        destino = self.diretorio / f"{os.getpid()}.json"
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, prefix='.')
+        with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+            json.dump(self._estado(), arquivo)
+        os.replace(temporario, destino)
+
+    def _coleta(self) -> tuple[dict, dict]:
+        if self.diretorio is None:
+            estados = [self._estado()]
+        else:
+            self._grava()
+            estados = []
+            for arquivo in self.diretorio.glob('*.json'):
+                try:
+                    estados.append(json.loads(arquivo.read_text(encoding='utf-8')))
+                except (OSError, ValueError):
+                    continue
+
+        contadores, histogramas = {}, {}
+        for estado in estados:
+            for nome, rotulos, valor in estado['contadores']:
+                chave = (nome, tuple(map(tuple, rotulos)))
+                contadores[chave] = contadores.get(chave, 0) + valor
+            for nome, rotulos, faixas, soma, total in estado['histogramas']:
+                chave = (nome, tuple(map(tuple, rotulos)))
+                atual = histogramas.setdefault(chave, [[0] * len(faixas), 0.0, 0])
+                atual[0] = [a + b for a, b in zip(atual[0], faixas)]
+                atual[1] += soma
+                atual[2] += total
+        return contadores, histogramas
+
+    def _pool(self) -> list[tuple[str, tuple, int]]:
+        from src.modules import db
+
+        pool = db.engine.pool
+        # overflow() é negativo enquanto o pool não chegou ao seu tamanho
+        estados = (('tamanho', 'size'), ('em_uso', 'checkedout'), ('livres', 'checkedin'),
+                   ('overflow', 'overflow'))
+        return [('db_pool_conexoes', (('estado', estado), ('pid', os.getpid())),
+                 max(0, getattr(pool, metodo)()))
+                for estado, metodo in estados if hasattr(pool, metodo)]
+
+    def exporta(self) -> str:
+        contadores, histogramas = self._coleta()
+        linhas, declarados = [], set()
+
+        def declara(nome):
+            if nome not in declarados:
+                declarados.add(nome)
+                tipo, ajuda = AJUDA.get(nome, ("untyped", nome))
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+
+        for (nome, rotulos), valor in sorted(contadores.items()):
+            declara(nome)
+            linhas.append(f"{nome}{_rotulos(rotulos)} {valor}")
+        for (nome, rotulos), (faixas, soma, total) in sorted(histogramas.items()):
+            declara(nome)
+            acumulado = 0
+            for limite, quantidade in zip((*self.buckets, '+Inf'), faixas):
+                acumulado += quantidade
+                linhas.append(f"{nome}_bucket{_rotulos((*rotulos, ('le', limite)))} "
+                              f"{acumulado}")
+            linhas.append(f"{nome}_sum{_rotulos(rotulos)} {soma}")
+            linhas.append(f"{nome}_count{_rotulos(rotulos)} {total}")
+        for nome, rotulos, valor in self._pool():
+            declara(nome)
+            linhas.append(f"{nome}{_rotulos(rotulos)} {valor}")
+        return '\n'.join(linhas) + '\n'
+
+    def _autorizado(self) -> bool:
+        token = self.app.config['METRICS_TOKEN']
+        if token:
+            enviado = request.headers.get('Authorization', '')
+            if hmac.compare_digest(enviado.encode(), f"Bearer {token}".encode()):
+                return True
+        try:
+            endereco = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            return False
+        return any(endereco in rede for rede in self._redes)
+
+    def _exibe(self):
+        if not self._autorizado():
+            abort(403)
+        return self.exporta(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
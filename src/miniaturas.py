@@ -0,0 +1,122 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+# O Pillow é importado apenas nas funções que geram as variantes: este módulo
+# é carregado na inicialização da aplicação (as rotas usam MIME e o caminho
+# das variantes), mas só o pool de processos e os comandos processam imagens
+
+# Variantes geradas para cada foto: nome -> (largura e altura máximas, qualidade)
+VARIANTES = {
+    'thumb': ((96, 96), 70),
+    'card': ((320, 320), 78),
+    'full': ((1280, 1280), 85),
+}
+
+FORMATO = 'WEBP'
+MIME = 'image/webp'
+EXTENSAO = 'webp'
+
+logger = logging.getLogger(__name__)
+
+
+def nome_da_variante(chave: str, variante: str) -> str:
+    return f"{chave}-{variante}.{EXTENSAO}"
+
+
+def gera_variantes(origem: str,
+                   destino: str,
+                   chave: str,
+                   refazer: bool = False) -> list[str]:
+    # Executada nos processos do pool: recebe apenas caminhos e não toca no
+    # banco, para que possa rodar fora do contexto da aplicação
+    from PIL import Image, ImageOps
+
+    pasta = Path(destino)
+    pasta.mkdir(parents=True, exist_ok=True)
+    geradas = []
+    with Image.open(origem) as original:
+        imagem = ImageOps.exif_transpose(original)
+        modo = 'RGBA' if 'A' in imagem.getbands() or 'transparency' in imagem.info else 'RGB'
+        imagem = imagem.convert(modo)
+        for variante, (tamanho, qualidade) in VARIANTES.items():
+            final = pasta / nome_da_variante(chave, variante)
+            if final.is_file() and not refazer:
+                continue
+            copia = imagem.copy()
+            copia.thumbnail(tamanho, Image.Resampling.LANCZOS)
+            descritor, temporario = tempfile.mkstemp(dir=pasta, prefix='.variante-')
+            with os.fdopen(descritor, 'wb') as arquivo:
+                copia.save(arquivo, FORMATO, quality=qualidade, method=4)
+            os.replace(temporario, final)
+            geradas.append(variante)
+    # Variantes de fotos anteriores do mesmo produto não são mais usadas
+    for arquivo in pasta.iterdir():
+        if not arquivo.name.startswith((chave, '.')):
+            arquivo.unlink(missing_ok=True)
+    return geradas
+
+
+def _registra_falha(futuro: Future):
+    if (erro := futuro.exception()) is not None:
+        logger.error("Falha na geração das miniaturas: %s", erro)
+
+
+class Miniaturas:
+    """
+    Gera as variantes redimensionadas das fotos dos produtos em um pool de
+    processos, para que as requisições não esperem pelo processamento das
+    imagens. As variantes ficam em <blobstore>/variantes/<id do produto>/
+    """
+
+    def __init__(self, app=None):
+        self.blobstore = None
+        self.diretorio: Path | None = None
+        self.processos = 0
+        self._executor: ProcessPoolExecutor | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.blobstore = app.extensions['blobstore']
+        self.diretorio = self.blobstore.diretorio / 'variantes'
+        self.processos = app.config.get('MINIATURAS_PROCESSOS', max(1, (os.cpu_count() or 2) // 2))
+        app.extensions['miniaturas'] = self
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # 'spawn' evita copiar, via fork, as threads e conexões do servidor
+            self._executor = ProcessPoolExecutor(max_workers=self.processos,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def pasta(self, produto_id) -> Path:
+        return self.diretorio / str(produto_id)
+
+    def caminho(self, produto_id, chave: str, variante: str) -> Path | None:
+        if variante not in VARIANTES:
+            return None
+        return self.pasta(produto_id) / nome_da_variante(chave, variante)
+
+    def agenda(self, produto_id, chave: str | None, refazer: bool = False) -> Future | None:
+        if not chave:
+            shutil.rmtree(self.pasta(produto_id), ignore_errors=True)
+            return None
+        argumentos = (str(self.blobstore.caminho(chave)), str(self.pasta(produto_id)),
+                      chave, refazer)
+        if self.processos == 0:
+            from PIL import Image
+
+            try:
+                gera_variantes(*argumentos)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                logger.error("Falha na geração das miniaturas: %s", e)
+            return None
+        futuro = self.executor.submit(gera_variantes, *argumentos)
+        futuro.add_done_callback(_registra_falha)
+        return futuro
@@ -1,3 +1,4 @@
+import datetime
 import uuid
 from typing import Optional, Self
 
@@ -6,6 +7,7 @@ from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.types import DateTime
 
 from src.modules import db
+from src.utils import timestamp
 
 
 class TimeStampMixin:
@@ -16,12 +18,26 @@ class TimeStampMixin:
     dta_cadastro: Mapped[DateTime] = mapped_column(DateTime,
                                                    server_default=sa.func.now(),
                                                    nullable=False)
-    # pylint: disable=not-callable
+    # Gerada no Python, com microssegundos: func.now() no SQLite tem resolução
+    # de segundos, e duas alterações no mesmo segundo teriam a mesma data, o
+    # que invalidaria a marca de alteração usada pelo GET condicional
     dta_atualizacao: Mapped[Optional[DateTime]] = mapped_column(DateTime,
-                                                                onupdate=sa.func.now(),
-                                                                default=sa.func.now(),
+                                                                onupdate=timestamp,
+                                                                default=timestamp,
                                                                 nullable=True)
 
+    @classmethod
+    def marca_de_alteracao(cls) -> tuple[int, datetime.datetime | None]:
+        """Quantidade de linhas e última alteração da tabela."""
+        # Em subconsultas separadas, o SQLite otimiza cada agregação: o count
+        # conta as páginas do menor índice e o max lê só a ponta do índice de
+        # dta_atualizacao. Juntas no mesmo SELECT, a tabela seria percorrida
+        # pylint: disable=not-callable
+        return tuple(db.session.execute(
+            sa.select(sa.select(sa.func.count()).select_from(cls).scalar_subquery(),
+                      sa.select(sa.func.max(cls.dta_atualizacao)).scalar_subquery())
+        ).one())
+
 
 class BasicRepositoryMixin:
     @classmethod
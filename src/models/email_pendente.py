@@ -0,0 +1,49 @@
+import datetime
+import json
+from typing import Optional
+
+from sqlalchemy import DateTime, Index, Integer, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.base_mixin import BasicRepositoryMixin, TimeStampMixin
+from src.modules import db
+
+
+class EmailPendente(db.Model, TimeStampMixin, BasicRepositoryMixin):
+    """
+    Caixa de saída dos emails do sistema. A mensagem é gravada na mesma
+    transação da alteração que a originou e enviada depois pelos workers
+    do Outbox. Mensagens que esgotam as tentativas ficam com a situação
+    'falhou' (dead letter) para análise e reenvio manual
+    """
+    __tablename__ = 'emails_pendentes'
+    __table_args__ = (
+        Index('ix_emails_pendentes_situacao_proxima', 'situacao', 'proxima_tentativa'),
+    )
+
+    PENDENTE = 'pendente'
+    ENVIANDO = 'enviando'
+    ENVIADO = 'enviado'
+    FALHOU = 'falhou'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    destinatarios: Mapped[str] = mapped_column(Text, nullable=False)
+    assunto: Mapped[str] = mapped_column(String(255), nullable=False)
+    corpo: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    message_id: Mapped[str] = mapped_column(String(255), nullable=False)
+
+    situacao: Mapped[str] = mapped_column(String(16), nullable=False, default=PENDENTE)
+    tentativas: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    proxima_tentativa: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False)
+    reservado_por: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    dta_reserva: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, nullable=True)
+    dta_envio: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, nullable=True)
+    ultimo_erro: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    @property
+    def lista_de_destinatarios(self) -> list[str]:
+        return json.loads(self.destinatarios)
+
+    @lista_de_destinatarios.setter
+    def lista_de_destinatarios(self, valor: list[str]):
+        self.destinatarios = json.dumps(list(valor))
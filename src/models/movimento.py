@@ -0,0 +1,165 @@
+import datetime
+import uuid
+from typing import Optional
+
+import sqlalchemy as sa
+from sqlalchemy import DateTime, Index, Integer, String, Uuid
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.modules import db
+from src.utils import timestamp
+
+
+class Movimento(db.Model):
+    """
+    Livro de movimentações de estoque, apenas com inclusões: toda alteração
+    de Produto.estoque grava aqui a quantidade (positiva nas entradas e
+    negativa nas saídas), de modo que o estoque de um produto é a soma das
+    suas movimentações. O produto não é chave estrangeira, pois o histórico
+    é mantido mesmo depois que ele é removido
+    """
+    __tablename__ = 'movimentos'
+    __table_args__ = (
+        # Histórico de um produto e saldo de um produto em uma data
+        Index('ix_movimentos_produto_data', 'produto_id', 'dta_movimento'),
+        # Movimentações de um período, para os instantâneos e os resumos
+        Index('ix_movimentos_data', 'dta_movimento'),
+    )
+
+    COMPRA = 'compra'
+    VENDA = 'venda'
+    AJUSTE = 'ajuste'
+    TRANSFERENCIA = 'transferencia'
+    TIPOS = (COMPRA, VENDA, AJUSTE, TRANSFERENCIA)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    produto_id: Mapped[uuid.UUID] = mapped_column(Uuid(as_uuid=True), nullable=False)
+    tipo: Mapped[str] = mapped_column(String(16), nullable=False)
+    quantidade: Mapped[int] = mapped_column(Integer, nullable=False)
+    dta_movimento: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False,
+                                                             default=timestamp)
+    usuario_id: Mapped[Optional[uuid.UUID]] = mapped_column(Uuid(as_uuid=True), nullable=True)
+    # Onde a movimentação foi feita: 'lote', 'cadastro', 'importação', ...
+    origem: Mapped[Optional[str]] = mapped_column(String(60), nullable=True)
+
+    @classmethod
+    def linha(cls, produto_id, quantidade: int, tipo: str | None = None,
+              origem: str | None = None, usuario_id=None, dta_movimento=None) -> dict:
+        """Valores de uma movimentação, para inclusões em executemany."""
+        if tipo is None:
+            tipo = cls.COMPRA if quantidade > 0 else cls.VENDA
+        return dict(produto_id=produto_id, tipo=tipo, quantidade=quantidade,
+                    dta_movimento=dta_movimento or timestamp(), usuario_id=usuario_id,
+                    origem=origem)
+
+    @classmethod
+    def registra(cls, linhas: list[dict], tamanho_lote: int = 5000):
+        """Inclui as movimentações na transação corrente, sem passar pelo ORM."""
+        for inicio in range(0, len(linhas), tamanho_lote):
+            db.session.execute(sa.insert(cls.__table__), linhas[inicio:inicio + tamanho_lote])
+
+    @classmethod
+    def estoque_em(cls, instante: datetime.datetime,
+                   produto_ids: list | None = None) -> dict[uuid.UUID, int]:
+        """
+        Estoque de cada produto (ou apenas dos 'produto_ids') no instante
+        indicado: o último instantâneo anterior a ele mais as movimentações
+        feitas desde então, sem percorrer o livro inteiro
+        """
+        saldos = _saldos_em(instante, produto_ids)
+        return {produto_id: estoque for produto_id, estoque in db.session.execute(saldos)}
+
+    @classmethod
+    def resumo_do_periodo(cls, inicio: datetime.datetime, fim: datetime.datetime,
+                          produto_ids: list | None = None) -> dict[uuid.UUID, dict]:
+        """
+        Por produto: estoque no início e no fim do período e o total de cada
+        tipo de movimentação em (inicio, fim]
+        """
+        resumo = {}
+        for produto_id, estoque in cls.estoque_em(inicio, produto_ids).items():
+            resumo[produto_id] = dict(inicial=estoque, final=estoque,
+                                      **dict.fromkeys(cls.TIPOS, 0))
+        sentenca = (sa.select(cls.produto_id, cls.tipo, sa.func.sum(cls.quantidade)).
+                    where(cls.dta_movimento > inicio, cls.dta_movimento <= fim).
+                    group_by(cls.produto_id, cls.tipo))
+        if produto_ids is not None:
+            sentenca = sentenca.where(cls.produto_id.in_(produto_ids))
+        for produto_id, tipo, quantidade in db.session.execute(sentenca):
+            linha = resumo.setdefault(produto_id, dict(inicial=0, final=0,
+                                                       **dict.fromkeys(cls.TIPOS, 0)))
+            linha[tipo] += quantidade
+            linha['final'] += quantidade
+        return resumo
+
+    @classmethod
+    def divergencias(cls, completo: bool = False):
+        """
+        Consulta dos produtos cujo estoque difere do saldo do livro, com as
+        colunas id, nome, estoque e saldo. Com 'completo', o saldo é somado
+        desde a primeira movimentação, sem partir dos instantâneos
+        """
+        from src.models.produto import Produto
+
+        livro = _saldos_em(timestamp(), instantaneos=not completo).subquery()
+        saldo = sa.func.coalesce(livro.c.estoque, 0)
+        return (sa.select(Produto.id, Produto.nome, Produto.estoque, saldo.label('saldo')).
+                outerjoin(livro, livro.c.produto_id == Produto.id).
+                where(Produto.estoque != saldo).
+                order_by(Produto.nome, Produto.id))
+
+
+class SaldoDeEstoque(db.Model):
+    """
+    Instantâneo do estoque de cada produto em 'dta_corte', calculado a partir
+    do instantâneo anterior e das movimentações entre os dois. As consultas
+    do estoque em uma data partem do instantâneo mais próximo e somam apenas
+    as movimentações posteriores a ele
+    """
+    __tablename__ = 'saldos_de_estoque'
+
+    dta_corte: Mapped[datetime.datetime] = mapped_column(DateTime, primary_key=True)
+    produto_id: Mapped[uuid.UUID] = mapped_column(Uuid(as_uuid=True), primary_key=True)
+    estoque: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    @classmethod
+    def anterior_a(cls, instante: datetime.datetime) -> datetime.datetime | None:
+        return db.session.execute(
+            sa.select(sa.func.max(cls.dta_corte)).where(cls.dta_corte <= instante)
+        ).scalar_one()
+
+    @classmethod
+    def gera(cls, corte: datetime.datetime) -> int:
+        """
+        Grava o instantâneo de 'corte', substituindo um já existente, e
+        devolve a quantidade de produtos. O commit é responsabilidade de quem
+        chama
+        """
+        db.session.execute(sa.delete(cls).where(cls.dta_corte == corte))
+        saldos = _saldos_em(corte).subquery()
+        resultado = db.session.execute(
+            sa.insert(cls).from_select(['dta_corte', 'produto_id', 'estoque'],
+                                       sa.select(sa.literal(corte, DateTime),
+                                                 saldos.c.produto_id,
+                                                 saldos.c.estoque)))
+        return resultado.rowcount
+
+
+def _saldos_em(instante: datetime.datetime, produto_ids: list | None = None,
+               instantaneos: bool = True):
+    anterior = SaldoDeEstoque.anterior_a(instante) if instantaneos else None
+    partes = []
+    movimentos = (sa.select(Movimento.produto_id, Movimento.quantidade.label('quantidade')).
+                  where(Movimento.dta_movimento <= instante))
+    if anterior is not None:
+        partes.append(sa.select(SaldoDeEstoque.produto_id,
+                                SaldoDeEstoque.estoque.label('quantidade')).
+                      where(SaldoDeEstoque.dta_corte == anterior))
+        movimentos = movimentos.where(Movimento.dta_movimento > anterior)
+    partes.append(movimentos)
+    if produto_ids is not None:
+        partes = [parte.where(parte.selected_columns.produto_id.in_(produto_ids))
+                  for parte in partes]
+    uniao = sa.union_all(*partes).subquery()
+    return (sa.select(uniao.c.produto_id, sa.func.sum(uniao.c.quantidade).label('estoque')).
+            group_by(uniao.c.produto_id))
@@ -1,32 +1,395 @@
+import random
+import re
+import time
 import uuid
-from typing import Optional
+from typing import NamedTuple, Optional, Self
 
-from sqlalchemy import Boolean, DECIMAL, ForeignKey, Integer, String, Text, Uuid
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+import sqlalchemy as sa
+from sqlalchemy import Boolean, DECIMAL, ForeignKey, Index, Integer, String, Uuid
+from sqlalchemy.orm import joinedload, Mapped, mapped_column, relationship
 
 from src.models.base_mixin import BasicRepositoryMixin, TimeStampMixin
-from src.modules import db
+from src.models.movimento import Movimento
+from src.modules import blobstore, db
+
+
+class ItemDeLote(NamedTuple):
+    linha: int
+    produto_id: uuid.UUID
+    delta: int
+
+
+class FalhaDeLote(NamedTuple):
+    linha: int
+    produto_id: uuid.UUID | None
+    delta: int | None
+    motivo: str
+
+
+class ConflitoDeEstoque(Exception):
+    pass
+
+
+class EstoqueInsuficiente(Exception):
+    pass
+
+
+class ResultadoDaMovimentacao(NamedTuple):
+    estoque: int
+    tentativas: int
 
 
 class Produto(db.Model, TimeStampMixin, BasicRepositoryMixin):
     __tablename__ = 'produtos'
+    # Índice composto usado pela paginação por cursor da listagem, que
+    # ordena por (nome, id). Também atende às buscas pelo prefixo do nome.
+    __table_args__ = (
+        Index('ix_produtos_nome_id', 'nome', 'id'),
+        # max(dta_atualizacao) do GET condicional sem percorrer a tabela
+        Index('ix_produtos_dta_atualizacao', 'dta_atualizacao'),
+    )
+
     id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True),
                                      primary_key=True,
                                      default=uuid.uuid4)
-    nome: Mapped[str] = mapped_column(String(100), nullable=False, index=True)
+    nome: Mapped[str] = mapped_column(String(100), nullable=False)
     preco: Mapped[DECIMAL] = mapped_column(DECIMAL(10, 2), default=0.00)
     estoque: Mapped[Integer] = mapped_column(Integer, nullable=False, default=0)
+    # Ponto de reposição: o produto está "em falta" quando o estoque chega a
+    # este valor
+    estoque_minimo: Mapped[Integer] = mapped_column(Integer, nullable=False, default=0,
+                                                    server_default='0')
     ativo: Mapped[Boolean] = mapped_column(Boolean, default=True)
 
     categoria_id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True),
                                                ForeignKey('categorias.id'))
 
-    foto_base64: Mapped[Optional[Text]] = mapped_column(Text,
-                                                        nullable=True)
+    # A foto fica no BlobStore; aqui apenas o hash (sha256) do conteúdo, para
+    # que carregar um produto não traga a imagem junto
+    foto_hash: Mapped[Optional[str]] = mapped_column(String(64),
+                                                     nullable=True)
     foto_mime: Mapped[String] = mapped_column(String(64),
                                               nullable=True)
     possui_foto: Mapped[Boolean] = mapped_column(Boolean,
                                                  default=False)
 
+    # Controle de concorrência otimista: todo UPDATE do ORM confere e
+    # incrementa a versão, e falha com StaleDataError se outra transação
+    # alterou o produto depois que ele foi lido. As atualizações feitas fora
+    # do ORM também devem incrementá-la
+    versao: Mapped[int] = mapped_column(Integer, nullable=False, default=1,
+                                        server_default='1')
+
     categoria = relationship('Categoria',
                              back_populates='lista_de_produtos')
+
+    __mapper_args__ = {'version_id_col': versao}
+
+    @classmethod
+    def em_falta(cls):
+        # Precisa ser exatamente a mesma condição dos índices parciais abaixo,
+        # para que o SQLite os reconheça como aplicáveis à consulta
+        return sa.and_(cls.ativo.is_(True), cls.estoque <= cls.estoque_minimo)
+
+    @classmethod
+    def busca(cls, texto: str, pagina: int = 1, tamanho: int = 25) -> tuple[list[Self], bool]:
+        """
+        Busca por palavras (ou prefixos de palavras) do nome, sem diferenciar
+        acentos e maiúsculas. No SQLite usa o índice FTS5 'produtos_fts' e
+        ordena pela relevância (bm25); nos outros bancos recorre ao LIKE.
+        Retorna os produtos da página e se existe uma próxima página
+        """
+        termos = re.findall(r'\w+', texto)
+        if not termos:
+            return [], False
+        sentenca = sa.select(cls).options(joinedload(cls.categoria))
+        if db.engine.dialect.name == 'sqlite':
+            # Cada termo vira uma frase entre aspas (o usuário não consegue
+            # injetar a sintaxe do FTS5) seguida de * para casar prefixos
+            expressao = " ".join(f'"{termo}"*' for termo in termos)
+            sentenca = (sentenca.
+                        join(PRODUTOS_FTS,
+                             PRODUTOS_FTS.c.rowid == sa.literal_column('produtos.rowid')).
+                        where(PRODUTOS_FTS.c.nome.op('MATCH')(expressao)).
+                        order_by(PRODUTOS_FTS.c.rank, cls.nome))
+        else:
+            for termo in termos:
+                sentenca = sentenca.where(cls.nome.ilike(f"%{termo}%"))
+            sentenca = sentenca.order_by(cls.nome, cls.id)
+        sentenca = sentenca.limit(tamanho + 1).offset((pagina - 1) * tamanho)
+        produtos = list(db.session.execute(sentenca).scalars())
+        return produtos[:tamanho], len(produtos) > tamanho
+
+    def define_foto(self, fluxo) -> bool:
+        chave, mime = blobstore.guarda(fluxo)
+        if mime is None:
+            # Conteúdo não é uma imagem reconhecida. Como nenhum produto pode
+            # referenciar um blob inválido, ele é descartado
+            blobstore.remove(chave)
+            return False
+        self.foto_hash = chave
+        self.foto_mime = mime
+        self.possui_foto = True
+        return True
+
+    def remove_foto(self):
+        self.foto_hash = None
+        self.foto_mime = None
+        self.possui_foto = False
+
+    @classmethod
+    def movimenta_em_lote(cls,
+                          itens: list[ItemDeLote],
+                          tamanho_lote: int = 500,
+                          usuario_id=None) -> tuple[int, list[FalhaDeLote]]:
+        """
+        Aplica as movimentações (compra com delta positivo, venda com delta
+        negativo) na transação corrente, sem carregar os objetos do ORM. Para
+        cada bloco de 'tamanho_lote' itens são feitas apenas duas idas ao
+        banco: um SELECT dos estoques atuais e um UPDATE em executemany, com
+        uma linha por produto. Itens que deixariam o estoque negativo, de
+        produtos inexistentes ou inativos são devolvidos como falhas e não
+        alteram nada. Cada item aplicado é registrado no livro de
+        movimentações. O commit é responsabilidade de quem chama.
+        """
+        tabela = cls.__table__
+        atualizacao = (sa.update(tabela).
+                       where(tabela.c.id == sa.bindparam('b_id'),
+                             tabela.c.estoque + sa.bindparam('delta') >= 0).
+                       values(estoque=tabela.c.estoque + sa.bindparam('delta'),
+                              versao=tabela.c.versao + 1))
+        aplicados = 0
+        falhas = []
+        for inicio in range(0, len(itens), tamanho_lote):
+            bloco = itens[inicio:inicio + tamanho_lote]
+            atuais = {linha.id: linha for linha in db.session.execute(
+                sa.select(tabela.c.id, tabela.c.estoque, tabela.c.ativo).
+                where(tabela.c.id.in_({item.produto_id for item in bloco}))
+            )}
+
+            # As linhas são avaliadas na ordem recebida, acumulando o saldo de
+            # cada produto, de modo que várias linhas do mesmo produto sejam
+            # validadas em conjunto
+            saldos = {}
+            deltas = {}
+            movimentos = []
+            for item in bloco:
+                atual = atuais.get(item.produto_id)
+                if atual is None:
+                    falhas.append(FalhaDeLote(*item, "Produto inexistente"))
+                    continue
+                if not atual.ativo:
+                    falhas.append(FalhaDeLote(*item, "Produto inativo"))
+                    continue
+                saldo = saldos.get(item.produto_id, atual.estoque)
+                if saldo + item.delta < 0:
+                    falhas.append(FalhaDeLote(*item, f"Estoque insuficiente (saldo {saldo})"))
+                    continue
+                saldos[item.produto_id] = saldo + item.delta
+                deltas[item.produto_id] = deltas.get(item.produto_id, 0) + item.delta
+                movimentos.append(Movimento.linha(item.produto_id, item.delta, origem='lote',
+                                                  usuario_id=usuario_id))
+                aplicados += 1
+
+            if not deltas:
+                continue
+            parametros = [{'b_id': produto_id, 'delta': delta}
+                          for produto_id, delta in deltas.items()]
+            resultado = db.session.execute(atualizacao, parametros)
+            if resultado.rowcount != len(parametros):
+                # Outra transação alterou o estoque entre a leitura e a
+                # escrita; a guarda do UPDATE impediu o estoque negativo, mas
+                # o lote precisa ser desfeito por inteiro
+                raise ConflitoDeEstoque("O estoque foi alterado durante o processamento do lote")
+            Movimento.registra(movimentos)
+        return aplicados, falhas
+
+    @classmethod
+    def aplica_lote(cls,
+                    itens: list[ItemDeLote],
+                    tamanho_lote: int = 500,
+                    usuario_id=None,
+                    tentativas: int = 5,
+                    espera: float = 0.01,
+                    espera_maxima: float = 0.5) -> tuple[int, list[FalhaDeLote]]:
+        """
+        Executa movimenta_em_lote e confirma a transação. Se outra transação
+        alterar o estoque no meio do lote, tudo é desfeito e o lote é relido
+        e reaplicado após uma espera exponencial com jitter, até 'tentativas'
+        vezes. ConflitoDeEstoque só é lançada quando as tentativas se esgotam
+        """
+        for tentativa in range(1, tentativas + 1):
+            try:
+                aplicados, falhas = cls.movimenta_em_lote(itens, tamanho_lote=tamanho_lote,
+                                                          usuario_id=usuario_id)
+                db.session.commit()
+                return aplicados, falhas
+            except (ConflitoDeEstoque, sa.exc.OperationalError):
+                db.session.rollback()
+            except Exception:
+                db.session.rollback()
+                raise
+            if tentativa < tentativas:
+                _espera(tentativa, espera, espera_maxima)
+        raise ConflitoDeEstoque(f"O estoque foi alterado concorrentemente em todas as "
+                                f"{tentativas} tentativas")
+
+    @classmethod
+    def movimenta(cls,
+                  produto_id: uuid.UUID,
+                  delta: int,
+                  tipo: str | None = None,
+                  origem: str | None = None,
+                  usuario_id=None,
+                  tentativas: int = 8,
+                  espera: float = 0.002,
+                  espera_maxima: float = 0.1) -> ResultadoDaMovimentacao:
+        """
+        Compra (delta positivo) ou venda (delta negativo) de um produto por
+        compare-and-swap: lê estoque e versão, calcula o novo estoque e o
+        grava com um UPDATE condicionado à versão lida. Se outra transação
+        alterou o produto nesse intervalo, nenhuma linha é alterada e a
+        operação é repetida após uma espera exponencial com jitter, limitada
+        a 'espera_maxima', até 'tentativas' vezes. Cada tentativa é uma
+        transação própria, com a movimentação registrada no livro, e portanto
+        a transação corrente da sessão é confirmada. Lança
+        EstoqueInsuficiente, LookupError para produtos inexistentes ou
+        inativos e ConflitoDeEstoque se as tentativas se esgotarem
+        """
+        tabela = cls.__table__
+        for tentativa in range(1, tentativas + 1):
+            try:
+                atual = db.session.execute(
+                    sa.select(tabela.c.estoque, tabela.c.versao, tabela.c.ativo).
+                    where(tabela.c.id == produto_id)
+                ).one_or_none()
+                if atual is None or not atual.ativo:
+                    raise LookupError("Produto inexistente ou inativo")
+                estoque = atual.estoque + delta
+                if estoque < 0:
+                    raise EstoqueInsuficiente(f"Estoque insuficiente (saldo {atual.estoque})")
+                alterados = db.session.execute(
+                    sa.update(tabela).
+                    where(tabela.c.id == produto_id, tabela.c.versao == atual.versao).
+                    values(estoque=estoque, versao=atual.versao + 1)
+                ).rowcount
+                if alterados == 1:
+                    Movimento.registra([Movimento.linha(produto_id, delta, tipo=tipo,
+                                                        origem=origem,
+                                                        usuario_id=usuario_id)])
+                    db.session.commit()
+                    return ResultadoDaMovimentacao(estoque, tentativa)
+            except sa.exc.OperationalError:
+                # O banco recusou a gravação: no SQLite, outra conexão manteve
+                # o banco ocupado além do busy_timeout; em outros bancos, uma
+                # falha de serialização. Ambos são tratados como conflito
+                pass
+            except Exception:
+                db.session.rollback()
+                raise
+            db.session.rollback()
+            if tentativa < tentativas:
+                _espera(tentativa, espera, espera_maxima)
+        raise ConflitoDeEstoque(f"O produto foi alterado concorrentemente em todas as "
+                                f"{tentativas} tentativas")
+
+
+def _espera(tentativa: int, espera: float, espera_maxima: float):
+    # Espera exponencial com jitter entre as tentativas de uma gravação em
+    # conflito, para que os concorrentes não voltem a colidir
+    time.sleep(random.uniform(0, min(espera_maxima, espera * 2 ** tentativa)))
+
+
+# noinspection PyUnusedLocal
+@sa.event.listens_for(db.session, 'before_flush')
+def _registra_movimentos(session, flush_context, instances):  # pylint: disable=unused-argument
+    # As alterações de estoque feitas pelo ORM (cadastro, edição e remoção
+    # de produtos) entram no livro como ajustes, no mesmo flush. As
+    # alterações em massa, fora do ORM, registram as suas movimentações
+    # explicitamente
+    from flask import g, has_request_context
+
+    usuario = g.get('_login_user') if has_request_context() else None
+    usuario_id = getattr(usuario, 'id', None)
+    alteracoes = []
+    for produto in session.new:
+        if isinstance(produto, Produto) and produto.estoque:
+            alteracoes.append((produto, produto.estoque, 'cadastro'))
+    for produto in session.dirty:
+        if isinstance(produto, Produto):
+            historico = sa.inspect(produto).attrs.estoque.history
+            if historico.deleted and historico.added:
+                delta = (historico.added[0] or 0) - (historico.deleted[0] or 0)
+                if delta:
+                    alteracoes.append((produto, delta, 'alteração'))
+    for produto in session.deleted:
+        if isinstance(produto, Produto) and produto.estoque:
+            alteracoes.append((produto, -produto.estoque, 'remoção'))
+
+    for produto, delta, origem in alteracoes:
+        if produto.id is None:
+            produto.id = uuid.uuid4()
+        session.add(Movimento(**Movimento.linha(produto.id, delta, tipo=Movimento.AJUSTE,
+                                                origem=origem, usuario_id=usuario_id)))
+
+
+# Índices parciais com apenas os produtos em falta: a consulta da página
+# "Produtos em falta" percorre um índice pequeno, já na ordem da paginação,
+# em vez de varrer a tabela de produtos
+Index('ix_produtos_em_falta_nome_id',
+      Produto.nome, Produto.id,
+      sqlite_where=Produto.em_falta(),
+      postgresql_where=Produto.em_falta())
+Index('ix_produtos_em_falta_categoria_nome_id',
+      Produto.categoria_id, Produto.nome, Produto.id,
+      sqlite_where=Produto.em_falta(),
+      postgresql_where=Produto.em_falta())
+
+
+# Índice de busca textual (SQLite FTS5) sobre o nome dos produtos. A tabela
+# virtual usa 'produtos' como conteúdo externo, guardando apenas o índice
+# invertido, e é mantida pelas triggers abaixo em qualquer INSERT, UPDATE ou
+# DELETE, inclusive os feitos em massa fora do ORM. O tokenizador
+# 'unicode61 remove_diacritics 2' ignora acentos e maiúsculas, e os índices
+# de prefixo de 2 e 3 caracteres aceleram as buscas por prefixo.
+# Como a ligação é feita pelo rowid implícito de 'produtos', depois de um
+# VACUUM o índice deve ser reconstruído (flask produtos reindexar-busca)
+PRODUTOS_FTS = sa.table('produtos_fts', sa.column('rowid'), sa.column('nome'), sa.column('rank'))
+
+PRODUTOS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5("
+    "nome, content='produtos', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS produtos_fts_ai AFTER INSERT ON produtos BEGIN "
+    "INSERT INTO produtos_fts(rowid, nome) VALUES (new.rowid, new.nome); END",
+    "CREATE TRIGGER IF NOT EXISTS produtos_fts_ad AFTER DELETE ON produtos BEGIN "
+    "INSERT INTO produtos_fts(produtos_fts, rowid, nome) VALUES ('delete', old.rowid, old.nome); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS produtos_fts_au AFTER UPDATE OF nome ON produtos BEGIN "
+    "INSERT INTO produtos_fts(produtos_fts, rowid, nome) VALUES ('delete', old.rowid, old.nome); "
+    "INSERT INTO produtos_fts(rowid, nome) VALUES (new.rowid, new.nome); END",
+]
+
+for _comando in PRODUTOS_FTS_DDL:
+    sa.event.listen(Produto.__table__, 'after_create',
+                    sa.DDL(_comando).execute_if(dialect='sqlite'))
+sa.event.listen(Produto.__table__, 'before_drop',
+                sa.DDL("DROP TABLE IF EXISTS produtos_fts").execute_if(dialect='sqlite'))
+
+
+def reconstroi_indice_de_busca():
+    if db.engine.dialect.name != 'sqlite':
+        return
+    for comando in PRODUTOS_FTS_DDL:
+        db.session.execute(sa.text(comando))
+    db.session.execute(sa.text("INSERT INTO produtos_fts(produtos_fts) VALUES ('rebuild')"))
+
+
+def suspende_indice_de_busca():
+    # Em cargas volumosas, reconstruir o índice uma única vez no final é bem
+    # mais rápido do que mantê-lo linha a linha pelas triggers. Depois da
+    # carga, chame reconstroi_indice_de_busca() na mesma transação
+    if db.engine.dialect.name != 'sqlite':
+        return
+    for trigger in ('produtos_fts_ai', 'produtos_fts_ad', 'produtos_fts_au'):
+        db.session.execute(sa.text(f"DROP TRIGGER IF EXISTS {trigger}"))
@@ -1,24 +1,37 @@
-import smtplib
 import uuid
-from base64 import b64encode
+from functools import lru_cache
 from hashlib import md5
 from io import BytesIO
 from time import time
 from typing import Optional
 
-import email_validator
-import jwt
-import pyotp
 from flask import current_app
 from flask_login import UserMixin
-from flask_mailman import EmailMessage
-from qrcode.main import QRCode
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.types import Boolean, DateTime, String, Uuid
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from src.cache import TTLCache
 from src.models.base_mixin import BasicRepositoryMixin, TimeStampMixin
-from src.modules import db
+from src.modules import db, outbox
+
+# qrcode, pyotp, jwt e email_validator são importados apenas nos métodos que
+# os usam: este módulo é carregado na inicialização da aplicação, e boa parte
+# das requisições (e dos processos) nunca precisa deles
+
+# Imagens do QR code de ativação do 2FA, por (otp_secret, formato). Uma nova
+# chave secreta gera uma nova entrada, e a ativação remove as da chave usada
+qrcodes_2fa = TTLCache(maxsize=256, ttl=900)
+
+FORMATOS_QRCODE = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+@lru_cache(maxsize=8)
+def prefixo_do_hash(metodo: str) -> str:
+    # O Werkzeug completa os parâmetros omitidos ("scrypt" vira
+    # "scrypt:32768:8:1"); gerar um hash de exemplo revela a forma canônica
+    # do método, que é o prefixo gravado antes do primeiro '$'
+    return generate_password_hash("", method=metodo).split('$', 1)[0]
 
 
 class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
@@ -44,23 +57,41 @@ class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
     def otp_secret_formatted(self) -> str:
         return " ".join(self.otp_secret[i:i + 4] for i in range(0, len(self.otp_secret), 4))
 
-    @property
-    def get_b64encoded_qr_totp_uri(self) -> str:
-        qr = QRCode(version=1, box_size=10, border=5)
-        qr.add_data(self.get_totp_uri, optimize=0)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color='black', back_color='white')
-        buffer = BytesIO()
-        img.save(buffer)
-        return b64encode(buffer.getvalue()).decode('UTF-8')
+    def qrcode_totp(self, formato: str = 'png') -> bytes:
+        chave = (self.otp_secret, formato)
+        imagem = qrcodes_2fa.get(chave)
+        if imagem is None:
+            from qrcode.image.svg import SvgPathImage
+            from qrcode.main import QRCode
+
+            qr = QRCode(version=1, box_size=10, border=5)
+            qr.add_data(self.get_totp_uri, optimize=0)
+            qr.make(fit=True)
+            buffer = BytesIO()
+            if formato == 'svg':
+                # O SVG é apenas texto e não exige rasterizar a imagem
+                qr.make_image(image_factory=SvgPathImage).save(buffer)
+            else:
+                qr.make_image(fill_color='black', back_color='white').save(buffer)
+            imagem = buffer.getvalue()
+            qrcodes_2fa.set(chave, imagem)
+        return imagem
+
+    def descarta_qrcode_totp(self):
+        for formato in FORMATOS_QRCODE:
+            qrcodes_2fa.pop((self.otp_secret, formato))
 
     @property
     def get_totp_uri(self) -> str:
+        import pyotp
+
         otp = pyotp.totp.TOTP(self.otp_secret)
         return otp.provisioning_uri(name=self.email,
                                     issuer_name=current_app.config.get('APP_NAME'))
 
     def verify_totp(self, token) -> bool:
+        import pyotp
+
         totp = pyotp.TOTP(self.otp_secret)
         return totp.verify(token, valid_window=1)
 
@@ -75,6 +106,8 @@ class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
     # noinspection PyTypeChecker
     @email.setter
     def email(self, value):
+        import email_validator
+
         self.email_normalizado = (email_validator.
                                   validate_email(value,
                                                  check_deliverability=False).
@@ -87,13 +120,29 @@ class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
 
     # noinspection PyTypeChecker
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password,
+            method=current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt'),
+            salt_length=current_app.config.get('PASSWORD_HASH_SALT_LENGTH', 16))
 
     def check_password(self, password) -> bool:
         return check_password_hash(self.password_hash, password)
 
+    def precisa_rehash(self) -> bool:
+        # O hash é gravado como "método:parâmetros$sal$hash"; ele é refeito
+        # quando qualquer parte da política atual muda, inclusive só o
+        # tamanho do sal
+        partes = self.password_hash.split('$', 2)
+        if len(partes) != 3:
+            return True
+        metodo, sal, _ = partes
+        return (metodo != prefixo_do_hash(current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt'))
+                or len(sal) != current_app.config.get('PASSWORD_HASH_SALT_LENGTH', 16))
+
     @classmethod
     def get_by_email(cls, email):
+        import email_validator
+
         user_email = (email_validator.
                       validate_email(email,
                                      check_deliverability=False).
@@ -102,6 +151,8 @@ class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
         return cls.get_first_or_none_by('email_normalizado', user_email)
 
     def create_jwt_token(self, action: str, expires_in: int = 600) -> str:
+        import jwt
+
         payload = dict(
             user=str(self.id),
             action=action.lower(),
@@ -113,6 +164,8 @@ class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
 
     @staticmethod
     def verify_jwt_token(token):
+        import jwt
+
         try:
             payload = jwt.decode(token,
                                  key=current_app.config.get('SECRET_KEY'),
@@ -127,15 +180,9 @@ class User(db.Model, TimeStampMixin, UserMixin, BasicRepositoryMixin):
             return None, None
         return User.get_by_id(user_id), action
 
-    def send_email(self, subject: str = "Mensagem do sistema", body: str = "") -> bool:
-        msg = EmailMessage()
-        msg.to = [self.email]
-        msg.subject = f"[{current_app.config.get('APP_NAME')}] {subject}"
-        msg.body = body
-        msg.extra_headers['Message-ID'] = \
-            f"{str(uuid.uuid4())}@{current_app.config.get('APP_MTA_MESSAGEID')}"
-        try:
-            msg.send()
-        except smtplib.SMTPException:
-            return False
-        return True
+    def send_email(self, subject: str = "Mensagem do sistema", body: str = ""):
+        # A mensagem entra na caixa de saída e é gravada junto com a transação
+        # corrente, que falha inteira se ela não puder ser gravada; o envio
+        # pelo SMTP é feito depois pelos workers do Outbox, que registram as
+        # falhas na própria mensagem
+        outbox.enfileira([self.email], subject, body)
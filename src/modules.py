@@ -6,6 +6,15 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 from sqlalchemy.orm import DeclarativeBase
 
+from src.assets import Assets
+from src.blobstore import BlobStore
+from src.cache import FragmentCache, UserLoaderCache
+from src.importacao import Importacoes
+from src.metrics import Metrics
+from src.miniaturas import Miniaturas
+from src.outbox import Outbox
+from src.profiling import Profiling
+
 
 class Base(DeclarativeBase):
     # Se houver atributos comuns a todas as classes,
@@ -13,6 +22,7 @@ class Base(DeclarativeBase):
     pass
 
 
+assets = Assets()
 bootstrap = Bootstrap5()
 minify = Minify()
 db = SQLAlchemy(model_class=Base,
@@ -20,3 +30,11 @@ db = SQLAlchemy(model_class=Base,
 login = LoginManager()
 csrf = CSRFProtect()
 mail = Mail()
+blobstore = BlobStore()
+miniaturas = Miniaturas()
+importacoes = Importacoes()
+user_cache = UserLoaderCache()
+fragment_cache = FragmentCache()
+outbox = Outbox()
+profiling = Profiling()
+metrics = Metrics()
@@ -0,0 +1,204 @@
+import smtplib
+import threading
+import uuid
+from datetime import timedelta
+
+import sqlalchemy as sa
+from flask_mailman import EmailMessage
+
+
+class Outbox:
+    """
+    Envio assíncrono dos emails gravados em 'emails_pendentes'. Um conjunto
+    de threads (EMAIL_OUTBOX_WORKERS) reserva lotes de mensagens e as envia
+    reutilizando uma única conexão SMTP por lote. Falhas são reagendadas com
+    espera exponencial até EMAIL_OUTBOX_MAX_TENTATIVAS; depois disso a
+    mensagem fica como 'falhou'. A caixa de saída também pode ser esvaziada
+    por um processo separado com 'flask email processar'
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._acordar = threading.Event()
+        self._workers: list[threading.Thread] = []
+        self._trava = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from src.modules import db
+
+        self.app = app
+        app.config.setdefault('EMAIL_OUTBOX_WORKERS', 1)
+        app.config.setdefault('EMAIL_OUTBOX_LOTE', 50)
+        app.config.setdefault('EMAIL_OUTBOX_MAX_TENTATIVAS', 6)
+        app.config.setdefault('EMAIL_OUTBOX_ESPERA', 30)
+        app.config.setdefault('EMAIL_OUTBOX_INTERVALO', 10)
+        app.config.setdefault('EMAIL_OUTBOX_RESERVA', 300)
+        app.extensions['outbox'] = self
+
+        if not sa.event.contains(db.session, 'after_commit', self._apos_commit):
+            sa.event.listen(db.session, 'after_commit', self._apos_commit)
+            sa.event.listen(db.session, 'after_rollback', self._apos_rollback)
+
+        # Os workers só são iniciados quando a aplicação atende a primeira
+        # requisição, para que os comandos do flask não os disparem
+        app.before_request(self.inicia_workers)
+
+    def _apos_commit(self, session):
+        if session.info.pop('outbox', False):
+            self._acordar.set()
+
+    @staticmethod
+    def _apos_rollback(session):
+        session.info.pop('outbox', None)
+
+    def enfileira(self, destinatarios: list[str], assunto: str, corpo: str):
+        from src.models.email_pendente import EmailPendente
+        from src.modules import db
+        from src.utils import timestamp
+
+        mensagem = EmailPendente()
+        mensagem.lista_de_destinatarios = destinatarios
+        mensagem.assunto = assunto
+        mensagem.corpo = corpo
+        mensagem.message_id = (f"{str(uuid.uuid4())}@"
+                               f"{self.app.config.get('APP_MTA_MESSAGEID')}")
+        mensagem.proxima_tentativa = timestamp()
+        db.session.add(mensagem)
+        db.session.info['outbox'] = True
+        return mensagem
+
+    def inicia_workers(self):
+        if self._workers:
+            return
+        with self._trava:
+            if self._workers:
+                return
+            for numero in range(self.app.config['EMAIL_OUTBOX_WORKERS']):
+                worker = threading.Thread(target=self._executa,
+                                          name=f"outbox-{numero}",
+                                          daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _executa(self):
+        intervalo = self.app.config['EMAIL_OUTBOX_INTERVALO']
+        while True:
+            try:
+                with self.app.app_context():
+                    enviados = self.processa_lote()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.app.logger.error("Outbox: erro no processamento do lote: %s", e)
+                enviados = 0
+            if enviados == 0:
+                self._acordar.wait(intervalo)
+                self._acordar.clear()
+
+    def _reserva(self, limite: int) -> list:
+        from src.models.email_pendente import EmailPendente
+        from src.modules import db
+        from src.utils import timestamp
+
+        agora = timestamp()
+        token = uuid.uuid4().hex
+        # Reservas abandonadas por um worker que morreu ou travou no meio do
+        # envio. A reserva já contou como tentativa: a mensagem que esgotou
+        # as tentativas vai para a dead letter em vez de ser reservada de novo
+        abandonada = sa.and_(EmailPendente.situacao == EmailPendente.ENVIANDO,
+                             EmailPendente.dta_reserva < agora - timedelta(
+                                 seconds=self.app.config['EMAIL_OUTBOX_RESERVA']))
+        esgotada = EmailPendente.tentativas >= self.app.config['EMAIL_OUTBOX_MAX_TENTATIVAS']
+        db.session.execute(
+            sa.update(EmailPendente).
+            where(abandonada, esgotada).
+            values(situacao=EmailPendente.FALHOU, reservado_por=None,
+                   ultimo_erro="Reserva expirada sem que o envio fosse concluído").
+            execution_options(synchronize_session=False)
+        )
+        disponivel = sa.or_(
+            sa.and_(EmailPendente.situacao == EmailPendente.PENDENTE,
+                    EmailPendente.proxima_tentativa <= agora),
+            sa.and_(abandonada, sa.not_(esgotada))
+        )
+        candidatos = (sa.select(EmailPendente.id).
+                      where(disponivel).
+                      order_by(EmailPendente.id).
+                      limit(limite))
+        # O UPDATE repete a condição, então dois workers nunca reservam a
+        # mesma mensagem. Cada reserva conta como uma tentativa, mesmo que o
+        # worker não chegue a registrar o resultado do envio
+        db.session.execute(
+            sa.update(EmailPendente).
+            where(EmailPendente.id.in_(candidatos.scalar_subquery()), disponivel).
+            values(situacao=EmailPendente.ENVIANDO, reservado_por=token, dta_reserva=agora,
+                   tentativas=EmailPendente.tentativas + 1).
+            execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return list(db.session.execute(
+            sa.select(EmailPendente).
+            where(EmailPendente.reservado_por == token,
+                  EmailPendente.situacao == EmailPendente.ENVIANDO).
+            order_by(EmailPendente.id)
+        ).scalars())
+
+    def processa_lote(self) -> int:
+        from src.models.email_pendente import EmailPendente
+        from src.modules import db, mail
+        from src.utils import timestamp
+
+        mensagens = self._reserva(self.app.config['EMAIL_OUTBOX_LOTE'])
+        if not mensagens:
+            return 0
+
+        config = self.app.config
+        enviados = 0
+        conexao = mail.get_connection(fail_silently=False)
+        try:
+            conexao.open()
+        except (smtplib.SMTPException, OSError) as e:
+            for mensagem in mensagens:
+                self._reagenda(mensagem, e)
+            db.session.commit()
+            return 0
+
+        try:
+            for mensagem in mensagens:
+                email = EmailMessage(subject=f"[{config.get('APP_NAME')}] {mensagem.assunto}",
+                                     body=mensagem.corpo,
+                                     to=mensagem.lista_de_destinatarios,
+                                     headers={'Message-ID': mensagem.message_id},
+                                     connection=conexao)
+                try:
+                    email.send()
+                except (smtplib.SMTPException, OSError) as e:
+                    self._reagenda(mensagem, e)
+                    continue
+                mensagem.situacao = EmailPendente.ENVIADO
+                mensagem.dta_envio = timestamp()
+                mensagem.reservado_por = None
+                enviados += 1
+        finally:
+            conexao.close()
+            db.session.commit()
+        return enviados
+
+    def _reagenda(self, mensagem, erro: Exception):
+        from src.models.email_pendente import EmailPendente
+        from src.utils import timestamp
+
+        # A tentativa foi contada na reserva da mensagem
+        mensagem.ultimo_erro = str(erro)
+        mensagem.reservado_por = None
+        if mensagem.tentativas >= self.app.config['EMAIL_OUTBOX_MAX_TENTATIVAS']:
+            mensagem.situacao = EmailPendente.FALHOU
+            self.app.logger.error("Outbox: email %d descartado após %d tentativas: %s",
+                                  mensagem.id, mensagem.tentativas, erro)
+            return
+        espera = self.app.config['EMAIL_OUTBOX_ESPERA'] * 2 ** (mensagem.tentativas - 1)
+        mensagem.situacao = EmailPendente.PENDENTE
+        mensagem.proxima_tentativa = timestamp() + timedelta(seconds=espera)
+        self.app.logger.warning("Outbox: falha no envio do email %d (tentativa %d), nova "
+                                "tentativa em %d segundos: %s",
+                                mensagem.id, mensagem.tentativas, espera, erro)
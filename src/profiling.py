@@ -0,0 +1,187 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+import sqlalchemy as sa
+from flask import before_render_template, g, has_request_context, jsonify, request, \
+    template_rendered
+from flask_login import login_required
+
+
+@dataclass
+class Medicao:
+    inicio: float
+    consultas: int = 0
+    tempo_db: float = 0.0
+    tempo_render: float = 0.0
+    inicio_render: list[float] = field(default_factory=list)
+    lentas: list[tuple[float, str]] = field(default_factory=list)
+
+
+@dataclass
+class EstatisticaDoEndpoint:
+    requisicoes: int = 0
+    tempo_total: float = 0.0
+    tempo_maximo: float = 0.0
+    consultas: int = 0
+    tempo_db: float = 0.0
+    tempo_render: float = 0.0
+    lentas: list[tuple[float, str]] = field(default_factory=list)
+
+
+class Profiling:
+    """
+    Instrumentação opcional (PROFILING) das requisições: conta as consultas
+    ao banco e mede o tempo gasto nelas e na renderização dos templates. Os
+    números vão no cabeçalho Server-Timing da resposta (visível nas
+    ferramentas de desenvolvedor do navegador), as requisições acima de
+    PROFILING_REQUISICAO_LENTA milissegundos são registradas no log e os
+    totais são acumulados por endpoint, com as consultas mais lentas, e
+    exibidos em /profiling no modo de depuração
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ativo = False
+        self.estatisticas: dict[str, EstatisticaDoEndpoint] = {}
+        self._trava = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('PROFILING', False)
+        app.config.setdefault('PROFILING_SERVER_TIMING', True)
+        app.config.setdefault('PROFILING_REQUISICAO_LENTA', 500)
+        app.config.setdefault('PROFILING_CONSULTA_LENTA', 100)
+        app.config.setdefault('PROFILING_CONSULTAS_GUARDADAS', 5)
+        app.extensions['profiling'] = self
+
+        # Desligado, nenhum gancho é registrado e o custo é zero
+        self.ativo = app.config['PROFILING']
+        if not self.ativo:
+            return
+
+        if not sa.event.contains(sa.engine.Engine, 'before_cursor_execute',
+                                 self._antes_da_consulta):
+            sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                            self._antes_da_consulta)
+            sa.event.listen(sa.engine.Engine, 'after_cursor_execute',
+                            self._depois_da_consulta)
+        before_render_template.connect(self._antes_do_template, app)
+        template_rendered.connect(self._depois_do_template, app)
+        app.before_request(self._inicia)
+        app.after_request(self._finaliza)
+        # Os totais expõem as rotas e o SQL das consultas lentas: /profiling
+        # só existe no modo de depuração; em produção, use o log e o
+        # cabeçalho Server-Timing
+        if app.debug:
+            app.add_url_rule('/profiling', 'profiling', login_required(self._exibe))
+
+    @staticmethod
+    def _medicao() -> Medicao | None:
+        # Consultas fora de uma requisição (comandos, workers) não são medidas
+        if not has_request_context():
+            return None
+        return g.get('_profiling')
+
+    # O início fica no contexto da execução, que é descartado junto com ela:
+    # uma consulta que falha não deixa uma marca para trás. As consultas
+    # internas do dialeto, sem contexto, não são medidas
+    # noinspection PyUnusedLocal
+    @staticmethod
+    # pylint: disable-next=unused-argument
+    def _antes_da_consulta(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._profiling_inicio = time.perf_counter()  # pylint: disable=protected-access
+
+    # noinspection PyUnusedLocal
+    # pylint: disable-next=unused-argument
+    def _depois_da_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        inicio = getattr(context, '_profiling_inicio', None)
+        medicao = self._medicao()
+        if inicio is None or medicao is None:
+            return
+        duracao = time.perf_counter() - inicio
+        medicao.consultas += 1
+        medicao.tempo_db += duracao
+        if duracao * 1000 >= self.app.config['PROFILING_CONSULTA_LENTA']:
+            medicao.lentas.append((duracao, statement))
+
+    # noinspection PyUnusedLocal
+    # pylint: disable-next=unused-argument
+    def _antes_do_template(self, sender, template, context, **extra):
+        medicao = self._medicao()
+        if medicao is not None:
+            medicao.inicio_render.append(time.perf_counter())
+
+    # noinspection PyUnusedLocal
+    # pylint: disable-next=unused-argument
+    def _depois_do_template(self, sender, template, context, **extra):
+        medicao = self._medicao()
+        if medicao is not None and medicao.inicio_render:
+            medicao.tempo_render += time.perf_counter() - medicao.inicio_render.pop()
+
+    @staticmethod
+    def _inicia():
+        g._profiling = Medicao(inicio=time.perf_counter())  # pylint: disable=protected-access
+
+    def _finaliza(self, response):
+        medicao = g.pop('_profiling', None)
+        if medicao is None:
+            return response
+        total = time.perf_counter() - medicao.inicio
+        endpoint = request.endpoint or '<sem endpoint>'
+        config = self.app.config
+
+        if config['PROFILING_SERVER_TIMING']:
+            response.headers.add('Server-Timing',
+                                 f'db;dur={medicao.tempo_db * 1000:.1f};'
+                                 f'desc="{medicao.consultas} consultas", '
+                                 f'tpl;dur={medicao.tempo_render * 1000:.1f}, '
+                                 f'app;dur={total * 1000:.1f}')
+
+        self._acumula(endpoint, total, medicao)
+
+        if total * 1000 >= config['PROFILING_REQUISICAO_LENTA']:
+            self.app.logger.warning("Requisição lenta: %s %s (%s) -> %d em %.1fms; "
+                                    "%d consultas em %.1fms, templates em %.1fms",
+                                    request.method, request.path, endpoint,
+                                    response.status_code, total * 1000, medicao.consultas,
+                                    medicao.tempo_db * 1000, medicao.tempo_render * 1000)
+            for duracao, statement in sorted(medicao.lentas, reverse=True):
+                self.app.logger.warning("Consulta lenta (%.1fms): %s", duracao * 1000,
+                                        statement)
+        return response
+
+    def _acumula(self, endpoint: str, total: float, medicao: Medicao):
+        guardadas = self.app.config['PROFILING_CONSULTAS_GUARDADAS']
+        with self._trava:
+            estatistica = self.estatisticas.setdefault(endpoint, EstatisticaDoEndpoint())
+            estatistica.requisicoes += 1
+            estatistica.tempo_total += total
+            estatistica.tempo_maximo = max(estatistica.tempo_maximo, total)
+            estatistica.consultas += medicao.consultas
+            estatistica.tempo_db += medicao.tempo_db
+            estatistica.tempo_render += medicao.tempo_render
+            if medicao.lentas:
+                estatistica.lentas = sorted(estatistica.lentas + medicao.lentas,
+                                            reverse=True)[:guardadas]
+
+    def _exibe(self):
+        return jsonify(self.resumo())
+
+    def resumo(self) -> dict[str, dict]:
+        """Médias por endpoint desde o início do processo, em milissegundos."""
+        with self._trava:
+            return {endpoint: dict(requisicoes=e.requisicoes,
+                                   media_ms=round(e.tempo_total / e.requisicoes * 1000, 2),
+                                   maximo_ms=round(e.tempo_maximo * 1000, 2),
+                                   consultas_por_requisicao=round(e.consultas / e.requisicoes,
+                                                                  2),
+                                   db_ms=round(e.tempo_db / e.requisicoes * 1000, 2),
+                                   templates_ms=round(e.tempo_render / e.requisicoes * 1000,
+                                                      2),
+                                   consultas_lentas=[dict(ms=round(d * 1000, 2), sql=s)
+                                                     for d, s in e.lentas])
+                    for endpoint, e in sorted(self.estatisticas.items())}
@@ -0,0 +1,224 @@
+import datetime
+import json
+import uuid
+from decimal import Decimal, InvalidOperation
+
+import sqlalchemy as sa
+from flask import abort, Blueprint, current_app, jsonify, request, stream_with_context, \
+    url_for
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+from src.models.categoria import Categoria
+from src.models.produto import Produto
+from src.modules import db
+from src.utils import get_condicional, pagina_keyset, tamanho_da_pagina
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Campos que podem ser pedidos em ?campos=; id e nome são sempre lidos, pois
+# são as colunas da paginação
+CAMPOS_DE_CATEGORIA = {
+    'id': Categoria.id,
+    'nome': Categoria.nome,
+    'dta_cadastro': Categoria.dta_cadastro,
+    'dta_atualizacao': Categoria.dta_atualizacao,
+}
+CAMPOS_DE_PRODUTO = {
+    'id': Produto.id,
+    'nome': Produto.nome,
+    'preco': Produto.preco,
+    'estoque': Produto.estoque,
+    'estoque_minimo': Produto.estoque_minimo,
+    'ativo': Produto.ativo,
+    'categoria_id': Produto.categoria_id,
+    'categoria': Categoria.nome,
+    'possui_foto': Produto.possui_foto,
+    'foto': Produto.foto_hash,
+    'dta_cadastro': Produto.dta_cadastro,
+    'dta_atualizacao': Produto.dta_atualizacao,
+}
+
+
+@bp.before_request
+def exige_login():
+    # Os mesmos dados da exportação em CSV/XLSX, que exige login: a API usa a
+    # sessão do usuário ou o token Bearer (veja load_user_from_request), mas
+    # responde 401 em JSON em vez de redirecionar para a página de login
+    if not current_user.is_authenticated:
+        abort(401, "É necessário estar logado ou enviar um token válido para acessar a API")
+
+
+@bp.errorhandler(HTTPException)
+def erro(e: HTTPException):
+    return jsonify(erro=e.description, status=e.code), e.code
+
+
+def _valor(campo: str, valor):
+    if valor is None:
+        return None
+    if campo == 'foto':
+        return url_for('produtos.foto', chave=valor)
+    if isinstance(valor, (uuid.UUID, Decimal)):
+        # Decimal como texto, para não perder a precisão dos preços
+        return str(valor)
+    if isinstance(valor, datetime.datetime):
+        return valor.isoformat()
+    return valor
+
+
+def _campos(disponiveis: dict) -> list[str]:
+    pedidos = request.args.get('campos')
+    if not pedidos:
+        return list(disponiveis)
+    campos = [campo.strip() for campo in pedidos.split(',') if campo.strip()]
+    if desconhecidos := [campo for campo in campos if campo not in disponiveis]:
+        abort(400, f"Campos desconhecidos: {', '.join(desconhecidos)}. "
+                   f"Disponíveis: {', '.join(disponiveis)}")
+    return campos
+
+
+def _selecao(disponiveis: dict, campos: list[str]):
+    lidos = dict.fromkeys(['id', 'nome', *campos])
+    return sa.select(*[disponiveis[campo].label(campo) for campo in lidos])
+
+
+def _serializa(linha, campos: list[str]) -> dict:
+    return {campo: _valor(campo, getattr(linha, campo)) for campo in campos}
+
+
+def _uuid(parametro: str) -> uuid.UUID | None:
+    valor = request.args.get(parametro)
+    if valor is None:
+        return None
+    try:
+        return uuid.UUID(valor)
+    except ValueError:
+        abort(400, f"'{parametro}' não é um identificador válido")
+
+
+def _decimal(parametro: str) -> Decimal | None:
+    valor = request.args.get(parametro)
+    if valor is None:
+        return None
+    try:
+        return Decimal(valor)
+    except InvalidOperation:
+        abort(400, f"'{parametro}' não é um número válido")
+
+
+def _booleano(parametro: str) -> bool | None:
+    valor = request.args.get(parametro)
+    if valor is None:
+        return None
+    if valor.lower() in ('1', 'true', 'sim'):
+        return True
+    if valor.lower() in ('0', 'false', 'nao', 'não'):
+        return False
+    abort(400, f"'{parametro}' deve ser true ou false")
+
+
+def _filtra_categorias(sentenca):
+    if nome := request.args.get('nome'):
+        sentenca = sentenca.where(Categoria.nome.ilike(f"%{nome}%"))
+    return sentenca
+
+
+def _filtra_produtos(sentenca, campos: list[str]):
+    if 'categoria' in campos:
+        sentenca = sentenca.outerjoin(Categoria, Categoria.id == Produto.categoria_id)
+    if (categoria_id := _uuid('categoria')) is not None:
+        sentenca = sentenca.where(Produto.categoria_id == categoria_id)
+    if (ativo := _booleano('ativo')) is not None:
+        sentenca = sentenca.where(Produto.ativo.is_(ativo))
+    if _booleano('em_falta'):
+        sentenca = sentenca.where(Produto.em_falta())
+    if nome := request.args.get('nome'):
+        sentenca = sentenca.where(Produto.nome.ilike(f"%{nome}%"))
+    if (preco_min := _decimal('preco_min')) is not None:
+        sentenca = sentenca.where(Produto.preco >= preco_min)
+    if (preco_max := _decimal('preco_max')) is not None:
+        sentenca = sentenca.where(Produto.preco <= preco_max)
+    return sentenca
+
+
+def _pagina(sentenca, colunas, campos: list[str], endpoint: str):
+    tamanho = tamanho_da_pagina(request.args.get('tamanho'))
+    try:
+        pagina = pagina_keyset(sentenca, colunas,
+                               apos=request.args.get('apos'),
+                               antes=request.args.get('antes'),
+                               tamanho=tamanho,
+                               escalares=False)
+    except ValueError:
+        abort(400, "Cursor de paginação inválido")
+
+    argumentos = {chave: valor for chave, valor in request.args.items()
+                  if chave not in ('apos', 'antes')}
+    links = {}
+    if pagina.proximo:
+        links['proximo'] = url_for(endpoint, **argumentos, apos=pagina.proximo)
+    if pagina.anterior:
+        links['anterior'] = url_for(endpoint, **argumentos, antes=pagina.anterior)
+    return jsonify(dados=[_serializa(linha, campos) for linha in pagina.itens],
+                   paginacao=dict(tamanho=tamanho,
+                                  proximo=pagina.proximo,
+                                  anterior=pagina.anterior),
+                   links=links)
+
+
+@bp.route('/categorias', methods=['GET'])
+@get_condicional(Categoria)
+def categorias():
+    campos = _campos(CAMPOS_DE_CATEGORIA)
+    sentenca = _filtra_categorias(_selecao(CAMPOS_DE_CATEGORIA, campos))
+    return _pagina(sentenca, [Categoria.nome, Categoria.id], campos, 'api.categorias')
+
+
+@bp.route('/categorias/<uuid:id_categoria>', methods=['GET'])
+def categoria(id_categoria):
+    campos = _campos(CAMPOS_DE_CATEGORIA)
+    linha = db.session.execute(_selecao(CAMPOS_DE_CATEGORIA, campos).
+                               where(Categoria.id == id_categoria)).one_or_none()
+    if linha is None:
+        abort(404, "Categoria inexistente")
+    return jsonify(_serializa(linha, campos))
+
+
+@bp.route('/produtos', methods=['GET'])
+@get_condicional(Produto, Categoria)
+def produtos():
+    campos = _campos(CAMPOS_DE_PRODUTO)
+    sentenca = _filtra_produtos(_selecao(CAMPOS_DE_PRODUTO, campos), campos)
+    return _pagina(sentenca, [Produto.nome, Produto.id], campos, 'api.produtos')
+
+
+@bp.route('/produtos/<uuid:id_produto>', methods=['GET'])
+def produto(id_produto):
+    campos = _campos(CAMPOS_DE_PRODUTO)
+    sentenca = _filtra_produtos(_selecao(CAMPOS_DE_PRODUTO, campos), campos)
+    linha = db.session.execute(sentenca.where(Produto.id == id_produto)).one_or_none()
+    if linha is None:
+        abort(404, "Produto inexistente")
+    return jsonify(_serializa(linha, campos))
+
+
+@bp.route('/produtos/exportar', methods=['GET'])
+def exportar_produtos():
+    # Um objeto JSON por linha (NDJSON), gerado enquanto o banco entrega as
+    # linhas: yield_per lê o cursor em blocos, e nem a consulta nem a resposta
+    # ficam inteiras na memória, qualquer que seja o tamanho do catálogo
+    campos = _campos(CAMPOS_DE_PRODUTO)
+    sentenca = (_filtra_produtos(_selecao(CAMPOS_DE_PRODUTO, campos), campos).
+                order_by(Produto.nome, Produto.id).
+                execution_options(yield_per=current_app.config.get('EXPORTACAO_BLOCO',
+                                                                   1000)))
+
+    def linhas():
+        for linha in db.session.execute(sentenca):
+            yield json.dumps(_serializa(linha, campos), ensure_ascii=False) + '\n'
+
+    resposta = current_app.response_class(stream_with_context(linhas()),
+                                          mimetype='application/x-ndjson')
+    resposta.headers['Content-Disposition'] = 'attachment; filename="produtos.ndjson"'
+    return resposta
@@ -1,14 +1,14 @@
 from urllib.parse import urlsplit
 
-import pyotp
-from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
+from flask import abort, Blueprint, current_app, flash, make_response, redirect, render_template, \
+    request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 from markupsafe import Markup
 
 from src.forms.auth import AskToResetPassword, LoginForm, ProfileForm, Read2FACodeForm, \
     RegistrationForm, SetNewPasswordForm
-from src.models.usuario import User
-from src.modules import db
+from src.models.usuario import FORMATOS_QRCODE, User
+from src.modules import db, metrics
 from src.utils import timestamp
 
 bp = Blueprint('auth', __name__, url_prefix='/admin/user')
@@ -25,6 +25,7 @@ def login():
         usuario = User.get_by_email(form.email.data)
 
         if usuario is None or not usuario.check_password(form.password.data):
+            metrics.conta('auth_logins_total', resultado='falha')
             flash("Email ou senha incorretos", category='warning')
             return redirect(url_for('auth.login'))
         if not usuario.ativo:
@@ -36,6 +37,12 @@ def login():
                          f"{url_for('auth.revalida_email', user_id=usuario.id)}\""
                          f">novo email de confirmacao</a>?"), category='warning')
             return redirect(url_for('auth.login'))
+        if usuario.precisa_rehash():
+            # A senha confere, o usuário pode entrar, mas a senha foi gravada
+            # com a política de hash antiga; aproveita a senha em texto claro,
+            # que só está disponível neste passo, para regravá-la com a atual
+            usuario.set_password(form.password.data)
+            db.session.commit()
         if usuario.usa_2fa:
             flash(f"Conclua o login para o usuário {usuario.email} digitando o "
                   f"código do segundo fator de autenticação", category='info')
@@ -45,6 +52,7 @@ def login():
                                     next=request.args.get('next')))
         login_user(usuario, remember=form.remember_me.data)
         db.session.commit()
+        metrics.conta('auth_logins_total', resultado='sucesso')
         flash(f"Usuario {usuario.email} logado", category='success')
         next_page = request.args.get('next')
         if not next_page or urlsplit(next_page).netloc != '':
@@ -64,11 +72,9 @@ def revalida_email(user_id):
                                user=usuario,
                                token=usuario.create_jwt_token('validate_email'),
                                host=current_app.config.get('APP_BASE_URL'))
-        if not usuario.send_email(subject="Revalide o seu email", body=body):
-            current_app.logger.warning("Email de revalidação para o usuario %s não "
-                                       "foi enviado", str(usuario.id))
-        else:
-            flash("Mensagem para validação do email enviada", category='info')
+        usuario.send_email(subject="Revalide o seu email", body=body)
+        db.session.commit()
+        flash("Mensagem para validação do email enviada", category='info')
     next_page = request.args.get('next')
     if not next_page or urlsplit(next_page).netloc != '':
         next_page = url_for('index')
@@ -123,9 +129,8 @@ def new_password():
                                    user=usuario,
                                    token=usuario.create_jwt_token('reset_password'),
                                    host=current_app.config.get('APP_BASE_URL'))
-            if not usuario.send_email(subject="Altere a sua senha", body=body):
-                current_app.logger.warning("Email de reset de senha para o usuario %s "
-                                           "não enviado", email)
+            usuario.send_email(subject="Altere a sua senha", body=body)
+            db.session.commit()
             return redirect(url_for('auth.login'))
         current_app.logger.warning("Pedido de reset de senha para usuário inexistente (%s)",
                                    email)
@@ -155,10 +160,7 @@ def register():
                                user=usuario,
                                token=usuario.create_jwt_token('validate_email'),
                                host=current_app.config.get('APP_BASE_URL'))
-        if not usuario.send_email(subject="Ative a sua conta",
-                                  body=body):
-            current_app.logger.warning("Email de ativação para o usuario %s não "
-                                       "enviado", str(usuario.id))
+        usuario.send_email(subject="Ative a sua conta", body=body)
         db.session.commit()
         flash("Cadastro efetuado com sucesso. Confirme o seu email antes de logar "
               "no sistema", category='success')
@@ -193,6 +195,8 @@ def profile():
         current_user.nome = form.nome.data
         if form.usa_2fa.data:
             if not current_user.usa_2fa:
+                import pyotp
+
                 current_user.otp_secret = pyotp.random_base32()
                 db.session.commit()
                 flash("Alterações efetuadas. Conclua a ativação do segundo fator de"
@@ -206,11 +210,9 @@ def profile():
                 current_user.dta_ativacao_2fa = None
                 body = render_template('auth/email/disable-2fa.jinja2',
                                        user=current_user)
-                if not current_user.send_email(
-                        subject="Desativação do segundo fator de autenticação",
-                        body=body):
-                    current_app.logger.warning("Email de desativação do 2FA para o usuario "
-                                               "%s não foi enviado", str(current_user.id))
+                current_user.send_email(
+                    subject="Desativação do segundo fator de autenticação",
+                    body=body)
         db.session.commit()
         flash("Alterações efetuas", category='success')
     return render_template('auth/user.jinja2',
@@ -229,12 +231,14 @@ def enable_2fa():
     form = Read2FACodeForm()
     if request.method == 'POST' and form.is_submitted():
         if current_user.verify_totp(form.codigo.data):
+            metrics.conta('auth_2fa_verificacoes_total', resultado='sucesso')
             # noinspection PyBroadException
             try:
                 current_user.usa_2fa = True
                 current_user.dta_ativacao_2fa = timestamp()
                 current_user.ultimo_otp = form.codigo.data
                 db.session.commit()
+                current_user.descarta_qrcode_totp()
                 flash("Segundo fator de autenticação ativado", category='success')
                 return redirect(url_for('auth.profile'))
             except Exception:
@@ -247,6 +251,7 @@ def enable_2fa():
                       category='danger')
                 return redirect(url_for('auth.profile'))
         else:  # codigo errado
+            metrics.conta('auth_2fa_verificacoes_total', resultado='falha')
             flash('O código informado está incorreto. Tente novamente.',
                   category='warning')
             return redirect(url_for('auth.enable_2fa'))
@@ -254,10 +259,26 @@ def enable_2fa():
     return render_template('auth/enable_2fa.jinja2',
                            title="Ativação do segundo fator de autenticação",
                            form=form,
-                           imagem=current_user.get_b64encoded_qr_totp_uri,
+                           formato=current_app.config.get('QRCODE_FORMATO', 'png'),
                            token=current_user.otp_secret_formatted)
 
 
+@bp.route('/enable_2fa/qrcode.<any(png, svg):formato>', methods=['GET'])
+@login_required
+def qrcode_2fa(formato):
+    # Não há QR code a exibir para quem já usa o 2FA ou ainda não gerou a chave
+    if current_user.usa_2fa or not current_user.otp_secret:
+        abort(404)
+    resposta = make_response(current_user.qrcode_totp(formato))
+    resposta.mimetype = FORMATOS_QRCODE[formato]
+    # A imagem contém a chave secreta: só o navegador do próprio usuário pode
+    # guardá-la, e por pouco tempo
+    resposta.cache_control.private = True
+    resposta.cache_control.max_age = current_app.config.get('QRCODE_CACHE_MAX_AGE', 300)
+    resposta.vary.add('Cookie')
+    return resposta
+
+
 @bp.route('/get2fa/<uuid:user_id>', methods=['GET', 'POST'])
 def get2fa(user_id):
     if current_user.is_authenticated:
@@ -279,11 +300,14 @@ def get2fa(user_id):
             login_user(usuario, remember=bool(remember_me))
             usuario.ultimo_otp = token
             db.session.commit()
+            metrics.conta('auth_2fa_verificacoes_total', resultado='sucesso')
+            metrics.conta('auth_logins_total', resultado='sucesso')
             if not next_page or urlsplit(next_page).netloc != '':
                 next_page = url_for('index')
             flash(f"Usuario {usuario.email} logado", category='success')
             return redirect(next_page)
         # Codigo errado
+        metrics.conta('auth_2fa_verificacoes_total', resultado='falha')
         flash("Código incorreto. Tente novamente", category='warning')
 
     return render_template('render_simple_slim_form.jinja2',
@@ -1,21 +1,39 @@
 import sqlalchemy as sa
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import login_required
+from sqlalchemy.orm import raiseload
 
 from src.forms.categoria import NovoEditCategoriaForm
 from src.models.categoria import Categoria
+from src.models.produto import Produto
 from src.modules import db
+from src.utils import get_condicional
 
 bp = Blueprint('categorias', __name__, url_prefix='/categoria')
 
 
 @bp.route('/lista', methods=['GET'])
 @bp.route('/', methods=['GET'])
+@get_condicional(Categoria, Produto)
 def lista():
-    sentenca = sa.select(Categoria)
+    # Os totais de cada categoria são calculados pelo banco em uma única
+    # consulta agregada. O acesso à lista de produtos é proibido (raiseload)
+    # para que o template não dispare uma consulta por categoria
+    # pylint: disable=not-callable
+    sentenca = (sa.select(Categoria,
+                          sa.func.count(Produto.id).label('qtd_produtos'),
+                          sa.func.coalesce(
+                              sa.func.sum(sa.case((Produto.ativo.is_(True), 1), else_=0)),
+                              0).label('qtd_ativos'),
+                          sa.func.coalesce(sa.func.sum(Produto.estoque), 0).label('total_estoque'),
+                          sa.func.coalesce(sa.func.sum(Produto.estoque * Produto.preco),
+                                           0).label('valor_estoque')).
+                outerjoin(Produto, Produto.categoria_id == Categoria.id).
+                group_by(Categoria.id).
+                options(raiseload(Categoria.lista_de_produtos)))
     sentenca = sentenca.order_by(Categoria.nome)
 
-    rset = db.session.execute(sentenca).scalars()
+    rset = db.session.execute(sentenca)
 
     return render_template('categoria/lista.jinja2',
                            title="Lista de categorias",
@@ -0,0 +1,384 @@
+import datetime
+import re
+import uuid
+
+import sqlalchemy as sa
+from flask import abort, Blueprint, current_app, flash, redirect, render_template, request, \
+    send_file, stream_with_context, url_for
+from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+
+from src.exportacao import comprime_gzip, consulta_de_estoque, gera_csv, gera_xlsx
+from src.forms.produto import ImportacaoForm, MovimentacaoEmLoteForm, NovoEditProdutoForm
+from src.models.categoria import Categoria
+from src.models.produto import ConflitoDeEstoque, FalhaDeLote, ItemDeLote, Produto
+from src.miniaturas import MIME as MIME_DAS_VARIANTES
+from src.modules import blobstore, db, importacoes, miniaturas
+from src.utils import get_condicional, pagina_keyset, tamanho_da_pagina
+
+bp = Blueprint('produtos', __name__, url_prefix='/produto')
+
+
+def opcoes_de_categoria():
+    sentenca = sa.select(Categoria.id, Categoria.nome).order_by(Categoria.nome)
+    return [(str(linha.id), linha.nome) for linha in db.session.execute(sentenca)]
+
+
+def preenche_produto(produto: Produto, form: NovoEditProdutoForm) -> bool:
+    produto.nome = form.nome.data
+    produto.preco = form.preco.data
+    produto.estoque = form.estoque.data
+    produto.estoque_minimo = form.estoque_minimo.data
+    produto.ativo = form.ativo.data
+    produto.categoria_id = uuid.UUID(form.categoria.data)
+    if form.foto.data:
+        if not produto.define_foto(form.foto.data.stream):
+            flash("O arquivo enviado não é uma imagem válida", category='warning')
+            return False
+    elif form.remover_foto.data:
+        produto.remove_foto()
+    return True
+
+
+def alterado_por_outro_usuario(id_produto):
+    flash("O produto foi alterado por outro usuário enquanto você o editava. "
+          "Confira os dados atuais e repita a alteração", category='warning')
+    return redirect(url_for('produtos.edit', id_produto=id_produto))
+
+
+def interpreta_lote(texto: str) -> tuple[list[ItemDeLote], list[FalhaDeLote]]:
+    itens, falhas = [], []
+    for numero, linha in enumerate(texto.splitlines(), start=1):
+        linha = linha.strip()
+        if not linha or linha.startswith('#'):
+            continue
+        partes = re.split(r'[;,\t ]+', linha)
+        if len(partes) != 2:
+            falhas.append(FalhaDeLote(numero, None, None, "Linha fora do formato esperado"))
+            continue
+        try:
+            produto_id = uuid.UUID(partes[0])
+        except ValueError:
+            falhas.append(FalhaDeLote(numero, None, None, "Identificador de produto inválido"))
+            continue
+        try:
+            delta = int(partes[1])
+        except ValueError:
+            falhas.append(FalhaDeLote(numero, produto_id, None, "Quantidade inválida"))
+            continue
+        if delta == 0:
+            falhas.append(FalhaDeLote(numero, produto_id, delta, "Quantidade igual a zero"))
+            continue
+        itens.append(ItemDeLote(numero, produto_id, delta))
+    return itens, falhas
+
+
+@bp.route('/lista', methods=['GET'])
+@bp.route('/', methods=['GET'])
+@get_condicional(Produto, Categoria)
+def lista():
+    tamanho = tamanho_da_pagina(request.args.get('tamanho'), 'PRODUTOS_POR_PAGINA')
+    sentenca = sa.select(Produto).options(joinedload(Produto.categoria))
+
+    try:
+        pagina = pagina_keyset(sentenca,
+                               [Produto.nome, Produto.id],
+                               apos=request.args.get('apos'),
+                               antes=request.args.get('antes'),
+                               tamanho=tamanho)
+    except ValueError as e:
+        current_app.logger.warning("Listagem de produtos: %s", e)
+        flash("Página inválida", category='warning')
+        return redirect(url_for('produtos.lista'))
+
+    return render_template('produto/lista.jinja2',
+                           title="Lista de produtos",
+                           pagina=pagina,
+                           tamanho=tamanho)
+
+
+@bp.route('/busca', methods=['GET'])
+@get_condicional(Produto, Categoria)
+def busca():
+    texto = request.args.get('q', '').strip()
+    tamanho = tamanho_da_pagina(request.args.get('tamanho'), 'PRODUTOS_POR_PAGINA')
+    try:
+        pagina = max(1, min(int(request.args.get('pagina', 1)),
+                            current_app.config.get('BUSCA_MAXIMO_PAGINAS', 50)))
+    except ValueError:
+        pagina = 1
+
+    produtos, tem_mais = Produto.busca(texto, pagina=pagina, tamanho=tamanho)
+
+    return render_template('produto/busca.jinja2',
+                           title="Busca de produtos",
+                           texto=texto,
+                           produtos=produtos,
+                           pagina=pagina,
+                           tem_mais=tem_mais,
+                           tamanho=tamanho)
+
+
+@bp.route('/em_falta', methods=['GET'])
+@get_condicional(Produto, Categoria)
+def em_falta():
+    tamanho = tamanho_da_pagina(request.args.get('tamanho'), 'PRODUTOS_POR_PAGINA')
+    sentenca = (sa.select(Produto).
+                where(Produto.em_falta()).
+                options(joinedload(Produto.categoria)))
+
+    filtro = {}
+    if categoria := request.args.get('categoria'):
+        try:
+            sentenca = sentenca.where(Produto.categoria_id == uuid.UUID(categoria))
+        except ValueError:
+            flash("Categoria inválida", category='warning')
+            return redirect(url_for('produtos.em_falta'))
+        filtro['categoria'] = categoria
+
+    try:
+        pagina = pagina_keyset(sentenca,
+                               [Produto.nome, Produto.id],
+                               apos=request.args.get('apos'),
+                               antes=request.args.get('antes'),
+                               tamanho=tamanho)
+    except ValueError as e:
+        current_app.logger.warning("Listagem de produtos em falta: %s", e)
+        flash("Página inválida", category='warning')
+        return redirect(url_for('produtos.em_falta', **filtro))
+
+    return render_template('produto/em_falta.jinja2',
+                           title="Produtos em falta",
+                           pagina=pagina,
+                           tamanho=tamanho,
+                           categorias=opcoes_de_categoria(),
+                           filtro=filtro)
+
+
+@bp.route('/novo', methods=['GET', 'POST'])
+@login_required
+def novo():
+    form = NovoEditProdutoForm()
+    form.categoria.choices = opcoes_de_categoria()
+    form.submit.label.text = "Adicionar"
+    del form.remover_foto
+    del form.versao
+    if form.validate_on_submit():
+        produto = Produto()
+        if preenche_produto(produto, form):
+            db.session.add(produto)
+            db.session.commit()
+            miniaturas.agenda(produto.id, produto.foto_hash)
+            flash(f"Produto \"{form.nome.data}\" adicionado", category='success')
+            return redirect(url_for('produtos.lista'))
+
+    return render_template('produto/form.jinja2',
+                           title="Adicionar novo produto",
+                           form=form)
+
+
+@bp.route('/edit/<uuid:id_produto>', methods=['GET', 'POST'])
+@login_required
+def edit(id_produto):
+    produto = Produto.get_by_id(id_produto)
+    if produto is None:
+        flash("Produto inexistente", category='warning')
+        return redirect(url_for('produtos.lista'))
+
+    form = NovoEditProdutoForm(obj=produto)
+    form.categoria.choices = opcoes_de_categoria()
+    form.submit.label.text = "Alterar"
+    if request.method == 'GET':
+        form.categoria.data = str(produto.categoria_id)
+        form.versao.data = str(produto.versao)
+
+    if form.validate_on_submit():
+        if form.versao.data != str(produto.versao):
+            # Formulário aberto antes de uma alteração feita por outro usuário;
+            # gravá-lo desfaria aquela alteração
+            return alterado_por_outro_usuario(id_produto)
+        foto_anterior = produto.foto_hash
+        if preenche_produto(produto, form):
+            try:
+                db.session.commit()
+            except StaleDataError:
+                db.session.rollback()
+                return alterado_por_outro_usuario(id_produto)
+            if produto.foto_hash != foto_anterior:
+                miniaturas.agenda(produto.id, produto.foto_hash)
+            flash(f"Produto \"{produto.nome}\" alterado", category='success')
+            return redirect(url_for('produtos.lista'))
+
+    return render_template('produto/form.jinja2',
+                           title="Alterar produto",
+                           form=form,
+                           produto=produto)
+
+
+@bp.route('/remove/<uuid:id_produto>', methods=['GET'])
+@login_required
+def remove(id_produto):
+    produto = Produto.get_by_id(id_produto)
+    if produto is None:
+        flash("Produto inexistente", category='warning')
+        return redirect(url_for('produtos.lista'))
+
+    old = produto.nome
+    db.session.delete(produto)
+    db.session.commit()
+    miniaturas.agenda(id_produto, None)
+    flash(f"Produto \"{old}\" removido", category='success')
+    return redirect(url_for('produtos.lista'))
+
+
+@bp.route('/lote', methods=['GET', 'POST'])
+@login_required
+def lote():
+    form = MovimentacaoEmLoteForm()
+    resultado = None
+    if form.validate_on_submit():
+        itens, falhas = interpreta_lote(form.linhas.data)
+        maximo = current_app.config.get('LOTE_MAXIMO_LINHAS', 5000)
+        if len(itens) > maximo:
+            flash(f"O lote pode ter no máximo {maximo} movimentações", category='warning')
+        else:
+            try:
+                aplicados, falhas_no_banco = Produto.aplica_lote(
+                    itens,
+                    tamanho_lote=current_app.config.get('LOTE_TAMANHO_BLOCO', 500),
+                    usuario_id=current_user.id,
+                    tentativas=current_app.config.get('LOTE_TENTATIVAS', 5))
+            except ConflitoDeEstoque as e:
+                current_app.logger.warning("Movimentação em lote: %s", e)
+                flash("O estoque foi alterado por outros usuários durante todas as tentativas "
+                      "de processamento. Nenhuma movimentação foi aplicada; envie o lote "
+                      "novamente", category='danger')
+            else:
+                falhas = sorted(falhas + falhas_no_banco)
+                resultado = dict(aplicados=aplicados, falhas=falhas)
+                flash(f"{aplicados} movimentações aplicadas e {len(falhas)} rejeitadas",
+                      category='success' if not falhas else 'warning')
+
+    return render_template('produto/lote.jinja2',
+                           title="Comprar/vender em lote",
+                           form=form,
+                           resultado=resultado)
+
+
+@bp.route('/importar', methods=['GET', 'POST'])
+@login_required
+def importar():
+    form = ImportacaoForm()
+    if form.validate_on_submit():
+        # O processamento continua em segundo plano; a página de
+        # acompanhamento mostra o andamento
+        importacao_id = importacoes.inicia(form.arquivo.data.stream,
+                                           atualizar=form.atualizar.data,
+                                           criar_categorias=form.criar_categorias.data)
+        flash("Arquivo recebido; a importação foi iniciada", category='info')
+        return redirect(url_for('produtos.importacao', importacao_id=importacao_id))
+
+    return render_template('render_simple_form.jinja2',
+                           title="Importar produtos",
+                           form=form)
+
+
+@bp.route('/importar/<string:importacao_id>', methods=['GET'])
+@login_required
+def importacao(importacao_id):
+    progresso = importacoes.situacao(importacao_id)
+    if progresso is None:
+        flash("Importação inexistente", category='warning')
+        return redirect(url_for('produtos.importar'))
+
+    return render_template('produto/importacao.jinja2',
+                           title="Importação de produtos",
+                           importacao_id=importacao_id,
+                           progresso=progresso)
+
+
+@bp.route('/importar/<string:importacao_id>/erros', methods=['GET'])
+@login_required
+def erros_da_importacao(importacao_id):
+    try:
+        caminho = importacoes.arquivo(importacao_id, 'erros.csv')
+    except ValueError:
+        abort(404)
+    if not caminho.is_file():
+        abort(404)
+    return send_file(caminho, mimetype='text/csv', as_attachment=True,
+                     download_name='erros.csv', max_age=0)
+
+
+@bp.route('/exportar/<string:formato>', methods=['GET'])
+@login_required
+def exportar(formato):
+    # A planilha é gerada enquanto as linhas são lidas do banco e enviada em
+    # pedaços (chunked), com memória constante qualquer que seja o catálogo
+    if formato not in ('csv', 'xlsx'):
+        abort(404)
+    sentenca = consulta_de_estoque(current_app.config.get('EXPORTACAO_BLOCO', 1000))
+
+    def linhas():
+        yield from db.session.execute(sentenca)
+
+    if formato == 'csv':
+        conteudo = gera_csv(linhas(), current_app.config.get('EXPORTACAO_CSV_SEPARADOR', ','))
+        mimetype = 'text/csv'
+    else:
+        conteudo = gera_xlsx(linhas())
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    # O XLSX já é um arquivo zip; comprimir de novo não reduz o tamanho
+    gzip = formato == 'csv' and bool(request.accept_encodings['gzip'])
+    if gzip:
+        conteudo = comprime_gzip(conteudo)
+    resposta = current_app.response_class(stream_with_context(conteudo), mimetype=mimetype)
+    if gzip:
+        resposta.content_encoding = 'gzip'
+    resposta.vary.add('Accept-Encoding')
+    resposta.headers['Content-Disposition'] = \
+        f'attachment; filename="estoque-{datetime.date.today().isoformat()}.{formato}"'
+    resposta.cache_control.no_store = True
+    return resposta
+
+
+@bp.route('/foto/<string:chave>', methods=['GET'])
+def foto(chave):
+    # A URL contém o hash do conteúdo, logo a resposta nunca muda: o hash é
+    # o ETag e o navegador pode manter a imagem em cache indefinidamente.
+    # O send_file trata If-None-Match (304) e requisições parciais (Range)
+    if not blobstore.existe(chave):
+        abort(404)
+    resposta = send_file(blobstore.caminho(chave),
+                         mimetype=blobstore.mime(chave),
+                         etag=chave,
+                         conditional=True,
+                         max_age=current_app.config.get('FOTO_CACHE_MAX_AGE', 31536000))
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+
+@bp.route('/foto/<uuid:id_produto>/<string:chave>/<string:variante>', methods=['GET'])
+def foto_variante(id_produto, chave, variante):
+    # Enquanto a variante ainda está sendo gerada, a foto original é servida
+    # com um cache curto, para que o navegador volte a pedir a variante depois
+    caminho = miniaturas.caminho(id_produto, chave, variante)
+    if caminho is None or not blobstore.existe(chave):
+        abort(404)
+    if not caminho.is_file():
+        return send_file(blobstore.caminho(chave),
+                         mimetype=blobstore.mime(chave),
+                         conditional=True,
+                         etag=False,
+                         max_age=current_app.config.get('MINIATURAS_ESPERA_MAX_AGE', 60))
+    resposta = send_file(caminho,
+                         mimetype=MIME_DAS_VARIANTES,
+                         etag=f"{chave}-{variante}",
+                         conditional=True,
+                         max_age=current_app.config.get('FOTO_CACHE_MAX_AGE', 31536000))
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
@@ -1,7 +1,16 @@
+import base64
 import datetime
+import functools
+import hashlib
+import json
+import re
 from pathlib import Path
+from typing import NamedTuple
 
 import pytz
+import sqlalchemy as sa
+
+from src.modules import db
 
 
 def existe_esquema(app) -> bool:
@@ -23,10 +32,65 @@ def existe_esquema(app) -> bool:
     #   target_metadata = Base.metada
 
 
+# Pragmas do SQLite que podem ser definidos em SQLITE_PRAGMAS na configuração.
+# Eles valem por conexão (exceto journal_mode=WAL, que fica gravado no arquivo)
+# e por isso são aplicados a cada nova conexão aberta pelo pool
+PRAGMAS_SQLITE = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout',
+                  'temp_store', 'foreign_keys', 'wal_autocheckpoint', 'journal_size_limit',
+                  'locking_mode', 'automatic_index', 'cache_spill')
+
+
+def configura_sqlite(app):
+    pragmas = app.config.get('SQLITE_PRAGMAS', {})
+    if db.engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    comandos = []
+    for nome, valor in pragmas.items():
+        if nome not in PRAGMAS_SQLITE:
+            app.logger.warning("Pragma do SQLite desconhecido ou não permitido: %s", nome)
+            continue
+        if isinstance(valor, bool):
+            valor = 'ON' if valor else 'OFF'
+        if not re.match(r'^-?\w+$', str(valor)):
+            app.logger.warning("Valor inválido para o pragma %s: %r", nome, valor)
+            continue
+        comandos.append(f"PRAGMA {nome}={valor}")
+
+    # noinspection PyUnusedLocal
+    def aplica_pragmas(conexao_dbapi, registro):  # pylint: disable=unused-argument
+        cursor = conexao_dbapi.cursor()
+        for comando in comandos:
+            cursor.execute(comando)
+        cursor.close()
+
+    sa.event.listen(db.engine, 'connect', aplica_pragmas)
+
+    with db.engine.connect() as conexao:
+        efetivos = []
+        for nome in pragmas:
+            if nome in PRAGMAS_SQLITE:
+                valor = conexao.exec_driver_sql(f"PRAGMA {nome}").scalar()
+                efetivos.append(f"{nome}={valor}")
+    app.logger.info("SQLite configurado com %s", ", ".join(efetivos))
+
+
 def timestamp():
     return datetime.datetime.now(tz=pytz.timezone('UTC'))
 
 
+def em_blocos(itens, tamanho: int):
+    """Agrupa os itens de um iterável em listas de até 'tamanho' itens."""
+    bloco = []
+    for item in itens:
+        bloco.append(item)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
 # Formatando as datas para horário local
 # https://stackoverflow.com/q/65359968
 def as_localtime(data_em_utc) -> str | datetime.date:
@@ -43,3 +107,131 @@ def as_localtime(data_em_utc) -> str | datetime.date:
     except Exception as e:
         current_app.logger.warning("as_localtime: Exception %s", e)
         return data_em_utc
+
+
+class Pagina(NamedTuple):
+    itens: list
+    anterior: str | None
+    proximo: str | None
+
+
+def codifica_cursor(valores) -> str:
+    texto = json.dumps([str(valor) for valor in valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodifica_cursor(cursor: str, colunas) -> list:
+    # Os valores do cursor são convertidos de volta para o tipo Python de
+    # cada coluna, para que o SQLAlchemy aplique o processamento correto
+    # (UUID, Decimal, datas) na comparação
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valores = json.loads(texto)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor de paginação inválido") from e
+    if not isinstance(valores, list) or len(valores) != len(colunas):
+        raise ValueError("Cursor de paginação inválido")
+    convertidos = []
+    for valor, coluna in zip(valores, colunas):
+        tipo = coluna.type.python_type
+        if tipo in (datetime.datetime, datetime.date):
+            convertidos.append(tipo.fromisoformat(valor))
+        else:
+            convertidos.append(tipo(valor))
+    return convertidos
+
+
+def tamanho_da_pagina(solicitado, padrao: str = 'PAGINACAO_PADRAO') -> int:
+    from flask import current_app
+    maximo = current_app.config.get('PAGINACAO_MAXIMA', 100)
+    try:
+        tamanho = int(solicitado)
+    except (TypeError, ValueError):
+        tamanho = current_app.config.get(padrao, 25)
+    return max(1, min(tamanho, maximo))
+
+
+def pagina_keyset(sentenca,
+                  colunas,
+                  apos: str | None = None,
+                  antes: str | None = None,
+                  tamanho: int = 25,
+                  escalares: bool = True) -> Pagina:
+    # Paginação por cursor (keyset): em vez de OFFSET, a consulta continua a
+    # partir dos valores das colunas de ordenação do último registro visto.
+    # Com um índice composto sobre as colunas o custo de qualquer página é o
+    # mesmo, pois o banco posiciona no índice e lê apenas 'tamanho' linhas.
+    chave = sa.tuple_(*colunas)
+    if antes:
+        valores = decodifica_cursor(antes, colunas)
+        sentenca = sentenca.where(chave < sa.tuple_(*valores))
+        sentenca = sentenca.order_by(*[coluna.desc() for coluna in colunas])
+    else:
+        if apos:
+            valores = decodifica_cursor(apos, colunas)
+            sentenca = sentenca.where(chave > sa.tuple_(*valores))
+        sentenca = sentenca.order_by(*colunas)
+    sentenca = sentenca.limit(tamanho + 1)
+
+    resultado = db.session.execute(sentenca)
+    itens = list(resultado.scalars() if escalares else resultado)
+    tem_mais = len(itens) > tamanho
+    itens = itens[:tamanho]
+
+    def cursor_de(item):
+        return codifica_cursor([getattr(item, coluna.key) for coluna in colunas])
+
+    if antes:
+        itens.reverse()
+        anterior = cursor_de(itens[0]) if itens and tem_mais else None
+        proximo = cursor_de(itens[-1]) if itens else None
+    else:
+        anterior = cursor_de(itens[0]) if itens and apos else None
+        proximo = cursor_de(itens[-1]) if itens and tem_mais else None
+    return Pagina(itens, anterior, proximo)
+
+
+def get_condicional(*modelos):
+    """
+    Responde 304 sem executar a view quando o cliente já tem a versão atual
+    da página. O validador é o número de linhas e a última dta_atualizacao
+    de cada modelo (TimeStampMixin) de que a página depende, mais o usuário
+    logado e a sua dta_atualizacao, já que a barra de navegação muda com
+    ele. Apenas o ETag é enviado: um Last-Modified, com a resolução de um
+    segundo do HTTP e sem mudar quando uma linha é removida, daria 304 a
+    páginas alteradas
+    """
+    from flask import current_app, make_response, request, session
+    from flask_login import current_user
+    from werkzeug.http import is_resource_modified
+
+    def decorador(view):
+        @functools.wraps(view)
+        def envolvida(*args, **kwargs):
+            # Mensagens pendentes fazem parte da página e são consumidas por ela
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            marcas = [modelo.marca_de_alteracao() for modelo in modelos]
+            if current_user.is_authenticated:
+                usuario = (current_user.get_id(), current_user.dta_atualizacao)
+            else:
+                usuario = 'anonimo'
+            etag = hashlib.sha1(repr((usuario, marcas)).encode()).hexdigest()
+
+            if is_resource_modified(request.environ, etag=etag):
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+            else:
+                resposta = current_app.response_class(status=304)
+            resposta.set_etag(etag)
+            # O navegador guarda a página, mas precisa revalidá-la a cada acesso
+            resposta.cache_control.no_cache = True
+            resposta.cache_control.private = current_user.is_authenticated
+            resposta.vary.add('Cookie')
+            return resposta
+
+        return envolvida
+
+    return decorador
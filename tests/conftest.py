@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+
+from src.factory import create_app
+from src.modules import db
+
+CONFIG_DE_EXEMPLO = Path(__file__).parent.parent / 'instance' / 'config.sample.json'
+
+
+@pytest.fixture
+def app(tmp_path, request):
+    # Configuração de exemplo com o banco e os diretórios gravados em
+    # tmp_path, sem tocar em instance/. Os testes podem alterar outras
+    # chaves com @pytest.mark.parametrize('app', [{...}], indirect=True)
+    banco = tmp_path / 'teste.sqlite3'
+    uri = f"sqlite+pysqlite:///{banco}"
+    config = json.loads(CONFIG_DE_EXEMPLO.read_text(encoding='utf-8'))
+    config.update(SQLITE_DB_NAME=str(banco),
+                  SECRET_KEY='chave-dos-testes-com-ao-menos-32-bytes',
+                  SQLALCHEMY_DATABASE_URI=uri,
+                  TESTING=True,
+                  WTF_CSRF_ENABLED=False,
+                  PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+                  ASSETS=False,
+                  MINIFY=False,
+                  JINJA_BYTECODE_CACHE=None,
+                  FRAGMENT_CACHE=False,
+                  METRICS=False,
+                  PROFILING=False,
+                  EMAIL_OUTBOX_WORKERS=0,
+                  MAIL_BACKEND='locmem',
+                  MINIATURAS_PROCESSOS=0,
+                  BLOBSTORE_DIR=str(tmp_path / 'blobs'),
+                  IMPORTACAO_DIR=str(tmp_path / 'importacoes'))
+    config.update(getattr(request, 'param', {}))
+    arquivo = tmp_path / 'config.json'
+    arquivo.write_text(json.dumps(config), encoding='utf-8')
+
+    # A aplicação se recusa a iniciar sem o banco, então o esquema é criado
+    # antes dela
+    motor = sa.create_engine(uri)
+    db.metadata.create_all(motor)
+    motor.dispose()
+
+    aplicacao = create_app(str(arquivo))
+    with aplicacao.app_context():
+        db.create_all()
+    yield aplicacao
+    with aplicacao.app_context():
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,51 @@
+import uuid
+
+from src.models.usuario import User
+from src.modules import db
+
+
+def _cadastra_usuario(ativo: bool = True) -> uuid.UUID:
+    usuario = User(nome="Integração", email=f"{uuid.uuid4().hex}@exemplo.com.br",
+                   ativo=ativo, email_validado=True)
+    usuario.set_password("segredo")
+    db.session.add(usuario)
+    db.session.commit()
+    return usuario.id
+
+
+def test_api_exige_sessao_ou_token(app):
+    cliente = app.test_client()
+    resposta = cliente.get('/api/v1/categorias')
+    assert resposta.status_code == 401
+    assert resposta.json['status'] == 401
+
+    resposta = cliente.get('/api/v1/categorias', headers={'Authorization': "Bearer invalido"})
+    assert resposta.status_code == 401
+
+
+def test_api_aceita_token_bearer(app):
+    with app.app_context():
+        usuario = db.session.get(User, _cadastra_usuario())
+        token = usuario.create_jwt_token('api')
+        outra_acao = usuario.create_jwt_token('reset_password')
+        desativado = db.session.get(User, _cadastra_usuario(ativo=False)).create_jwt_token('api')
+
+    cliente = app.test_client()
+    resposta = cliente.get('/api/v1/categorias', headers={'Authorization': f"Bearer {token}"})
+    assert resposta.status_code == 200
+    # O token não abre uma sessão
+    assert cliente.get('/api/v1/categorias').status_code == 401
+    for recusado in (outra_acao, desativado):
+        resposta = cliente.get('/api/v1/categorias',
+                               headers={'Authorization': f"Bearer {recusado}"})
+        assert resposta.status_code == 401
+
+
+def test_comando_emite_token(app):
+    with app.app_context():
+        email = db.session.get(User, _cadastra_usuario()).email
+    resultado = app.test_cli_runner().invoke(args=['usuarios', 'token', email, '--dias', '1'])
+    assert resultado.exit_code == 0, resultado.output
+    with app.app_context():
+        usuario, action = User.verify_jwt_token(resultado.output.strip())
+        assert (usuario.email, action) == (email, 'api')
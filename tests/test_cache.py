@@ -0,0 +1,35 @@
+from src.models.usuario import User
+from src.modules import db, user_cache
+
+
+def _cadastra() -> User:
+    usuario = User(nome="Original", email="fulano@exemplo.com.br", ativo=True)
+    usuario.set_password("segredo")
+    db.session.add(usuario)
+    db.session.commit()
+    return usuario
+
+
+def test_usuario_removido_do_cache_apenas_no_commit(app):
+    with app.app_context():
+        user_id = _cadastra().id
+        db.session.remove()
+        user_cache.get(user_id)
+        assert user_cache.cache.get(user_id) is not None
+
+        usuario = db.session.get(User, user_id)
+        usuario.nome = "Desfeito"
+        db.session.flush()
+        # Gravado mas não confirmado: o cache continua com a versão do banco
+        assert user_cache.cache.get(user_id).nome == "Original"
+        db.session.rollback()
+        assert user_cache.cache.get(user_id).nome == "Original"
+        db.session.commit()
+        assert user_cache.cache.get(user_id) is not None
+
+        usuario = db.session.get(User, user_id)
+        usuario.nome = "Confirmado"
+        db.session.commit()
+        assert user_cache.cache.get(user_id) is None
+        db.session.remove()
+        assert user_cache.get(user_id).nome == "Confirmado"
@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+import sqlalchemy as sa
+
+from src.models.categoria import Categoria
+from src.models.produto import Produto
+from src.modules import db
+
+
+def _cadastra(primeira: int, quantidade_de_categorias: int, produtos_por_categoria: int):
+    for numero in range(primeira, primeira + quantidade_de_categorias):
+        categoria = Categoria(nome=f"Categoria {numero:04d}")
+        categoria.lista_de_produtos = [
+            Produto(nome=f"Produto {numero:04d}-{sequencia:03d}",
+                    preco=Decimal('9.90'),
+                    estoque=sequencia,
+                    ativo=sequencia % 2 == 0)
+            for sequencia in range(produtos_por_categoria)
+        ]
+        db.session.add(categoria)
+    db.session.commit()
+
+
+def _comandos_da_lista(app) -> tuple[int, str]:
+    comandos = []
+
+    # noinspection PyUnusedLocal
+    # pylint: disable-next=unused-argument
+    def registra(conexao, cursor, sentenca, parametros, contexto, executemany):
+        comandos.append(sentenca)
+
+    with app.app_context():
+        motor = db.engine
+    sa.event.listen(motor, 'before_cursor_execute', registra)
+    try:
+        resposta = app.test_client().get('/categoria/')
+    finally:
+        sa.event.remove(motor, 'before_cursor_execute', registra)
+    assert resposta.status_code == 200
+    return len(comandos), resposta.get_data(as_text=True)
+
+
+def test_lista_de_categorias_com_consultas_constantes(app):
+    with app.app_context():
+        _cadastra(0, 3, 2)
+    poucas, pagina = _comandos_da_lista(app)
+    assert "Categoria 0002" in pagina
+
+    # Dez vezes mais categorias, com mais produtos em cada uma
+    with app.app_context():
+        _cadastra(3, 27, 5)
+    muitas, pagina = _comandos_da_lista(app)
+    assert "Categoria 0029" in pagina
+
+    assert muitas == poucas
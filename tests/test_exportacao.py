@@ -0,0 +1,32 @@
+import csv
+import io
+import uuid
+import zipfile
+from decimal import Decimal
+
+from src.exportacao import gera_csv, gera_xlsx
+
+PERIGOSOS = ["=HYPERLINK(\"http://exemplo.com\")", "+1+1", "-2+3", "@SOMA(A1)",
+             "\tTAB", "\rCR"]
+
+
+def _linhas():
+    return [(uuid.uuid4(), nome, "Categoria", Decimal('-1.50'), -3, 0, True)
+            for nome in PERIGOSOS]
+
+
+def test_csv_neutraliza_formulas():
+    conteudo = b''.join(gera_csv(_linhas())).decode('utf-8-sig')
+    _, *linhas = csv.reader(io.StringIO(conteudo, newline=''))
+    assert [linha[1] for linha in linhas] == ["'" + nome for nome in PERIGOSOS]
+    # Os números negativos continuam números
+    assert {(linha[3], linha[4]) for linha in linhas} == {('-1.50', '-3')}
+
+
+def test_xlsx_grava_textos_como_inline_strings():
+    planilha = io.BytesIO(b''.join(gera_xlsx(_linhas())))
+    with zipfile.ZipFile(planilha) as arquivo:
+        xml = arquivo.read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert '<f>' not in xml
+    assert '<c t="inlineStr"><is><t xml:space="preserve">=HYPERLINK("' in xml
+    assert '<c><v>-1.50</v></c>' in xml
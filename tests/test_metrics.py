@@ -0,0 +1,20 @@
+import pytest
+
+
+def _status(app, remoto: str = '127.0.0.1', **cabecalhos) -> int:
+    return app.test_client().get('/metrics', headers=cabecalhos,
+                                 environ_base={'REMOTE_ADDR': remoto}).status_code
+
+
+@pytest.mark.parametrize('app', [{'METRICS': True}], indirect=True)
+def test_metrics_recusa_sem_configuracao(app):
+    assert _status(app) == 403
+
+
+@pytest.mark.parametrize('app', [{'METRICS': True, 'METRICS_IPS': ['10.0.0.0/8'],
+                                  'METRICS_TOKEN': 'segredo'}], indirect=True)
+def test_metrics_por_endereco_ou_token(app):
+    assert _status(app, '10.1.2.3') == 200
+    assert _status(app) == 403
+    assert _status(app, Authorization="Bearer outro") == 403
+    assert _status(app, Authorization="Bearer segredo") == 200
@@ -0,0 +1,98 @@
+import smtplib
+from datetime import timedelta
+
+import pytest
+import sqlalchemy as sa
+from flask import current_app
+from flask_mailman.backends import locmem
+
+from src.models.email_pendente import EmailPendente
+from src.modules import db, outbox
+from src.utils import timestamp
+
+
+@pytest.fixture(name='caixa')
+def _caixa(app):
+    # O backend locmem guarda as mensagens enviadas no estado da extensão
+    estado = app.extensions['mailman']
+    estado.outbox = []
+    with app.app_context():
+        yield estado.outbox
+
+
+def _mensagens() -> list[EmailPendente]:
+    db.session.expire_all()
+    return list(db.session.execute(sa.select(EmailPendente).order_by(EmailPendente.id)).scalars())
+
+
+def _agora():
+    return timestamp().replace(tzinfo=None)
+
+
+def test_mensagem_gravada_com_a_transacao(caixa):
+    outbox.enfileira(["desfeito@exemplo.com.br"], "Desfeito", "corpo")
+    db.session.rollback()
+    assert not _mensagens()
+
+    outbox.enfileira(["fulano@exemplo.com.br"], "Bem-vindo", "corpo")
+    db.session.commit()
+    assert [mensagem.situacao for mensagem in _mensagens()] == [EmailPendente.PENDENTE]
+
+    assert outbox.processa_lote() == 1
+    assert [email.to for email in caixa] == [["fulano@exemplo.com.br"]]
+    assert caixa[0].subject == f"[{current_app.config['APP_NAME']}] Bem-vindo"
+    mensagem, = _mensagens()
+    assert (mensagem.situacao, mensagem.tentativas) == (EmailPendente.ENVIADO, 1)
+    assert outbox.processa_lote() == 0
+
+
+def test_falhas_reagendadas_com_espera_exponencial(caixa, monkeypatch):
+    def falha(self, mensagens):  # pylint: disable=unused-argument
+        raise smtplib.SMTPException("servidor indisponível")
+
+    monkeypatch.setattr(locmem.EmailBackend, 'send_messages', falha)
+    outbox.enfileira(["fulano@exemplo.com.br"], "Assunto", "corpo")
+    db.session.commit()
+
+    maximo = current_app.config['EMAIL_OUTBOX_MAX_TENTATIVAS']
+    for tentativa in range(1, maximo):
+        antes = _agora()
+        assert outbox.processa_lote() == 0
+        mensagem, = _mensagens()
+        assert (mensagem.situacao, mensagem.tentativas) == (EmailPendente.PENDENTE, tentativa)
+        assert "servidor indisponível" in mensagem.ultimo_erro
+        espera = current_app.config['EMAIL_OUTBOX_ESPERA'] * 2 ** (tentativa - 1)
+        assert abs((mensagem.proxima_tentativa - antes).total_seconds() - espera) < 5
+        # Antes do prazo, a mensagem não é reservada de novo
+        assert outbox.processa_lote() == 0
+        assert _mensagens()[0].tentativas == tentativa
+        mensagem.proxima_tentativa = _agora()
+        db.session.commit()
+
+    assert outbox.processa_lote() == 0
+    mensagem, = _mensagens()
+    assert (mensagem.situacao, mensagem.tentativas) == (EmailPendente.FALHOU, maximo)
+    assert not caixa
+
+
+def test_reserva_abandonada_conta_como_tentativa(caixa):
+    maximo = current_app.config['EMAIL_OUTBOX_MAX_TENTATIVAS']
+    expirada = _agora() - timedelta(seconds=current_app.config['EMAIL_OUTBOX_RESERVA'] + 1)
+    outbox.enfileira(["ainda@exemplo.com.br"], "Ainda dá", "corpo")
+    outbox.enfileira(["envenenada@exemplo.com.br"], "Envenenada", "corpo")
+    db.session.flush()
+    # Duas reservas de workers que morreram no meio do envio: uma ainda tem
+    # uma tentativa, a outra já usou todas
+    ainda, envenenada = _mensagens()
+    for mensagem, tentativas in ((ainda, maximo - 1), (envenenada, maximo)):
+        mensagem.situacao = EmailPendente.ENVIANDO
+        mensagem.reservado_por = 'worker-morto'
+        mensagem.dta_reserva = expirada
+        mensagem.tentativas = tentativas
+    db.session.commit()
+
+    assert outbox.processa_lote() == 1
+    assert [email.to for email in caixa] == [["ainda@exemplo.com.br"]]
+    ainda, envenenada = _mensagens()
+    assert (ainda.situacao, ainda.tentativas) == (EmailPendente.ENVIADO, maximo)
+    assert (envenenada.situacao, envenenada.tentativas) == (EmailPendente.FALHOU, maximo)
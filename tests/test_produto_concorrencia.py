@@ -0,0 +1,140 @@
+import random
+import threading
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+
+from src.models.categoria import Categoria
+from src.models.movimento import Movimento
+from src.models.produto import ConflitoDeEstoque, ItemDeLote, Produto
+from src.modules import db
+
+THREADS = 8
+OPERACOES = 25
+ESTOQUE_INICIAL = 10_000
+
+
+def _cadastra_produtos(quantidade: int) -> list:
+    categoria = Categoria(nome="Concorrência")
+    categoria.lista_de_produtos = [Produto(nome=f"Disputado {numero}",
+                                           preco=Decimal('1.00'),
+                                           estoque=ESTOQUE_INICIAL,
+                                           ativo=True)
+                                   for numero in range(quantidade)]
+    db.session.add(categoria)
+    db.session.commit()
+    return [produto.id for produto in categoria.lista_de_produtos]
+
+
+def _estoques(ids: list) -> dict:
+    return dict(db.session.execute(
+        sa.select(Produto.id, Produto.estoque).where(Produto.id.in_(ids))).all())
+
+
+def _em_paralelo(app, tarefa) -> list:
+    # Cada thread tem a sua própria sessão (scoped_session) e conexão
+    largada = threading.Barrier(THREADS)
+    resultados = [{} for _ in range(THREADS)]
+    erros = []
+
+    def executa(numero: int):
+        try:
+            with app.app_context():
+                largada.wait()
+                resultados[numero] = tarefa(numero)
+                db.session.remove()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            erros.append(e)
+
+    threads = [threading.Thread(target=executa, args=(numero,)) for numero in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not erros, erros
+    return resultados
+
+
+def test_movimenta_sem_perder_atualizacoes(app):
+    with app.app_context():
+        ids = _cadastra_produtos(2)
+
+    def compra_e_vende(numero: int) -> dict:
+        aleatorio = random.Random(numero)
+        aplicados = dict.fromkeys(ids, 0)
+        for _ in range(OPERACOES):
+            produto_id = aleatorio.choice(ids)
+            delta = aleatorio.choice((-3, -2, -1, 1, 2, 3))
+            try:
+                Produto.movimenta(produto_id, delta, origem='teste', tentativas=50)
+            except ConflitoDeEstoque:
+                continue
+            aplicados[produto_id] += delta
+        return aplicados
+
+    resultados = _em_paralelo(app, compra_e_vende)
+
+    with app.app_context():
+        estoques = _estoques(ids)
+        for produto_id in ids:
+            aplicado = sum(resultado[produto_id] for resultado in resultados)
+            assert estoques[produto_id] == ESTOQUE_INICIAL + aplicado
+        assert not db.session.execute(Movimento.divergencias(completo=True)).all()
+
+
+def test_lote_repete_os_conflitos(app):
+    with app.app_context():
+        ids = _cadastra_produtos(3)
+
+    def aplica(numero: int) -> dict:
+        aleatorio = random.Random(numero)
+        aplicados = dict.fromkeys(ids, 0)
+        for _ in range(OPERACOES // 5):
+            itens = [ItemDeLote(linha, aleatorio.choice(ids), aleatorio.choice((-2, -1, 1, 2)))
+                     for linha in range(1, 6)]
+            try:
+                _, falhas = Produto.aplica_lote(itens, tentativas=50)
+            except ConflitoDeEstoque:
+                continue
+            assert not falhas
+            for item in itens:
+                aplicados[item.produto_id] += item.delta
+        return aplicados
+
+    resultados = _em_paralelo(app, aplica)
+
+    with app.app_context():
+        estoques = _estoques(ids)
+        for produto_id in ids:
+            aplicado = sum(resultado[produto_id] for resultado in resultados)
+            assert estoques[produto_id] == ESTOQUE_INICIAL + aplicado
+        assert not db.session.execute(Movimento.divergencias(completo=True)).all()
+
+
+def test_lote_so_desiste_depois_das_tentativas(app, monkeypatch):
+    with app.app_context():
+        ids = _cadastra_produtos(1)
+        original = Produto.movimenta_em_lote.__func__
+        chamadas = []
+
+        def em_conflito_na_primeira(cls, *args, **kwargs):
+            chamadas.append(1)
+            resultado = original(cls, *args, **kwargs)
+            if len(chamadas) == 1:
+                raise ConflitoDeEstoque("conflito simulado")
+            return resultado
+
+        monkeypatch.setattr(Produto, 'movimenta_em_lote', classmethod(em_conflito_na_primeira))
+        aplicados, falhas = Produto.aplica_lote([ItemDeLote(1, ids[0], -5)], espera=0)
+        assert (aplicados, falhas, len(chamadas)) == (1, [], 2)
+        # A primeira tentativa foi desfeita: a venda foi aplicada uma única vez
+        assert _estoques(ids)[ids[0]] == ESTOQUE_INICIAL - 5
+        assert not db.session.execute(Movimento.divergencias(completo=True)).all()
+
+        def sempre_em_conflito(cls, *args, **kwargs):  # pylint: disable=unused-argument
+            raise ConflitoDeEstoque("conflito simulado")
+
+        monkeypatch.setattr(Produto, 'movimenta_em_lote', classmethod(sempre_em_conflito))
+        with pytest.raises(ConflitoDeEstoque, match="3 tentativas"):
+            Produto.aplica_lote([ItemDeLote(1, ids[0], -5)], tentativas=3, espera=0)
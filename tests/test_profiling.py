@@ -0,0 +1,23 @@
+import pytest
+import sqlalchemy as sa
+
+from src.modules import db
+
+
+@pytest.mark.parametrize('app', [{'PROFILING': True}], indirect=True)
+def test_consulta_com_erro_nao_afeta_a_medicao(app):
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        with pytest.raises(sa.exc.OperationalError):
+            db.session.execute(sa.text("SELECT * FROM tabela_inexistente"))
+        db.session.rollback()
+        db.session.execute(sa.text("SELECT 1"))
+        resposta = app.process_response(app.response_class())
+    assert 'desc="1 consultas"' in resposta.headers['Server-Timing']
+
+
+@pytest.mark.parametrize('app, status', [({'PROFILING': True}, 404),
+                                         ({'PROFILING': True, 'DEBUG': True}, 302)],
+                         indirect=['app'])
+def test_totais_so_no_modo_de_depuracao(app, status):
+    assert app.test_client().get('/profiling').status_code == status
@@ -0,0 +1,47 @@
+import pytest
+
+from src.models.usuario import User
+from src.modules import db
+
+SENHA = "segredo"
+
+
+def _cadastra(app, **campos) -> str:
+    with app.app_context():
+        usuario = User(nome="Fulano", email="fulano@exemplo.com.br", email_validado=True,
+                       **{'ativo': True, **campos})
+        usuario.set_password(SENHA)
+        db.session.add(usuario)
+        db.session.commit()
+        return usuario.password_hash
+
+
+def _entra(app):
+    return app.test_client().post('/admin/user/login', data={'email': "fulano@exemplo.com.br",
+                                                       'password': SENHA})
+
+
+def _hash_gravado(app) -> str:
+    with app.app_context():
+        return User.get_by_email("fulano@exemplo.com.br").password_hash
+
+
+@pytest.mark.parametrize('politica', [{'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:2000'},
+                                      {'PASSWORD_HASH_SALT_LENGTH': 24}])
+def test_login_refaz_o_hash_da_politica_antiga(app, politica):
+    antigo = _cadastra(app)
+    app.config.update(politica)
+    _entra(app)
+    novo = _hash_gravado(app)
+    assert novo != antigo
+    with app.app_context():
+        usuario = User.get_by_email("fulano@exemplo.com.br")
+        assert usuario.check_password(SENHA)
+        assert not usuario.precisa_rehash()
+
+
+def test_login_recusado_nao_refaz_o_hash(app):
+    antigo = _cadastra(app, ativo=False)
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    _entra(app)
+    assert _hash_gravado(app) == antigo